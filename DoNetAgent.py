@@ -1,5 +1,29 @@
-from netmiko import ConnectHandler
-from typing import List, Optional
+import socket
+import time
+from netmiko import ConnectHandler, NetmikoAuthenticationException, NetmikoTimeoutException
+from typing import Any, Callable, List, Optional
+from metrics import SSH_CONNECT_DURATION, SSH_COMMAND_DURATION, OUTPUT_BYTES
+from tracing import span
+from inventory import device_key
+from ssh_probe import get_warm_sockets
+
+# Failures of a login over a warm probe socket that a fresh connection may not hit: the device
+# dropped the idle connection. Authentication failures are never retried (AAA lockout).
+WARM_SOCKET_TRANSPORT_ERRORS = (EOFError, socket.error, NetmikoTimeoutException)
+
+# Output markers of a failed configuration change: our own error messages and IOS-style CLI errors
+ERROR_MARKERS = ("Error executing", "% Invalid", "% Incomplete", "% Ambiguous", "% Unknown")
+
+# Factory opening device connections; stand-ins (e.g. fake_device) replace it in benchmarks
+_connection_factory: Callable[..., Any] = ConnectHandler
+
+def configure_connection_factory(factory: Optional[Callable[..., Any]]) -> None:
+    """Replaces the factory used to open device connections.
+
+    :param factory: Callable accepting Netmiko's ConnectHandler arguments; None restores ConnectHandler.
+    """
+    global _connection_factory
+    _connection_factory = factory or ConnectHandler
 
 class NetAgent:
     """
@@ -46,8 +70,26 @@ class NetAgent:
             'port': port,
             'secret': secret or password,  # Use password as secret if not provided
         }
-        self.conn = ConnectHandler(**self.device)
-        self.conn.enable()  # Enter privileged mode if possible
+        started = time.perf_counter()
+        with span("ssh.connect", host=host, device_type=device_type):
+            # A socket left by an SSH reachability probe saves the TCP handshake
+            sock = get_warm_sockets().take(device_key(host, port))
+            if sock is not None:
+                try:
+                    self.conn = _connection_factory(**self.device, sock=sock)
+                except NetmikoAuthenticationException:
+                    sock.close()
+                    raise
+                except WARM_SOCKET_TRANSPORT_ERRORS:
+                    sock.close()  # The device may have dropped the idle connection; connect afresh
+                    self.conn = _connection_factory(**self.device)
+                except BaseException:
+                    sock.close()
+                    raise
+            else:
+                self.conn = _connection_factory(**self.device)
+            self.conn.enable()  # Enter privileged mode if possible
+        SSH_CONNECT_DURATION.labels(device_type=device_type).observe(time.perf_counter() - started)
 
     def execute_show(self, command: str) -> str:
         """
@@ -60,10 +102,13 @@ class NetAgent:
         """
         try:
 
-            hostname = self.conn.find_prompt().split('@')[1].split('#')[0]
+            # Prompts look like "user@hostname#" on wbos and "hostname#" on IOS-like devices
+            hostname = self.conn.find_prompt().split('@')[-1].rstrip('#>')
             print(f"Connected to {hostname}")
 
-            result = self.conn.send_command(command)
+            with span("ssh.show", command=command), SSH_COMMAND_DURATION.labels(kind="show").time():
+                result = self.conn.send_command(command)
+            OUTPUT_BYTES.labels(source="show").observe(len(result.encode("utf-8")))
             return result
         except Exception as e:
             return f"Error executing show command: {str(e)}"
@@ -79,17 +124,88 @@ class NetAgent:
         :return: The output from the configuration session as a string.
         """
         try:
-            self.conn.config_mode()
-            result = self.conn.send_config_set(commands)
-            self.conn.commit()  # Commit changes if device supports it (e.g., Juniper); otherwise, save config
-            self.conn.exit_config_mode()
-            # For Cisco-like devices, save the config
-            if 'cisco' in self.device['device_type']:
-                self.conn.save_config()
+            with span("ssh.set", commands=len(commands)), SSH_COMMAND_DURATION.labels(kind="set").time():
+                self.conn.config_mode()
+                result = self.conn.send_config_set(commands)
+                try:
+                    self.conn.commit()  # Commit changes if device supports it (e.g., Juniper); otherwise, save config
+                except AttributeError:
+                    pass  # Netmiko raises AttributeError for platforms without commit (e.g. cisco_ios)
+                self.conn.exit_config_mode()
+                # For Cisco-like devices, save the config
+                if 'cisco' in self.device['device_type']:
+                    self.conn.save_config()
+            OUTPUT_BYTES.labels(source="set").observe(len(result.encode("utf-8")))
             return result
         except Exception as e:
             return f"Error executing set commands: {str(e)}"
 
+    def execute_set_batch(self, changes: List[List[str]]) -> List[str]:
+        """
+        Apply several change sets in one configuration session, with a single commit and save.
+        
+        Each change set starts from global configuration mode, so a set that ends inside a
+        sub-mode (e.g. 'interface Gi0/1') does not change where the next set's commands apply,
+        and each set's output is reported to whoever requested it. Once a set fails (CLI error
+        or exception), the remaining sets are not sent and nothing is committed or saved;
+        every set then reports the batch as not persisted.
+        
+        :param changes: Lists of configuration commands, applied in order.
+        :return: The output of each change set, in the same order.
+        """
+        outputs = []
+        failed = None
+        try:
+            with span("ssh.set_batch", changes=len(changes), commands=sum(len(c) for c in changes)), \
+                    SSH_COMMAND_DURATION.labels(kind="set").time():
+                self.conn.config_mode()
+                for index, commands in enumerate(changes):
+                    if index:
+                        self._config_top()
+                    try:
+                        output = self.conn.send_config_set(commands, exit_config_mode=False)
+                    except Exception as e:
+                        output = f"Error executing set commands: {str(e)}"
+                    outputs.append(output)
+                    if any(marker in output for marker in ERROR_MARKERS):
+                        failed = index
+                        break
+                if failed is None:
+                    try:
+                        self.conn.commit()
+                    except AttributeError:
+                        pass  # Netmiko raises AttributeError for platforms without commit (e.g. cisco_ios)
+                elif 'juniper' in self.device['device_type']:
+                    self.conn.send_config_set(['rollback 0'], exit_config_mode=False)  # Discard the candidate
+                self.conn.exit_config_mode()
+                if failed is None and 'cisco' in self.device['device_type']:
+                    self.conn.save_config()
+        except Exception as e:
+            return [f"Error executing set commands: {str(e)}"] * len(changes)
+        if failed is not None:
+            return [self._not_persisted(index, failed, outputs) for index in range(len(changes))]
+        for output in outputs:
+            OUTPUT_BYTES.labels(source="set").observe(len(output.encode("utf-8")))
+        return outputs
+
+    def _config_top(self) -> None:
+        """Returns from any configuration sub-mode to the top of configuration mode."""
+        if 'juniper' in self.device['device_type']:
+            self.conn.send_config_set(['top'], exit_config_mode=False)
+        else:
+            self.conn.exit_config_mode()  # 'end' on IOS-like devices
+            self.conn.config_mode()
+
+    @staticmethod
+    def _not_persisted(index: int, failed: int, outputs: List[str]) -> str:
+        """Output reported for a change set of a batch that was not committed or saved."""
+        if index == failed:
+            return outputs[index]
+        reason = f"Error executing set commands: not persisted, change set {failed + 1} of the batch failed"
+        if index > failed:
+            return f"{reason}; this set was not sent"
+        return f"{reason}\n{outputs[index]}"
+
     def disconnect(self):
         """
         Disconnect from the device.
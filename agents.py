@@ -2,35 +2,70 @@ import autogen
 from config import SystemConfig
 from tools import ping_host, port_scan, netmiko_show, netmiko_set  # Added new tools
 from state import SystemState
-from typing import Dict
+from llm_client import PooledLLMClient, get_llm_pool
+from schemas import AnalysisResult, CommandDecision
+from typing import Dict, Optional
 
-def get_llm_config(config: SystemConfig) -> Dict:
+# Reply schemas enforced by the backend for the profiles whose replies are parsed as JSON
+STRUCTURED_OUTPUTS = {"determine_command": CommandDecision, "analyze": AnalysisResult}
+
+def get_llm_config(config: SystemConfig, profile: Optional[str] = None) -> Dict:
     """Returns the LLM configuration dictionary based on the provided SystemConfig.
 
+    Requests go through a PooledLLMClient, which dispatches them over `config.llm_backends`
+    (or `config.llm_base_url`); agents must register it with `register_model_client`.
+
     Args:
         config (SystemConfig): Configuration object containing LLM settings.
+        profile (Optional[str]): Generation profile (see `SystemConfig.generation_profiles`)
+            providing max_tokens, temperature, stop sequences and thinking on/off. With
+            `config.structured_output`, profiles listed in STRUCTURED_OUTPUTS also request
+            replies constrained to their JSON schema; a grammar-constrained reply cannot carry
+            a <think> block, so thinking is turned off for them.
 
     Returns:
         Dict: Configuration dictionary for the LLM.
     """
-    return {
+    generation = config.generation_profile(profile)
+    structured = config.structured_output and profile in STRUCTURED_OUTPUTS
+    thinking = generation["thinking"] and not structured
+    llm_config = {
         "config_list": [{
             "model": config.llm_model,
-            "base_url": config.llm_base_url,
-            "api_key": config.llm_api_key,
-            "api_type": "openai",
-            "price": [0, 0]  # Suppress warning
+            "model_client_cls": PooledLLMClient.__name__,
+            "price": [0, 0],  # Suppress warning
+            # Qwen3 chat templates read enable_thinking; llama.cpp passes it through chat_template_kwargs
+            "extra_body": {"chat_template_kwargs": {"enable_thinking": thinking}},
+            # Labels the role's prompt cache statistics; not sent to the backend
+            "slot_role": profile or "default",
         }],
-        "temperature": config.temperature,
-        "max_tokens": config.max_tokens,
+        "temperature": generation["temperature"],
+        "max_tokens": generation["max_tokens"],
         "cache_seed": config.cache_seed,
     }
+    if generation["stop"]:
+        llm_config["stop"] = list(generation["stop"])
+    if structured:
+        llm_config["response_format"] = STRUCTURED_OUTPUTS[profile]
+    return llm_config
+
+def register_llm_client(agent: autogen.ConversableAgent, config: SystemConfig) -> None:
+    """Attaches the shared LLM backend pool to an agent.
+
+    Must be repeated whenever autogen rebuilds the agent's client, e.g. after tools are registered.
+
+    Args:
+        agent (autogen.ConversableAgent): Agent created with `get_llm_config`.
+        config (SystemConfig): Configuration object selecting the backends.
+    """
+    agent.register_model_client(PooledLLMClient, pool=get_llm_pool(config))
 
 def create_agent(
     name: str,
     system_message: str,
     config: SystemConfig,
-    state: SystemState
+    state: SystemState,
+    profile: Optional[str] = None
 ) -> autogen.AssistantAgent:
     """Creates an AssistantAgent with the specified name and system message.
 
@@ -39,28 +74,37 @@ def create_agent(
         system_message (str): System message or prompt for the agent.
         config (SystemConfig): Configuration object containing LLM and execution settings.
         state (SystemState): System state object (currently unused but kept for compatibility).
+        profile (Optional[str]): Generation profile applied to the agent's requests.
 
     Returns:
         autogen.AssistantAgent: Configured AssistantAgent instance.
     """
-    return autogen.AssistantAgent(
+    agent = autogen.AssistantAgent(
         name=name,
         system_message=system_message,
-        llm_config=get_llm_config(config),
+        llm_config=get_llm_config(config, profile),
         code_execution_config=config.code_execution_config,
     )
+    register_llm_client(agent, config)
+    return agent
 
-def create_dominant_agent(config: SystemConfig, state: SystemState) -> autogen.AssistantAgent:
+def create_dominant_agent(
+    config: SystemConfig,
+    state: SystemState,
+    profile: str = "determine_command"
+) -> autogen.AssistantAgent:
     """Creates the DominantAgent.
 
     Args:
         config (SystemConfig): Configuration object.
         state (SystemState): System state object.
+        profile (str): Generation profile; "determine_command" for short command JSON,
+            "summary" for the final answer.
 
     Returns:
         autogen.AssistantAgent: Configured DominantAgent instance.
     """
-    return create_agent("DominantAgent", config.dominant_prompt, config, state)
+    return create_agent("DominantAgent", config.dominant_prompt, config, state, profile)
 
 def create_network_agent(config: SystemConfig, state: SystemState) -> autogen.AssistantAgent:
     """Creates the NetworkAgent (formerly ScannerAgent).
@@ -72,7 +116,7 @@ def create_network_agent(config: SystemConfig, state: SystemState) -> autogen.As
     Returns:
         autogen.AssistantAgent: Configured NetworkAgent instance.
     """
-    return create_agent("NetworkAgent", config.network_prompt, config, state)
+    return create_agent("NetworkAgent", config.network_prompt, config, state, "network")
 
 def create_analyzer_agent(analyzer_id: int, config: SystemConfig, state: SystemState) -> autogen.AssistantAgent:
     """Creates an AnalyzerAgent with a formatted prompt based on the analyzer ID.
@@ -86,4 +130,4 @@ def create_analyzer_agent(analyzer_id: int, config: SystemConfig, state: SystemS
         autogen.AssistantAgent: Configured AnalyzerAgent instance.
     """
     prompt = config.analyzer_prompt_template.format(id=analyzer_id)
-    return create_agent(f"Analyzer{analyzer_id}Agent", prompt, config, state)
\ No newline at end of file
+    return create_agent(f"Analyzer{analyzer_id}Agent", prompt, config, state, "analyze")
\ No newline at end of file
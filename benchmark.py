@@ -0,0 +1,360 @@
+"""Offline end-to-end benchmark of the query pipeline.
+
+Drives CoopetitionSystem.process_query_stream (``--mode pipeline``) or the /process
+endpoint (``--mode http``) against the mock LLM server and the fake device backend,
+and reports latency percentiles, throughput and a per-step breakdown. Every run is
+recorded to ``bench_results/`` together with the git revision so runs can be compared
+across commits with ``--compare``.
+
+Example:
+    python benchmark.py --queries 40 --concurrency 4 --llm-latency 0.2 --device-command-latency 0.5
+"""
+import argparse
+import json
+import logging
+import math
+import statistics
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import requests
+
+import tracing
+from config import SystemConfig
+from fake_device import FakeDeviceBackend, FakeDeviceSettings
+from metrics import (
+    Histogram, STEP_DURATION, LLM_CALL_DURATION, SSH_CONNECT_DURATION,
+    SSH_COMMAND_DURATION, DEVICE_WAIT_DURATION, JOB_WAIT_DURATION,
+)
+from mock_llm import MockLLMServer, MockLLMSettings
+from orchestrator import CoopetitionSystem
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RESULTS_DIR = "bench_results"
+ERROR_MARKER = "Произошла ошибка"
+QUERY_TEMPLATES = [
+    "покажи статус интерфейсов на хосте {ip}",
+    "покажи соседство bgp на хосте {ip}",
+    "покажи таблицу qos на хосте {ip}",
+]
+# Histograms broken down per label set in the report
+BREAKDOWN_HISTOGRAMS = {
+    "step": STEP_DURATION,
+    "llm_chat": LLM_CALL_DURATION,
+    "ssh_connect": SSH_CONNECT_DURATION,
+    "ssh_command": SSH_COMMAND_DURATION,
+    "device_wait": DEVICE_WAIT_DURATION,
+    "job_wait": JOB_WAIT_DURATION,
+}
+
+
+@dataclass
+class QueryResult:
+    """Timing of a single benchmarked query."""
+    query: str
+    latency: float
+    first_chunk: float
+    ok: bool
+    error: Optional[str] = None
+
+
+@dataclass
+class BenchmarkReport:
+    """Aggregated results of a benchmark run."""
+    params: Dict[str, Any]
+    revision: str
+    started_at: str
+    queries: int
+    errors: int
+    wall_time: float
+    throughput: float
+    latency: Dict[str, float]
+    first_chunk: Dict[str, float]
+    breakdown: Dict[str, Dict[str, Dict[str, float]]] = field(default_factory=dict)
+    llm: Dict[str, Any] = field(default_factory=dict)
+    devices: Dict[str, int] = field(default_factory=dict)
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Returns the pct-th percentile of values using nearest-rank."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def summarize(values: List[float]) -> Dict[str, float]:
+    """Latency summary: mean, p50, p90, p95, p99 and max in seconds."""
+    if not values:
+        return {}
+    return {
+        "mean": statistics.fmean(values),
+        "p50": percentile(values, 50),
+        "p90": percentile(values, 90),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+        "max": max(values),
+    }
+
+
+def _histogram_totals(histogram: Histogram) -> Dict[str, Tuple[int, float]]:
+    totals = {}
+    for key, child in list(histogram._children.items()):
+        totals[",".join(key)] = (child.count, child.sum)
+    return totals
+
+
+def _snapshot() -> Dict[str, Dict[str, Tuple[int, float]]]:
+    return {name: _histogram_totals(histogram) for name, histogram in BREAKDOWN_HISTOGRAMS.items()}
+
+
+def _breakdown(before, after) -> Dict[str, Dict[str, Dict[str, float]]]:
+    """Per-label count, total and mean duration accumulated between two snapshots."""
+    result = {}
+    for name, totals in after.items():
+        rows = {}
+        for key, (count, total) in totals.items():
+            prev_count, prev_total = before.get(name, {}).get(key, (0, 0.0))
+            if count - prev_count:
+                rows[key] = {
+                    "count": count - prev_count,
+                    "total": total - prev_total,
+                    "mean": (total - prev_total) / (count - prev_count),
+                }
+        if rows:
+            result[name] = rows
+    return result
+
+
+def git_revision() -> str:
+    """Returns the current git revision, marked dirty if the tree has local changes."""
+    repo = Path(__file__).resolve().parent
+    try:
+        revision = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, cwd=repo).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True, text=True, cwd=repo).stdout.strip()
+        return f"{revision}-dirty" if dirty else revision or "unknown"
+    except OSError:
+        return "unknown"
+
+
+def make_queries(count: int, devices: int) -> List[str]:
+    """Builds `count` queries spread over `devices` distinct device addresses."""
+    return [
+        QUERY_TEMPLATES[i % len(QUERY_TEMPLATES)].format(ip=f"10.200.{(i % devices) // 250}.{(i % devices) % 250 + 1}")
+        for i in range(count)
+    ]
+
+
+def run_pipeline_query(config: SystemConfig, query: str) -> QueryResult:
+    """Runs one query through CoopetitionSystem.process_query_stream."""
+    started = time.perf_counter()
+    first_chunk = None
+    chunks = []
+    for chunk in CoopetitionSystem(config).process_query_stream(query):
+        if first_chunk is None:
+            first_chunk = time.perf_counter() - started
+        chunks.append(chunk)
+    output = "".join(chunks)
+    ok = ERROR_MARKER not in output
+    error = output[output.find(ERROR_MARKER):].splitlines()[0] if not ok else None
+    return QueryResult(query, time.perf_counter() - started, first_chunk or 0.0, ok, error)
+
+
+def run_http_query(url: str, query: str) -> QueryResult:
+    """Runs one query through the /process endpoint and consumes the SSE stream."""
+    started = time.perf_counter()
+    first_chunk = None
+    chunks = []
+    with requests.post(url, json={"query": query}, stream=True, timeout=600) as response:
+        if response.status_code != 200:
+            return QueryResult(query, time.perf_counter() - started, 0.0, False, f"HTTP {response.status_code}")
+        for line in response.iter_lines(decode_unicode=True):
+            if not line or not line.startswith("data: ") or line == "data: [DONE]":
+                continue
+            if first_chunk is None:
+                first_chunk = time.perf_counter() - started
+            chunks.append(json.loads(line[len("data: "):])["choices"][0]["delta"]["content"])
+    output = "".join(chunks)
+    ok = ERROR_MARKER not in output
+    error = output[output.find(ERROR_MARKER):].splitlines()[0] if not ok else None
+    return QueryResult(query, time.perf_counter() - started, first_chunk or 0.0, ok, error)
+
+
+def _start_http_server(concurrency: int, queue_size: int) -> Tuple[str, Any]:
+    from werkzeug.serving import make_server
+    import main
+    from scheduler import JobScheduler
+
+    main.scheduler = JobScheduler(concurrency, queue_size, 1)
+    server = make_server("127.0.0.1", 0, main.app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="bench-http", daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}/process", server
+
+
+def run_benchmark(args: argparse.Namespace) -> BenchmarkReport:
+    """Starts the stand-ins, runs the queries and aggregates the results."""
+    llm_servers = [
+        MockLLMServer(MockLLMSettings(
+            latency=args.llm_latency,
+            token_delay=args.llm_token_delay,
+            output_chars=args.llm_output_chars,
+            slots=args.llm_slots,
+            thinking_tokens=args.llm_thinking_tokens,
+        )).start()
+        for _ in range(args.llm_backends)
+    ]
+    devices = FakeDeviceBackend(FakeDeviceSettings(
+        connect_latency=args.device_connect_latency,
+        command_latency=args.device_command_latency,
+        ping_latency=args.device_ping_latency,
+        output_lines=args.device_output_lines,
+    )).install()
+    tracing.configure_tracing(tracing.TraceExporter())
+
+    overrides = {
+        "llm_base_url": llm_servers[0].base_url,
+        "llm_backends": [{"base_url": server.base_url, "slots": args.llm_slots} for server in llm_servers],
+        "llm_dispatch": args.llm_dispatch,
+        "stream_char_delay": args.char_delay,
+        "stream_output_char_delay": args.char_delay,
+        "trace_exporter": "none",
+    }
+    if args.uniform_generation:
+        # Every step with the global budget and thinking on, as before per-step profiles
+        overrides["generation_profiles"] = {}
+    config = SystemConfig(**overrides)
+    queries = make_queries(args.queries, args.devices)
+    http_server = None
+    if args.mode == "http":
+        import main
+        main.SYSTEM_CONFIG_OVERRIDES.update(overrides)
+        url, http_server = _start_http_server(args.concurrency, max(args.queries, 1))
+
+    before = _snapshot()
+    started_at = time.strftime("%Y-%m-%dT%H:%M:%S")
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        if args.mode == "http":
+            results = list(pool.map(lambda q: run_http_query(url, q), queries))
+        else:
+            results = list(pool.map(lambda q: run_pipeline_query(config, q), queries))
+    wall_time = time.perf_counter() - started
+    after = _snapshot()
+
+    if http_server is not None:
+        http_server.shutdown()
+    devices.uninstall()
+    for llm_server in llm_servers:
+        llm_server.stop()
+
+    for result in results:
+        if not result.ok:
+            logger.warning(f"Query failed: {result.query}: {result.error}")
+    successful = [r for r in results if r.ok]
+    return BenchmarkReport(
+        params={key: value for key, value in vars(args).items() if key not in ("compare", "results_dir", "no_record")},
+        revision=git_revision(),
+        started_at=started_at,
+        queries=len(results),
+        errors=len(results) - len(successful),
+        wall_time=wall_time,
+        throughput=len(successful) / wall_time if wall_time else 0.0,
+        latency=summarize([r.latency for r in successful]),
+        first_chunk=summarize([r.first_chunk for r in successful]),
+        breakdown=_breakdown(before, after),
+        llm={
+            "requests": sum(server.llm.requests for server in llm_servers),
+            "prompt_tokens": sum(server.llm.prompt_tokens for server in llm_servers),
+            "completion_tokens": sum(server.llm.completion_tokens for server in llm_servers),
+            "requests_per_backend": [server.llm.requests for server in llm_servers],
+        },
+        devices=dict(devices.counters),
+    )
+
+
+def format_report(report: BenchmarkReport, baseline: Optional[Dict[str, Any]] = None) -> str:
+    """Renders a report as text, with relative changes against a baseline report if given."""
+
+    def delta(current: float, previous: Optional[float]) -> str:
+        if previous in (None, 0):
+            return ""
+        return f"  ({(current - previous) / previous * 100:+.1f}%)"
+
+    lines = [
+        f"Revision {report.revision}, mode {report.params['mode']}, "
+        f"{report.queries} queries at concurrency {report.params['concurrency']}",
+        f"Errors: {report.errors}   Wall time: {report.wall_time:.2f}s   "
+        f"Throughput: {report.throughput:.2f} q/s{delta(report.throughput, baseline and baseline.get('throughput'))}",
+    ]
+    for title, values, key in (("Latency", report.latency, "latency"), ("First chunk", report.first_chunk, "first_chunk")):
+        if values:
+            previous = (baseline or {}).get(key, {})
+            lines.append(f"{title}:")
+            lines.extend(f"  {name:<5} {value:8.3f}s{delta(value, previous.get(name))}" for name, value in values.items())
+    for name, rows in report.breakdown.items():
+        lines.append(f"Breakdown [{name}] (count, total, mean):")
+        previous = (baseline or {}).get("breakdown", {}).get(name, {})
+        for label, row in rows.items():
+            lines.append(
+                f"  {label:<40} {row['count']:6d} {row['total']:9.3f}s {row['mean']:8.3f}s"
+                f"{delta(row['mean'], previous.get(label, {}).get('mean'))}"
+            )
+    lines.append(f"LLM: {report.llm}")
+    lines.append(f"Devices: {report.devices}")
+    return "\n".join(lines)
+
+
+def record(report: BenchmarkReport, results_dir: str) -> Path:
+    """Writes the report to `<results_dir>/<timestamp>_<revision>.json`."""
+    directory = Path(results_dir)
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / f"{report.started_at.replace(':', '')}_{report.revision}.json"
+    path.write_text(json.dumps(asdict(report), indent=2, ensure_ascii=False))
+    return path
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmark of the NetAgents pipeline.")
+    parser.add_argument("--mode", choices=["pipeline", "http"], default="pipeline",
+                        help="Drive process_query_stream directly or through the /process endpoint")
+    parser.add_argument("--queries", type=int, default=20, help="Number of queries to run")
+    parser.add_argument("--concurrency", type=int, default=1, help="Queries run in parallel")
+    parser.add_argument("--devices", type=int, default=4, help="Number of distinct device addresses queried")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="Mock LLM delay per request (s)")
+    parser.add_argument("--llm-token-delay", type=float, default=0.0, help="Mock LLM delay per generated token (s)")
+    parser.add_argument("--llm-output-chars", type=int, default=400, help="Size of analyses and summaries")
+    parser.add_argument("--llm-slots", type=int, default=4, help="Mock LLM parallel generation slots")
+    parser.add_argument("--llm-thinking-tokens", type=int, default=0,
+                        help="Mock LLM reasoning tokens per reply when thinking is enabled")
+    parser.add_argument("--uniform-generation", action="store_true",
+                        help="Disable per-step generation profiles (baseline for comparisons)")
+    parser.add_argument("--llm-backends", type=int, default=1, help="Number of mock LLM servers")
+    parser.add_argument("--llm-dispatch", choices=["least_loaded", "slots"], default="least_loaded",
+                        help="How requests are spread over the mock LLM servers")
+    parser.add_argument("--device-connect-latency", type=float, default=0.2, help="Fake SSH login time (s)")
+    parser.add_argument("--device-command-latency", type=float, default=0.1, help="Fake command time (s)")
+    parser.add_argument("--device-ping-latency", type=float, default=0.01, help="Fake ping round-trip (s)")
+    parser.add_argument("--device-output-lines", type=int, default=48, help="Lines of show command output")
+    parser.add_argument("--char-delay", type=float, default=0.0, help="Typing-effect delay per streamed character (s)")
+    parser.add_argument("--results-dir", type=str, default=DEFAULT_RESULTS_DIR, help="Where results are recorded")
+    parser.add_argument("--compare", type=str, default=None, help="Baseline result file to compare against")
+    parser.add_argument("--no-record", action="store_true", help="Do not record the results")
+    args = parser.parse_args()
+
+    report = run_benchmark(args)
+    baseline = json.loads(Path(args.compare).read_text()) if args.compare else None
+    print(format_report(report, baseline))
+    if not args.no_record:
+        print(f"Results recorded to {record(report, args.results_dir)}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    main()
@@ -0,0 +1,416 @@
+import argparse
+import gzip
+import hashlib
+import json
+import logging
+import re
+import subprocess
+import sys
+import threading
+import time
+from collections import defaultdict, deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+import DoNetAgent
+import tools
+from history import OutputHistory, configure_output_history
+from llm_client import configure_llm_interceptor
+from result_store import HANDLE_PREFIX
+from sessions import SessionStore, configure_session_store
+
+logger = logging.getLogger(__name__)
+
+CASSETTE_VERSION = 1
+
+HANDLE_PATTERN = re.compile(re.escape(HANDLE_PREFIX) + r"[0-9a-f]{16}")
+
+
+class CassetteMiss(LookupError):
+    """Raised in replay when the run makes a request the cassette has no recording for."""
+
+
+def _digest(value: Any) -> str:
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=str, ensure_ascii=False).encode("utf-8")).hexdigest()[:16]
+
+
+def _fingerprint(messages: Any) -> str:
+    """Digest of a conversation, ignoring result handles, which differ between runs."""
+    return _digest(HANDLE_PATTERN.sub(HANDLE_PREFIX, json.dumps(messages, sort_keys=True, default=str, ensure_ascii=False)))
+
+
+def _stream_key(params: Dict[str, Any]) -> str:
+    """Identifies the agent a request comes from as "<tool set>:<system prompt>" digests."""
+    messages = params.get("messages") or []
+    system = messages[0].get("content") if messages and messages[0].get("role") == "system" else ""
+    tools_used = sorted(tool.get("function", {}).get("name", "") for tool in params.get("tools") or [])
+    return f"{_digest(tools_used)}:{_digest(system)}"
+
+
+def _prompt_chars(params: Dict[str, Any]) -> int:
+    return sum(len(json.dumps(message.get("content") or "", ensure_ascii=False)) for message in params.get("messages") or [])
+
+
+class _RecordingConnection:
+    """Wraps a Netmiko connection, recording command outputs."""
+
+    RECORDED = ("find_prompt", "send_command", "send_config_set")
+
+    def __init__(self, cassette: "Cassette", host: str, conn: Any):
+        self._cassette = cassette
+        self._host = host
+        self._conn = conn
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self._conn, name)
+        if name not in self.RECORDED:
+            return attr
+
+        def recorded(*args: Any, **kwargs: Any) -> Any:
+            started = time.perf_counter()
+            output = attr(*args, **kwargs)
+            self._cassette._record_device(self._host, name, args[0] if args else None, output,
+                                          time.perf_counter() - started)
+            return output
+        return recorded
+
+
+class _ReplayConnection:
+    """Serves recorded command outputs in place of a Netmiko connection."""
+
+    def __init__(self, cassette: "Cassette", host: str):
+        self._cassette = cassette
+        self._host = host
+
+    def find_prompt(self, *args: Any, **kwargs: Any) -> str:
+        return self._cassette._replay_device(self._host, "find_prompt", None)
+
+    def send_command(self, command: str, *args: Any, **kwargs: Any) -> str:
+        return self._cassette._replay_device(self._host, "send_command", command)
+
+    def send_config_set(self, commands: List[str], *args: Any, **kwargs: Any) -> str:
+        return self._cassette._replay_device(self._host, "send_config_set", commands)
+
+    def enable(self) -> str:
+        return ""
+
+    def config_mode(self) -> str:
+        return ""
+
+    def commit(self) -> str:
+        return ""
+
+    def exit_config_mode(self) -> str:
+        return ""
+
+    def save_config(self) -> str:
+        return ""
+
+    def disconnect(self) -> None:
+        pass
+
+
+class Cassette:
+    """Records the LLM and device traffic of pipeline runs, or replays it.
+
+    A cassette is a gzip-compressed JSON lines file: a header, then one line per LLM
+    completion, device command or ping, and a summary line per query (LLM calls, prompt size
+    and tokens, device operations, duration). In replay LLM responses are served per agent in
+    recorded order and device outputs per (host, command), with the recorded latency or none,
+    so a run is deterministic and needs neither an LLM server nor devices.
+    """
+
+    def __init__(self, path: str, mode: str, latency: str = "original", strict: bool = False):
+        """Opens a cassette.
+
+        Args:
+            path (str): Cassette file.
+            mode (str): "record" or "replay".
+            latency (str): In replay, "original" sleeps the recorded latency, "zero" answers at once.
+            strict (bool): In replay, fail on LLM requests that differ from the recorded ones
+                instead of only counting them.
+
+        Raises:
+            ValueError: If mode or latency is invalid.
+        """
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Cassette mode must be 'record' or 'replay', got {mode}")
+        if latency not in ("original", "zero"):
+            raise ValueError(f"Cassette latency must be 'original' or 'zero', got {latency}")
+        self.path = path
+        self.mode = mode
+        self.latency = latency
+        self.strict = strict
+        self.entries: List[Dict[str, Any]] = []
+        self.queries: List[Dict[str, Any]] = []
+        self.mismatches = 0
+        self._llm: Dict[str, Deque[Dict[str, Any]]] = defaultdict(deque)
+        self._device: Dict[Tuple[str, str, str], Deque[Dict[str, Any]]] = defaultdict(deque)
+        self._current: Optional[Dict[str, Any]] = None
+        self._miss: Optional[CassetteMiss] = None
+        self._lock = threading.Lock()
+        self._saved_factory: Optional[Callable[..., Any]] = None
+        self._saved_ping: Optional[Callable[..., Any]] = None
+        if mode == "replay":
+            self._load()
+
+    # -- file -----------------------------------------------------------------
+
+    def _load(self) -> None:
+        with gzip.open(self.path, "rt", encoding="utf-8") as f:
+            for seq, line in enumerate(f):
+                entry = json.loads(line)
+                entry["seq"] = seq
+                kind = entry.get("type")
+                if kind == "header":
+                    if entry.get("version") != CASSETTE_VERSION:
+                        raise ValueError(f"Unsupported cassette version {entry.get('version')} in {self.path}")
+                elif kind == "llm":
+                    self._llm[entry["stream"]].append(entry)
+                elif kind in ("device", "ping"):
+                    self._device[(entry["host"], entry["op"], _digest(entry["input"]))].append(entry)
+                elif kind == "query":
+                    self.queries.append(entry)
+        logger.info(f"Cassette {self.path}: {len(self.queries)} queries, "
+                    f"{sum(map(len, self._llm.values()))} LLM calls, {sum(map(len, self._device.values()))} device ops")
+
+    def save(self) -> None:
+        """Writes a recorded cassette."""
+        with gzip.open(self.path, "wt", encoding="utf-8") as f:
+            f.write(json.dumps({"type": "header", "version": CASSETTE_VERSION, "created": time.time()}) + "\n")
+            for entry in self.entries:
+                f.write(json.dumps(entry, ensure_ascii=False, default=str) + "\n")
+        logger.info(f"Cassette saved to {self.path}: {len(self.entries)} entries")
+
+    # -- hooks ----------------------------------------------------------------
+
+    def install(self) -> "Cassette":
+        """Hooks the cassette into the LLM client, the device connection factory and ping."""
+        self._saved_factory = DoNetAgent._connection_factory
+        self._saved_ping = tools._ping_runner
+        configure_llm_interceptor(self._intercept_llm)
+        if self.mode == "record":
+            factory = self._saved_factory
+            DoNetAgent.configure_connection_factory(
+                lambda **device: _RecordingConnection(self, device.get("host", ""), factory(**device)))
+            tools.configure_ping_runner(self._record_ping)
+        else:
+            DoNetAgent.configure_connection_factory(lambda **device: _ReplayConnection(self, device.get("host", "")))
+            tools.configure_ping_runner(self._replay_ping)
+        return self
+
+    def uninstall(self) -> None:
+        configure_llm_interceptor(None)
+        DoNetAgent.configure_connection_factory(self._saved_factory)
+        tools.configure_ping_runner(self._saved_ping)
+
+    def _sleep(self, latency: float) -> float:
+        """Waits out a recorded latency in "original" mode; returns the time waited."""
+        if self.latency == "original" and latency > 0:
+            time.sleep(latency)
+            return latency
+        return 0.0
+
+    def _missed(self, message: str) -> CassetteMiss:
+        """Remembers a replay miss for run_query, which the pipeline's own error handling would hide.
+
+        Called with the lock held.
+        """
+        miss = CassetteMiss(message)
+        if self._current is not None and self._miss is None:
+            self._miss = miss
+        return miss
+
+    def _count(self, **amounts: float) -> None:
+        with self._lock:
+            if self._current is not None:
+                for key, amount in amounts.items():
+                    self._current[key] += amount
+
+    # -- LLM ------------------------------------------------------------------
+
+    def _intercept_llm(self, params: Dict[str, Any], send: Callable[[], Any]) -> Any:
+        from openai.types.chat import ChatCompletion
+
+        stream, fingerprint, prompt_chars = _stream_key(params), _fingerprint(params.get("messages")), _prompt_chars(params)
+        if self.mode == "record":
+            started = time.perf_counter()
+            response = send()
+            entry = {"type": "llm", "stream": stream, "fingerprint": fingerprint, "prompt_chars": prompt_chars,
+                     "latency": round(time.perf_counter() - started, 4), "response": response.model_dump(mode="json")}
+            with self._lock:
+                self.entries.append(entry)
+            waited = entry["latency"]
+        else:
+            with self._lock:
+                recorded = self._llm.get(stream)
+                if not recorded:
+                    # An edited system prompt changes the stream: continue with the agent of the
+                    # same tool set whose next response comes first in the recording
+                    tools_key = stream.partition(":")[0]
+                    candidates = [queue for key, queue in self._llm.items()
+                                  if queue and key.partition(":")[0] == tools_key]
+                    if not candidates:
+                        raise self._missed(f"No recorded LLM response left for agent stream {stream}")
+                    recorded = min(candidates, key=lambda queue: queue[0]["seq"])
+                entry = recorded.popleft()
+                if entry["fingerprint"] != fingerprint:
+                    self.mismatches += 1
+                    if self.strict:
+                        raise self._missed(f"LLM request differs from the recording (stream {stream})")
+            waited = self._sleep(entry["latency"])
+            response = ChatCompletion.model_validate(entry["response"])
+        usage = entry["response"].get("usage") or {}
+        self._count(llm_calls=1, prompt_chars=prompt_chars, prompt_tokens=usage.get("prompt_tokens") or 0,
+                    completion_tokens=usage.get("completion_tokens") or 0, wait=waited)
+        return response
+
+    # -- devices --------------------------------------------------------------
+
+    def _record_device(self, host: str, op: str, command: Any, output: Any, latency: float) -> None:
+        with self._lock:
+            self.entries.append({"type": "device", "host": host, "op": op, "input": command, "output": output,
+                                 "latency": round(latency, 4)})
+        self._count(device_ops=1, wait=latency)
+
+    def _replay_device(self, host: str, op: str, command: Any) -> Any:
+        with self._lock:
+            recorded = self._device.get((host, op, _digest(command)))
+            if not recorded:
+                raise self._missed(f"No recorded {op} {command!r} on {host}")
+            # The last output keeps answering repeated commands
+            entry = recorded.popleft() if len(recorded) > 1 else recorded[0]
+        self._count(device_ops=1, wait=self._sleep(entry["latency"]))
+        return entry["output"]
+
+    def _record_ping(self, command: List[str], host: str) -> subprocess.CompletedProcess:
+        started = time.perf_counter()
+        result = self._saved_ping(command, host)
+        latency = time.perf_counter() - started
+        with self._lock:
+            self.entries.append({"type": "ping", "host": host, "op": "ping", "input": None,
+                                 "output": [result.returncode, result.stdout, result.stderr],
+                                 "latency": round(latency, 4)})
+        self._count(device_ops=1, wait=latency)
+        return result
+
+    def _replay_ping(self, command: List[str], host: str) -> subprocess.CompletedProcess:
+        returncode, stdout, stderr = self._replay_device(host, "ping", None)
+        return subprocess.CompletedProcess(command + [host], returncode, stdout, stderr)
+
+    # -- queries --------------------------------------------------------------
+
+    def run_query(self, system_factory: Callable[[], Any], query: str) -> Dict[str, Any]:
+        """Runs a query through a fresh pipeline and returns its statistics.
+
+        Args:
+            system_factory (Callable[[], Any]): Returns a CoopetitionSystem.
+            query (str): The query.
+
+        Returns:
+            Dict[str, Any]: llm_calls, prompt_chars, prompt_tokens, completion_tokens,
+                device_ops, duration, overhead (duration not spent waiting for the LLM or
+                devices) and whether the pipeline reported an error.
+
+        Raises:
+            CassetteMiss: In replay, if the run made a request the cassette has no recording for.
+        """
+        stats = {"type": "query", "query": query, "llm_calls": 0, "prompt_chars": 0, "prompt_tokens": 0,
+                 "completion_tokens": 0, "device_ops": 0, "wait": 0.0}
+        system = system_factory()
+        # Outputs and sessions of earlier queries change the prompts: every query starts from
+        # empty stores, so a query replays the same whichever queries ran before it in the process
+        configure_output_history(OutputHistory.from_config(system.config))
+        configure_session_store(SessionStore.from_config(system.config))
+        with self._lock:
+            self._current = stats
+            self._miss = None
+        started = time.perf_counter()
+        try:
+            output = "".join(system.process_query_stream(query))
+        finally:
+            with self._lock:
+                self._current = None
+                miss, self._miss = self._miss, None
+        if miss is not None:
+            raise miss
+        duration = time.perf_counter() - started
+        stats["duration"] = round(duration, 4)
+        stats["overhead"] = round(max(duration - stats.pop("wait"), 0.0), 4)
+        stats["error"] = "Произошла ошибка" in output
+        if self.mode == "record":
+            with self._lock:
+                self.entries.append(stats)
+        return stats
+
+
+def compare(recorded: Dict[str, Any], replayed: Dict[str, Any], max_prompt_growth: float) -> List[str]:
+    """Lists the budget regressions of a replayed query against its recording."""
+    problems = []
+    if replayed["error"] and not recorded.get("error"):
+        problems.append("pipeline failed")
+    if replayed["llm_calls"] > recorded["llm_calls"]:
+        problems.append(f"LLM calls {recorded['llm_calls']} -> {replayed['llm_calls']}")
+    if replayed["prompt_chars"] > recorded["prompt_chars"] * (1 + max_prompt_growth):
+        problems.append(f"prompt size {recorded['prompt_chars']} -> {replayed['prompt_chars']} chars")
+    return problems
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Record or replay LLM and device traffic of pipeline runs.")
+    sub = parser.add_subparsers(dest="mode", required=True)
+    record = sub.add_parser("record", help="Run queries against the real LLM and devices and record them")
+    record.add_argument("cassette", help="Cassette file to write (.jsonl.gz)")
+    record.add_argument("--query", action="append", required=True, help="Query to run; repeat for several")
+    record.add_argument("--llm-base-url", type=str, default=None, help="OpenAI-compatible LLM endpoint")
+    replay = sub.add_parser("replay", help="Replay a cassette and check the LLM budget per query")
+    replay.add_argument("cassette", help="Cassette file to read")
+    replay.add_argument("--latency", choices=["original", "zero"], default="zero",
+                        help="Serve responses with the recorded latency or at once (default: zero)")
+    replay.add_argument("--strict", action="store_true", help="Fail on LLM requests differing from the recording")
+    replay.add_argument("--max-prompt-growth", type=float, default=0.0,
+                        help="Allowed relative growth of the prompt size per query (default: 0)")
+    args = parser.parse_args()
+
+    from config import SystemConfig
+    from orchestrator import CoopetitionSystem
+
+    overrides: Dict[str, Any] = {"stream_char_delay": 0.0, "stream_output_char_delay": 0.0}
+    if getattr(args, "llm_base_url", None):
+        overrides["llm_base_url"] = args.llm_base_url
+    factory = lambda: CoopetitionSystem(SystemConfig(**overrides))
+
+    if args.mode == "record":
+        cassette = Cassette(args.cassette, "record").install()
+        try:
+            for query in args.query:
+                stats = cassette.run_query(factory, query)
+                print(json.dumps(stats, ensure_ascii=False))
+        finally:
+            cassette.uninstall()
+        cassette.save()
+        return 0
+
+    cassette = Cassette(args.cassette, "replay", args.latency, args.strict).install()
+    failed = False
+    try:
+        for recorded in list(cassette.queries):
+            try:
+                replayed = cassette.run_query(factory, recorded["query"])
+                problems = compare(recorded, replayed, args.max_prompt_growth)
+            except CassetteMiss as e:
+                replayed, problems = {"query": recorded["query"]}, [str(e)]
+            failed = failed or bool(problems)
+            keys = ("llm_calls", "prompt_chars", "duration", "overhead")
+            print(json.dumps({"query": recorded["query"], "recorded": {k: recorded.get(k) for k in keys},
+                              "replayed": {k: replayed.get(k) for k in keys}, "problems": problems},
+                             ensure_ascii=False))
+    finally:
+        cassette.uninstall()
+    if cassette.mismatches:
+        print(f"{cassette.mismatches} LLM request(s) differed from the recording", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    sys.exit(main())
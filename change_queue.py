@@ -0,0 +1,233 @@
+import contextvars
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Callable, Deque, Dict, Generator, List, Optional, Tuple
+
+from config import SystemConfig
+from DoNetAgent import NetAgent
+from device_limits import get_device_limiter
+from inventory import device_key
+from metrics import CHANGE_BATCH_SIZE, CHANGE_QUEUE_WAIT
+from poller import get_snapshot_store
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+_batching: contextvars.ContextVar[bool] = contextvars.ContextVar("change_batching", default=False)
+
+
+def changes_batched() -> bool:
+    """True while the current context routes set operations through the change queue."""
+    return _batching.get()
+
+
+@contextmanager
+def batched_changes() -> Generator[None, None, None]:
+    """Routes the set operations made in the block through the change queue.
+
+    Interactive pipeline runs apply their changes at once; automation that issues many changes
+    (e.g. query batches) opts in to have changes to a device merged within the batching window.
+    """
+    token = _batching.set(True)
+    try:
+        yield
+    finally:
+        _batching.reset(token)
+
+
+@dataclass(slots=True)
+class ChangeRequest:
+    """A set operation waiting in a device's change queue.
+
+    Attributes:
+        commands (List[str]): Configuration commands.
+        params (Dict[str, Any]): Connection parameters: username, password, device_type.
+        urgent (bool): Apply without waiting for the batching window.
+        submitted_at (float): Time the request was queued (time.monotonic()).
+        future (Future): Resolves to the request's own output.
+        context (contextvars.Context): Context of the submitter; a batch is applied in its first
+            request's context, so the device spans join that pipeline's trace.
+    """
+    commands: List[str]
+    params: Dict[str, Any]
+    urgent: bool = False
+    submitted_at: float = field(default_factory=time.monotonic)
+    future: Future = field(default_factory=Future)
+    context: contextvars.Context = field(default_factory=contextvars.copy_context)
+
+    @property
+    def batch_key(self) -> Tuple[str, str, str]:
+        """Requests can share a config session only with the same login and platform."""
+        return self.params["username"], self.params["password"], self.params["device_type"]
+
+
+@dataclass(slots=True)
+class _DeviceQueue:
+    pending: Deque[ChangeRequest] = field(default_factory=deque)
+    worker: Optional[threading.Thread] = None
+    batches: int = 0
+    changes: int = 0
+
+
+def _apply(host: str, port: int, params: Dict[str, Any], changes: List[List[str]]) -> List[str]:
+    """Applies change sets to a device in one config session with one commit and save."""
+    limiter = get_device_limiter()
+    with limiter.session(device_key(host, port), params["device_type"]) as ticket:
+        agent = NetAgent(host=host, username=params["username"], password=params["password"],
+                         device_type=params["device_type"], port=port)
+        try:
+            with limiter.command(ticket):
+                return agent.execute_set_batch(changes)
+        finally:
+            agent.disconnect()
+
+
+class ChangeQueue:
+    """Per-device write-behind queue merging bursts of set operations.
+
+    The first change for a device opens a batching window; changes arriving within it are
+    applied together in one config session with a single commit and `save_config`. Each
+    caller still receives the output of its own commands; if one change fails, none of the
+    batch is committed or saved (see NetAgent.execute_set_batch). Changes to a device are
+    applied in submission order, one batch at a time; an urgent change closes the window
+    immediately.
+    """
+
+    def __init__(self, window: float, max_batch: int,
+                 applier: Optional[Callable[[str, int, Dict[str, Any], List[List[str]]], List[str]]] = None):
+        """Initializes the queue.
+
+        Args:
+            window (float): Seconds the first change of a batch waits for more; 0 applies at once.
+            max_batch (int): Maximum number of changes per batch.
+            applier (Optional[Callable]): Applies (host, port, params, change sets) and returns
+                one output per change set.
+
+        Raises:
+            ValueError: If window is negative or max_batch is not positive.
+        """
+        if window < 0 or max_batch < 1:
+            raise ValueError("Change queue window must not be negative and max_batch must be positive")
+        self.window = window
+        self.max_batch = max_batch
+        self.applier = applier or _apply
+        self._queues: Dict[Tuple[str, int], _DeviceQueue] = {}
+        self._cond = threading.Condition()
+
+    @classmethod
+    def from_config(cls, config: SystemConfig) -> "ChangeQueue":
+        return cls(config.change_batch_window, config.change_batch_max)
+
+    def submit(self, host: str, commands: List[str], params: Dict[str, Any], port: int = 22,
+               urgent: bool = False) -> Future:
+        """Queues a set operation.
+
+        Args:
+            host (str): The IP address or hostname.
+            commands (List[str]): Configuration commands.
+            params (Dict[str, Any]): username, password and device_type.
+            port (int): SSH port.
+            urgent (bool): Flush the device's queue now instead of waiting for the window.
+
+        Returns:
+            Future: Resolves to the output of these commands, or an error message.
+        """
+        request = ChangeRequest(list(commands), params, urgent)
+        with self._cond:
+            queue = self._queues.setdefault((host, port), _DeviceQueue())
+            queue.pending.append(request)
+            if queue.worker is None:
+                queue.worker = threading.Thread(target=self._drain, args=(host, port, queue),
+                                                name=f"changes-{device_key(host, port)}", daemon=True)
+                queue.worker.start()
+            self._cond.notify_all()
+        return request.future
+
+    def flush(self, host: str, port: int = 22) -> None:
+        """Applies a device's pending changes without waiting for the window."""
+        with self._cond:
+            queue = self._queues.get((host, port))
+            if queue and queue.pending:
+                queue.pending[-1].urgent = True
+                self._cond.notify_all()
+
+    def _next_batch(self, queue: _DeviceQueue) -> List[ChangeRequest]:
+        """Waits for the window of the oldest change, then takes the batch from the queue head."""
+        while True:
+            if not queue.pending:
+                return []
+            ready = len(queue.pending) >= self.max_batch or any(r.urgent for r in queue.pending)
+            remaining = queue.pending[0].submitted_at + self.window - time.monotonic()
+            if ready or remaining <= 0:
+                break
+            self._cond.wait(remaining)
+        # Only a contiguous run of compatible changes keeps the submission order intact
+        key = queue.pending[0].batch_key
+        batch = []
+        while queue.pending and len(batch) < self.max_batch and queue.pending[0].batch_key == key:
+            batch.append(queue.pending.popleft())
+        return batch
+
+    def _drain(self, host: str, port: int, queue: _DeviceQueue) -> None:
+        while True:
+            with self._cond:
+                batch = self._next_batch(queue)
+                if not batch:
+                    queue.worker = None
+                    return
+            started = time.monotonic()
+            for request in batch:
+                CHANGE_QUEUE_WAIT.observe(started - request.submitted_at)
+            CHANGE_BATCH_SIZE.observe(len(batch))
+            try:
+                outputs = batch[0].context.run(self._apply_batch, host, port, batch)
+            except Exception as e:
+                logger.error(f"Change batch for {device_key(host, port)} failed: {str(e)}")
+                outputs = [f"Error executing set commands: {str(e)}"] * len(batch)
+            # Even a failed batch may have changed the running configuration
+            get_snapshot_store().invalidate(device_key(host, port))
+            if len(outputs) != len(batch):
+                outputs = [f"Error executing set commands: {len(outputs)} outputs for {len(batch)} changes"] * len(batch)
+            logger.info(f"Applied {len(batch)} change(s) to {device_key(host, port)} in one session")
+            with self._cond:
+                queue.batches += 1
+                queue.changes += len(batch)
+            for request, output in zip(batch, outputs):
+                request.future.set_result(output)
+
+    def _apply_batch(self, host: str, port: int, batch: List[ChangeRequest]) -> List[str]:
+        with span("change_queue.batch", host=device_key(host, port), changes=len(batch)):
+            return self.applier(host, port, batch[0].params, [request.commands for request in batch])
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                device_key(host, port): {"pending": len(queue.pending), "batches": queue.batches,
+                                         "changes": queue.changes}
+                for (host, port), queue in self._queues.items()
+            }
+
+
+_queue: Optional[ChangeQueue] = None
+_queue_lock = threading.Lock()
+
+
+def configure_change_queue(queue: ChangeQueue) -> None:
+    """Replaces the process-wide change queue."""
+    global _queue
+    with _queue_lock:
+        _queue = queue
+
+
+def get_change_queue() -> ChangeQueue:
+    """Returns the process-wide change queue, creating it from SystemConfig defaults if needed."""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = ChangeQueue.from_config(SystemConfig())
+        return _queue
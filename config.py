@@ -1,11 +1,31 @@
 # config.py
 from dataclasses import dataclass, field
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 
 import logging
+import re
 
 logger = logging.getLogger(__name__)
 
+# Keys (e.g. of credentials) whose values never appear in logs or state snapshots
+SENSITIVE_KEY_PATTERN = re.compile(r"password|secret|api_key", re.IGNORECASE)
+REDACTED = "***"
+
+
+def redact(value: Any) -> Any:
+    """Returns dicts and lists with the values of sensitive keys masked at any depth.
+
+    Values without sensitive keys are returned as they are, not copied.
+    """
+    if isinstance(value, dict):
+        masked = {key: REDACTED if SENSITIVE_KEY_PATTERN.search(str(key)) else redact(item)
+                  for key, item in value.items()}
+        return value if all(masked[key] is item for key, item in value.items()) else masked
+    if isinstance(value, list):
+        masked = [redact(item) for item in value]
+        return value if all(new is old for new, old in zip(masked, value)) else masked
+    return value
+
 
 # Default configuration values
 DEFAULT_LLM_BASE_URL = "http://10.27.192.116:8080/v1"
@@ -16,6 +36,138 @@ DEFAULT_TEMPERATURE = 0.7
 DEFAULT_CACHE_SEED = None
 DEFAULT_CODE_EXECUTION_CONFIG = {"use_docker": False}
 TERMINATION_MSG = "TERMINATE"
+DEFAULT_SCHEDULER_WORKERS = 2
+DEFAULT_SCHEDULER_QUEUE_SIZE = 16
+DEFAULT_SCHEDULER_RETRY_AFTER = 30
+DEFAULT_DEVICE_LIMIT = {"max_sessions": 2, "rate": 2.0, "burst": 2}
+DEFAULT_DEVICE_SESSION_WAIT_TIMEOUT = 120.0
+DEFAULT_TRACE_EXPORTER = "chrome"  # "chrome", "otlp" or "none"
+DEFAULT_TRACE_DIR = "traces"
+DEFAULT_TRACE_MAX_FILES = 200
+DEFAULT_TRACE_OTLP_ENDPOINT = "http://localhost:4318/v1/traces"
+# Per-character delays of the "typing" effect in the streamed response (0 disables it)
+DEFAULT_STREAM_CHAR_DELAY = 0.013
+DEFAULT_STREAM_OUTPUT_CHAR_DELAY = 0.0095
+DEFAULT_LLM_BACKEND_SLOTS = 4
+DEFAULT_LLM_DISPATCH = "least_loaded"  # "least_loaded" or "slots"
+DEFAULT_LLM_REQUEST_TIMEOUT = 600.0
+DEFAULT_LLM_FAILURE_THRESHOLD = 3
+DEFAULT_LLM_HEALTH_CHECK_INTERVAL = 15.0
+# Longest a request waits for a free backend slot ("slots" dispatch) before the pipeline fails
+DEFAULT_LLM_BACKEND_WAIT_TIMEOUT = 120.0
+# Adaptive (AIMD) limit on concurrent completion requests across all backends
+DEFAULT_LLM_ADAPTIVE_CONCURRENCY = True
+DEFAULT_LLM_CONCURRENCY_MIN = 1
+DEFAULT_LLM_CONCURRENCY_MAX = 64
+# Latency (per generated token) above this multiple of the best recent one counts as congestion
+DEFAULT_LLM_LATENCY_TOLERANCE = 1.5
+DEFAULT_LLM_QUEUE_TIMEOUT = 300.0
+DEFAULT_LLM_MAX_QUEUE = 256
+# Pin each agent role's requests to llama.cpp slots holding its prompt prefix (id_slot, cache_prompt)
+DEFAULT_LLM_SLOT_AFFINITY = True
+# Process the agents' fixed prompt prefixes once at startup so the first queries find them cached
+DEFAULT_LLM_PROMPT_WARMUP = True
+# Generation settings per pipeline step. Keys left out fall back to max_tokens/temperature;
+# "thinking" toggles Qwen3 reasoning through the chat template; it only applies while the step's
+# replies are not schema-constrained (see structured_output). Never use TERMINATE as a stop
+# sequence: the chats end when a reply finishes with it.
+DEFAULT_GENERATION_PROFILES = {
+    "determine_command": {"max_tokens": 256, "temperature": 0.1, "stop": [], "thinking": False},
+    "network": {"max_tokens": 16384, "temperature": 0.2, "stop": [], "thinking": False},
+    "analyze": {"max_tokens": 8192, "temperature": 0.7, "stop": [], "thinking": True},
+    "summary": {"max_tokens": 4096, "temperature": 0.5, "stop": [], "thinking": False},
+}
+GENERATION_PROFILE_KEYS = ("max_tokens", "temperature", "stop", "thinking")
+# Request JSON-schema constrained replies for command determination and analysis
+DEFAULT_STRUCTURED_OUTPUT = True
+DEFAULT_STRUCTURED_OUTPUT_RETRIES = 1
+DEFAULT_INVENTORY_PATH = "inventory.yaml"
+DEFAULT_FINGERPRINT_CACHE_PATH = "fingerprints.json"
+# Used for hosts missing from the inventory; device_type "autodetect" fingerprints them
+DEFAULT_DEVICE_CREDENTIALS = {"username": "wbos", "password": "welcome", "device_type": "cisco_ios"}
+# Step events kept per run, and characters per value when the state is logged
+DEFAULT_STATE_EVENT_BUFFER = 64
+DEFAULT_STATE_LOG_VALUE_CHARS = 200
+DEFAULT_SESSION_TTL = 1800.0
+DEFAULT_SESSION_MAX_SESSIONS = 256
+DEFAULT_SESSION_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_SESSION_MAX_HISTORY = 5
+# Follow-ups reuse a session's ping and show output only while they are this fresh (seconds)
+DEFAULT_SESSION_RESULT_MAX_AGE = 300.0
+# Background pre-fetch of hot show commands, by inventory group, e.g.
+# {"core": {"commands": ["show interface brief", "show bgp summary"], "interval": 60}}
+DEFAULT_PREFETCH_ENABLED = False
+DEFAULT_PREFETCH_INTERVAL = 60.0
+DEFAULT_PREFETCH_CONCURRENCY = 4
+# Poll times are spread by +/- this fraction of the interval
+DEFAULT_PREFETCH_JITTER = 0.2
+# The execute step answers from snapshots younger than this (seconds)
+DEFAULT_PREFETCH_MAX_AGE = 120.0
+# History of show outputs per (device, command); repeated runs send the analyzer only the delta
+DEFAULT_HISTORY_ENABLED = True
+DEFAULT_HISTORY_MAX_ENTRIES = 8
+DEFAULT_HISTORY_MAX_KEYS = 1024
+DEFAULT_HISTORY_MAX_BYTES = 32 * 1024 * 1024
+DEFAULT_HISTORY_DIFF_CONTEXT = 1
+# Outputs shorter than this are always analyzed in full
+DEFAULT_HISTORY_MIN_OUTPUT_CHARS = 2000
+# The delta is sent only if it is at most this fraction of the full output
+DEFAULT_HISTORY_DELTA_MAX_RATIO = 0.5
+# Tool outputs are kept in a result store and handed to the LLM by handle
+DEFAULT_RESULT_STORE_MEMORY_LIMIT = 64 * 1024 * 1024
+# Outputs of at least this many bytes are written to disk and read back through mmap
+DEFAULT_RESULT_STORE_SPILL_THRESHOLD = 1024 * 1024
+DEFAULT_RESULT_STORE_SPILL_DIR = None  # None: a directory under the system temp dir
+DEFAULT_RESULT_STORE_TTL = 600.0
+DEFAULT_RESULT_STORE_PREVIEW_CHARS = 300
+# Command outputs up to this many bytes are held by a request as a string; larger outputs stay
+# spooled (on disk above result_store_spill_threshold), are streamed to the client from there and
+# analyzed part by part
+DEFAULT_OUTPUT_INLINE_LIMIT = 256 * 1024
+DEFAULT_ANALYSIS_CHUNK_BYTES = 64 * 1024
+# Parts of a large output analyzed at most; the rest is reported as not analyzed
+DEFAULT_ANALYSIS_MAX_CHUNKS = 8
+# A request fails once the process RSS has grown by more than this since it started (None: no limit)
+DEFAULT_REQUEST_RSS_LIMIT = 1024 * 1024 * 1024
+# Set operations on one device arriving within this window share a config session, commit and save
+DEFAULT_CHANGE_BATCH_WINDOW = 0.5
+DEFAULT_CHANGE_BATCH_MAX = 32
+# Staged rollouts: canary devices first, then waves run `parallelism` devices at a time
+DEFAULT_ROLLOUT_CANARY = 1
+DEFAULT_ROLLOUT_PARALLELISM = 8
+DEFAULT_ROLLOUT_WAVE_SIZE = 32
+# Rollouts run off the scheduler workers; these cap the device sessions they open in total
+DEFAULT_ROLLOUT_MAX_PARALLELISM = 32
+DEFAULT_ROLLOUT_MAX_CONCURRENT = 1
+# Fraction of failed devices that halts a rollout
+DEFAULT_ROLLOUT_MAX_ERROR_RATE = 0.1
+# Queries of a /process_batch request processed at once, by default and at most
+DEFAULT_QUERY_BATCH_PARALLELISM = 8
+DEFAULT_QUERY_BATCH_MAX_PARALLELISM = 32
+DEFAULT_QUERY_BATCH_MAX_QUERIES = 1000
+# A batch's device session (and its device limiter slot) closes after this many idle seconds
+DEFAULT_QUERY_BATCH_SESSION_IDLE = 2.0
+# How the ping step checks reachability: "icmp" (ping) or "ssh" (TCP connect to the SSH port,
+# whose socket is then reused by the login)
+DEFAULT_REACHABILITY_CHECK = "icmp"
+DEFAULT_SSH_PROBE_TIMEOUT = 3.0
+# Probe sockets not taken over by a login within this time are closed
+DEFAULT_SSH_PROBE_SOCKET_TTL = 30.0
+# Run the likely show command of a query while the DominantAgent is still determining it
+DEFAULT_SPECULATION_ENABLED = False
+DEFAULT_SPECULATION_WORKERS = 4
+# Keyword rules predicting the show command, mirroring DOMINANT_PROMPT; the first match wins
+DEFAULT_SPECULATION_RULES = [
+    {"keywords": ["bgp", "соседств"], "command": "show bgp summary"},
+    {"keywords": ["qos", "качества обслуживания"], "command": "show qos classifiers dscp"},
+    {"keywords": ["интерфейс", "interface"], "command": "show interface brief"},
+]
+# Sampling profiles of requests sent with an X-Profile header, and of the whole process on demand
+DEFAULT_PROFILING_ENABLED = False
+DEFAULT_PROFILE_INTERVAL = 0.01
+DEFAULT_PROFILE_MAX_SECONDS = 120.0
+# Finished profiles kept for retrieval
+DEFAULT_PROFILE_KEEP = 20
 
 # Updated Prompt templates
 DOMINANT_PROMPT = """
@@ -31,13 +183,15 @@ Eсли пользователь просит показать соседств
 """
 
 NETWORK_PROMPT = """
-Вы - NetworkAgent. [REASON] о задаче, [ACT] вызов инструментов (ping_host, netmiko_show, netmiko_set).
+Вы - NetworkAgent. [REASON] о задаче, [ACT] вызов инструментов (ping_host, ssh_probe, netmiko_show, netmiko_set).
 Выполните инструмент, дождитесь результата, затем верните JSON в формате {"ping_result": "результат"} или {"show_result": "результат"} или {"set_result": "результат"}.
+netmiko_show и netmiko_set возвращают не сам вывод, а JSON с полем "handle" и началом вывода (preview); в show_result/set_result верните значение handle, не пересказывайте вывод.
 Завершите ответ словом TERMINATE.
 """
 
 ANALYZER_PROMPT_TEMPLATE = """
 Вы - Analyzer-{id}. Анализируйте данные из state (конфигурацию или результат). [REASON] о рисках/статусе, [ACT] генерируйте JSON анализ.
+Формат JSON: {{"status": "ok" | "warning" | "critical", "summary": "краткий вывод", "issues": ["проблема"], "recommendations": ["действие"]}}.
 Конкурируйте: будьте глубже и профессиональнее других.
 После генерации JSON завершите ответ словом TERMINATE.
 """
@@ -57,19 +211,182 @@ class SystemConfig:
     network_prompt: str = field(default=NETWORK_PROMPT)  # Renamed from scanner_prompt
     analyzer_prompt_template: str = field(default=ANALYZER_PROMPT_TEMPLATE)
     termination_msg: str = field(default=TERMINATION_MSG)
+    scheduler_workers: int = field(default=DEFAULT_SCHEDULER_WORKERS)
+    scheduler_queue_size: int = field(default=DEFAULT_SCHEDULER_QUEUE_SIZE)
+    scheduler_retry_after: int = field(default=DEFAULT_SCHEDULER_RETRY_AFTER)
+    # Per-device limits keyed by inventory group or device_type, e.g. {"cisco_ios": {"max_sessions": 3}}
+    device_limits: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+    default_device_limit: Dict[str, Any] = field(default_factory=lambda: dict(DEFAULT_DEVICE_LIMIT))
+    device_session_wait_timeout: Optional[float] = field(default=DEFAULT_DEVICE_SESSION_WAIT_TIMEOUT)
+    trace_exporter: str = field(default=DEFAULT_TRACE_EXPORTER)
+    trace_dir: str = field(default=DEFAULT_TRACE_DIR)
+    trace_max_files: int = field(default=DEFAULT_TRACE_MAX_FILES)
+    trace_otlp_endpoint: str = field(default=DEFAULT_TRACE_OTLP_ENDPOINT)
+    stream_char_delay: float = field(default=DEFAULT_STREAM_CHAR_DELAY)
+    stream_output_char_delay: float = field(default=DEFAULT_STREAM_OUTPUT_CHAR_DELAY)
+    # OpenAI-compatible backends shared by all agents, e.g. [{"base_url": "http://gpu1:8080/v1", "slots": 4}];
+    # empty means a single backend at llm_base_url
+    llm_backends: List[Dict[str, Any]] = field(default_factory=list)
+    llm_dispatch: str = field(default=DEFAULT_LLM_DISPATCH)
+    llm_request_timeout: float = field(default=DEFAULT_LLM_REQUEST_TIMEOUT)
+    llm_failure_threshold: int = field(default=DEFAULT_LLM_FAILURE_THRESHOLD)
+    llm_health_check_interval: float = field(default=DEFAULT_LLM_HEALTH_CHECK_INTERVAL)
+    llm_backend_wait_timeout: Optional[float] = field(default=DEFAULT_LLM_BACKEND_WAIT_TIMEOUT)
+    llm_adaptive_concurrency: bool = field(default=DEFAULT_LLM_ADAPTIVE_CONCURRENCY)
+    llm_concurrency_min: int = field(default=DEFAULT_LLM_CONCURRENCY_MIN)
+    llm_concurrency_max: int = field(default=DEFAULT_LLM_CONCURRENCY_MAX)
+    llm_latency_tolerance: float = field(default=DEFAULT_LLM_LATENCY_TOLERANCE)
+    llm_queue_timeout: float = field(default=DEFAULT_LLM_QUEUE_TIMEOUT)
+    llm_max_queue: int = field(default=DEFAULT_LLM_MAX_QUEUE)
+    llm_slot_affinity: bool = field(default=DEFAULT_LLM_SLOT_AFFINITY)
+    llm_prompt_warmup: bool = field(default=DEFAULT_LLM_PROMPT_WARMUP)
+    structured_output: bool = field(default=DEFAULT_STRUCTURED_OUTPUT)
+    structured_output_retries: int = field(default=DEFAULT_STRUCTURED_OUTPUT_RETRIES)
+    inventory_path: Optional[str] = field(default=DEFAULT_INVENTORY_PATH)
+    fingerprint_cache_path: Optional[str] = field(default=DEFAULT_FINGERPRINT_CACHE_PATH)
+    default_device_credentials: Dict[str, str] = field(default_factory=lambda: dict(DEFAULT_DEVICE_CREDENTIALS))
+    state_event_buffer: int = field(default=DEFAULT_STATE_EVENT_BUFFER)
+    state_log_value_chars: int = field(default=DEFAULT_STATE_LOG_VALUE_CHARS)
+    session_ttl: float = field(default=DEFAULT_SESSION_TTL)
+    session_max_sessions: int = field(default=DEFAULT_SESSION_MAX_SESSIONS)
+    session_max_bytes: int = field(default=DEFAULT_SESSION_MAX_BYTES)
+    session_max_history: int = field(default=DEFAULT_SESSION_MAX_HISTORY)
+    session_result_max_age: float = field(default=DEFAULT_SESSION_RESULT_MAX_AGE)
+    prefetch_enabled: bool = field(default=DEFAULT_PREFETCH_ENABLED)
+    prefetch_schedule: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+    prefetch_interval: float = field(default=DEFAULT_PREFETCH_INTERVAL)
+    prefetch_concurrency: int = field(default=DEFAULT_PREFETCH_CONCURRENCY)
+    prefetch_jitter: float = field(default=DEFAULT_PREFETCH_JITTER)
+    prefetch_max_age: float = field(default=DEFAULT_PREFETCH_MAX_AGE)
+    history_enabled: bool = field(default=DEFAULT_HISTORY_ENABLED)
+    history_max_entries: int = field(default=DEFAULT_HISTORY_MAX_ENTRIES)
+    history_max_keys: int = field(default=DEFAULT_HISTORY_MAX_KEYS)
+    history_max_bytes: int = field(default=DEFAULT_HISTORY_MAX_BYTES)
+    history_diff_context: int = field(default=DEFAULT_HISTORY_DIFF_CONTEXT)
+    history_min_output_chars: int = field(default=DEFAULT_HISTORY_MIN_OUTPUT_CHARS)
+    history_delta_max_ratio: float = field(default=DEFAULT_HISTORY_DELTA_MAX_RATIO)
+    result_store_memory_limit: int = field(default=DEFAULT_RESULT_STORE_MEMORY_LIMIT)
+    result_store_spill_threshold: int = field(default=DEFAULT_RESULT_STORE_SPILL_THRESHOLD)
+    result_store_spill_dir: Optional[str] = field(default=DEFAULT_RESULT_STORE_SPILL_DIR)
+    result_store_ttl: float = field(default=DEFAULT_RESULT_STORE_TTL)
+    result_store_preview_chars: int = field(default=DEFAULT_RESULT_STORE_PREVIEW_CHARS)
+    output_inline_limit: int = field(default=DEFAULT_OUTPUT_INLINE_LIMIT)
+    analysis_chunk_bytes: int = field(default=DEFAULT_ANALYSIS_CHUNK_BYTES)
+    analysis_max_chunks: int = field(default=DEFAULT_ANALYSIS_MAX_CHUNKS)
+    request_rss_limit: Optional[int] = field(default=DEFAULT_REQUEST_RSS_LIMIT)
+    change_batch_window: float = field(default=DEFAULT_CHANGE_BATCH_WINDOW)
+    change_batch_max: int = field(default=DEFAULT_CHANGE_BATCH_MAX)
+    rollout_canary: int = field(default=DEFAULT_ROLLOUT_CANARY)
+    rollout_parallelism: int = field(default=DEFAULT_ROLLOUT_PARALLELISM)
+    rollout_wave_size: int = field(default=DEFAULT_ROLLOUT_WAVE_SIZE)
+    rollout_max_error_rate: float = field(default=DEFAULT_ROLLOUT_MAX_ERROR_RATE)
+    rollout_max_parallelism: int = field(default=DEFAULT_ROLLOUT_MAX_PARALLELISM)
+    rollout_max_concurrent: int = field(default=DEFAULT_ROLLOUT_MAX_CONCURRENT)
+    query_batch_parallelism: int = field(default=DEFAULT_QUERY_BATCH_PARALLELISM)
+    query_batch_max_parallelism: int = field(default=DEFAULT_QUERY_BATCH_MAX_PARALLELISM)
+    query_batch_max_queries: int = field(default=DEFAULT_QUERY_BATCH_MAX_QUERIES)
+    query_batch_session_idle: float = field(default=DEFAULT_QUERY_BATCH_SESSION_IDLE)
+    reachability_check: str = field(default=DEFAULT_REACHABILITY_CHECK)
+    speculation_enabled: bool = field(default=DEFAULT_SPECULATION_ENABLED)
+    speculation_workers: int = field(default=DEFAULT_SPECULATION_WORKERS)
+    speculation_rules: List[Dict[str, Any]] = field(default_factory=lambda: [dict(rule) for rule in DEFAULT_SPECULATION_RULES])
+    profiling_enabled: bool = field(default=DEFAULT_PROFILING_ENABLED)
+    profile_interval: float = field(default=DEFAULT_PROFILE_INTERVAL)
+    profile_max_seconds: float = field(default=DEFAULT_PROFILE_MAX_SECONDS)
+    profile_keep: int = field(default=DEFAULT_PROFILE_KEEP)
+    generation_profiles: Dict[str, Dict[str, Any]] = field(
+        default_factory=lambda: {name: dict(profile) for name, profile in DEFAULT_GENERATION_PROFILES.items()})
 
     def __post_init__(self):
         """Validates configuration fields after initialization.
 
         Raises:
-            ValueError: If max_tokens or temperature are out of valid ranges.
+            ValueError: If max_tokens, temperature, scheduler limits, LLM backends, generation profiles
+                or the prefetch schedule are invalid.
         """
 
-        logger.info(f"LLM config: {self.__dict__}")
+        logger.info("LLM config: %s", redact(self.__dict__))
 
         if not (0 < self.max_tokens <= 65536):
             raise ValueError(f"max_tokens must be between 1 and 16384, got {self.max_tokens}")
         if not (0.0 <= self.temperature <= 2.0):
             raise ValueError(f"temperature must be between 0.0 and 2.0, got {self.temperature}")
         if not self.llm_base_url.startswith("http"):
-            raise ValueError(f"llm_base_url must be a valid URL, got {self.llm_base_url}")
\ No newline at end of file
+            raise ValueError(f"llm_base_url must be a valid URL, got {self.llm_base_url}")
+        if self.scheduler_workers < 1:
+            raise ValueError(f"scheduler_workers must be positive, got {self.scheduler_workers}")
+        if self.scheduler_queue_size < 1:
+            raise ValueError(f"scheduler_queue_size must be positive, got {self.scheduler_queue_size}")
+        for backend in self.llm_backends:
+            if not str(backend.get("base_url", "")).startswith("http"):
+                raise ValueError(f"llm_backends entries need a valid base_url, got {backend}")
+        if self.llm_dispatch not in ("least_loaded", "slots"):
+            raise ValueError(f"llm_dispatch must be 'least_loaded' or 'slots', got {self.llm_dispatch}")
+        if not (1 <= self.llm_concurrency_min <= self.llm_concurrency_max):
+            raise ValueError(f"llm_concurrency_min must be between 1 and llm_concurrency_max ({self.llm_concurrency_max}), "
+                             f"got {self.llm_concurrency_min}")
+        if self.llm_latency_tolerance <= 1.0:
+            raise ValueError(f"llm_latency_tolerance must be greater than 1.0, got {self.llm_latency_tolerance}")
+        if self.llm_backend_wait_timeout is not None and self.llm_backend_wait_timeout <= 0:
+            raise ValueError(f"llm_backend_wait_timeout must be positive or None, got {self.llm_backend_wait_timeout}")
+        if self.llm_queue_timeout <= 0 or self.llm_max_queue < 1:
+            raise ValueError("llm_queue_timeout and llm_max_queue must be positive")
+        if self.structured_output_retries < 0:
+            raise ValueError(f"structured_output_retries must not be negative, got {self.structured_output_retries}")
+        for name, profile in self.generation_profiles.items():
+            unknown = set(profile) - set(GENERATION_PROFILE_KEYS)
+            if unknown:
+                raise ValueError(f"Unknown keys {sorted(unknown)} in generation profile '{name}'")
+            if not (0 < profile.get("max_tokens", self.max_tokens) <= self.max_tokens):
+                raise ValueError(f"max_tokens of generation profile '{name}' must be between 1 and {self.max_tokens}")
+            if not (0.0 <= profile.get("temperature", self.temperature) <= 2.0):
+                raise ValueError(f"temperature of generation profile '{name}' must be between 0.0 and 2.0")
+            if self.termination_msg in profile.get("stop", []):
+                raise ValueError(f"Generation profile '{name}' must not stop on {self.termination_msg}")
+        if not (0.0 < self.history_delta_max_ratio <= 1.0):
+            raise ValueError(f"history_delta_max_ratio must be between 0.0 and 1.0, got {self.history_delta_max_ratio}")
+        if self.reachability_check not in ("icmp", "ssh"):
+            raise ValueError(f"reachability_check must be 'icmp' or 'ssh', got {self.reachability_check}")
+        for rule in self.speculation_rules:
+            if not rule.get("keywords") or not str(rule.get("command", "")).strip().lower().startswith("show "):
+                raise ValueError(f"speculation_rules entries need keywords and a show command, got {rule}")
+        if self.profile_interval <= 0 or self.profile_max_seconds <= 0:
+            raise ValueError(f"profile_interval and profile_max_seconds must be positive, got {self.profile_interval}, {self.profile_max_seconds}")
+        if self.output_inline_limit < 1 or self.analysis_chunk_bytes < 1 or self.analysis_max_chunks < 1:
+            raise ValueError("output_inline_limit, analysis_chunk_bytes and analysis_max_chunks must be positive")
+        if self.request_rss_limit is not None and self.request_rss_limit < 1:
+            raise ValueError(f"request_rss_limit must be positive or None, got {self.request_rss_limit}")
+        if not (1 <= self.query_batch_parallelism <= self.query_batch_max_parallelism):
+            raise ValueError("query_batch_parallelism must be between 1 and query_batch_max_parallelism")
+        if not (1 <= self.rollout_parallelism <= self.rollout_max_parallelism):
+            raise ValueError("rollout_parallelism must be between 1 and rollout_max_parallelism")
+        if self.rollout_max_concurrent < 1:
+            raise ValueError(f"rollout_max_concurrent must be positive, got {self.rollout_max_concurrent}")
+        if self.query_batch_max_queries < 1:
+            raise ValueError(f"query_batch_max_queries must be positive, got {self.query_batch_max_queries}")
+        if self.query_batch_session_idle < 0:
+            raise ValueError(f"query_batch_session_idle must not be negative, got {self.query_batch_session_idle}")
+        if self.profile_keep < 1:
+            raise ValueError(f"profile_keep must be positive, got {self.profile_keep}")
+        if self.prefetch_concurrency < 1:
+            raise ValueError(f"prefetch_concurrency must be positive, got {self.prefetch_concurrency}")
+        if not (0.0 <= self.prefetch_jitter < 1.0):
+            raise ValueError(f"prefetch_jitter must be between 0.0 and 1.0, got {self.prefetch_jitter}")
+        for group, entry in self.prefetch_schedule.items():
+            if not entry.get("commands"):
+                raise ValueError(f"Prefetch schedule of group '{group}' has no commands")
+            if entry.get("interval", self.prefetch_interval) <= 0:
+                raise ValueError(f"Prefetch interval of group '{group}' must be positive")
+
+    def generation_profile(self, name: Optional[str]) -> Dict[str, Any]:
+        """Returns the complete generation settings of a step profile.
+
+        Args:
+            name (Optional[str]): Profile name; None or an unknown name gives the global settings.
+
+        Returns:
+            Dict[str, Any]: max_tokens, temperature, stop and thinking.
+        """
+        profile = {"max_tokens": self.max_tokens, "temperature": self.temperature, "stop": [], "thinking": True}
+        profile.update(self.generation_profiles.get(name, {}) if name else {})
+        return profile
\ No newline at end of file
@@ -0,0 +1,472 @@
+"""Simulated SSH device farm for load-testing the NetAgent layer.
+
+Spins up many virtual cisco_ios-style devices on localhost ports. Each device speaks
+enough of the IOS CLI for Netmiko (prompts, enable, terminal settings, configuration
+mode, canned show outputs, write memory) and can emulate login latency, slow output,
+a VTY session cap and injected failures.
+
+Run standalone:
+    python device_farm.py --devices 200 --base-port 10022 --login-latency 0.5 --max-vty 4
+"""
+import argparse
+import logging
+import random
+import selectors
+import socket
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import paramiko
+
+from fake_device import render_output
+
+logger = logging.getLogger(__name__)
+# Server-side paramiko transports log every client teardown; keep them out of the benchmark output
+TRANSPORT_LOG_CHANNEL = "device_farm.transport"
+logging.getLogger(TRANSPORT_LOG_CHANNEL).setLevel(logging.CRITICAL)
+
+DEFAULT_USERNAME = "admin"
+DEFAULT_PASSWORD = "admin"
+DEFAULT_ENABLE_SECRET = "admin"
+OUTPUT_CHUNK_SIZE = 512
+INVALID_INPUT = "% Invalid input detected at '^' marker."
+
+# Canned outputs; any other "show" command gets a generated table
+CANNED_OUTPUTS = {
+    "show version": (
+        "Cisco IOS Software, Virtual Switch Software (vIOS-L2), Version 15.2(4.0.55)E\n"
+        "Technical Support: http://www.cisco.com/techsupport\n"
+        "{hostname} uptime is 1 week, 2 days, 3 hours, 4 minutes\n"
+        "System image file is \"flash0:/vios_l2-adventerprisek9-m\"\n"
+        "Configuration register is 0x101"
+    ),
+    "show ip interface brief": (
+        "Interface              IP-Address      OK? Method Status                Protocol\n"
+        "GigabitEthernet0/0     10.0.0.1        YES NVRAM  up                    up\n"
+        "GigabitEthernet0/1     unassigned      YES unset  administratively down down\n"
+        "GigabitEthernet0/2     unassigned      YES unset  up                    up\n"
+        "Vlan1                  192.168.1.1     YES NVRAM  up                    up"
+    ),
+    "show running-config": (
+        "Building configuration...\n\n"
+        "Current configuration : 1024 bytes\n!\nhostname {hostname}\n!\n"
+        "interface GigabitEthernet0/0\n ip address 10.0.0.1 255.255.255.0\n!\nend"
+    ),
+}
+
+
+@dataclass
+class DeviceProfile:
+    """Behaviour shared by the virtual devices of a farm.
+
+    Attributes:
+        login_latency (float): Delay before authentication completes, in seconds.
+        byte_delay (float): Delay per byte of command output, in seconds.
+        command_latency (float): Fixed delay before a command's output, in seconds.
+        max_vty (int): Concurrent sessions accepted per device; further connections are dropped.
+        output_lines (int): Lines of generated output for show commands without canned output.
+        auth_failure_rate (float): Probability that a correct login is rejected.
+        disconnect_rate (float): Probability that a session is dropped when a command is received.
+        error_rate (float): Probability that a command is answered with an IOS error.
+        save_latency (float): Duration of "write memory", in seconds.
+    """
+    username: str = DEFAULT_USERNAME
+    password: str = DEFAULT_PASSWORD
+    enable_secret: str = DEFAULT_ENABLE_SECRET
+    login_latency: float = 0.0
+    byte_delay: float = 0.0
+    command_latency: float = 0.0
+    max_vty: int = 5
+    output_lines: int = 48
+    auth_failure_rate: float = 0.0
+    disconnect_rate: float = 0.0
+    error_rate: float = 0.0
+    save_latency: float = 0.0
+    outputs: Dict[str, str] = field(default_factory=lambda: dict(CANNED_OUTPUTS))
+
+
+@dataclass
+class DeviceStats:
+    """Counters of a virtual device."""
+    connections: int = 0
+    active_sessions: int = 0
+    peak_sessions: int = 0
+    rejected_vty: int = 0
+    auth_failures: int = 0
+    commands: int = 0
+    config_lines: int = 0
+    saves: int = 0
+    injected_disconnects: int = 0
+
+
+class VirtualDevice:
+    """A single simulated device listening on its own localhost port."""
+
+    def __init__(self, hostname: str, listener: socket.socket, profile: DeviceProfile):
+        self.hostname = hostname
+        self.listener = listener
+        self.profile = profile
+        self.stats = DeviceStats()
+        self.running_config: List[str] = []
+        self._lock = threading.Lock()
+
+    @property
+    def port(self) -> int:
+        return self.listener.getsockname()[1]
+
+    def try_open_session(self) -> bool:
+        """Reserves a VTY line; returns False when all lines are busy."""
+        with self._lock:
+            self.stats.connections += 1
+            if self.stats.active_sessions >= self.profile.max_vty:
+                self.stats.rejected_vty += 1
+                return False
+            self.stats.active_sessions += 1
+            self.stats.peak_sessions = max(self.stats.peak_sessions, self.stats.active_sessions)
+            return True
+
+    def close_session(self) -> None:
+        with self._lock:
+            self.stats.active_sessions -= 1
+
+    def count(self, key: str, amount: int = 1) -> None:
+        with self._lock:
+            setattr(self.stats, key, getattr(self.stats, key) + amount)
+
+
+class _DeviceServer(paramiko.ServerInterface):
+    """Paramiko server interface authenticating against the device profile."""
+
+    def __init__(self, device: VirtualDevice):
+        self.device = device
+        self.shell_requested = threading.Event()
+
+    def get_allowed_auths(self, username):
+        return "password"
+
+    def check_auth_password(self, username, password):
+        profile = self.device.profile
+        time.sleep(profile.login_latency)
+        if username == profile.username and password == profile.password:
+            if random.random() >= profile.auth_failure_rate:
+                return paramiko.AUTH_SUCCESSFUL
+        self.device.count("auth_failures")
+        return paramiko.AUTH_FAILED
+
+    def check_channel_request(self, kind, chanid):
+        if kind == "session":
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_pty_request(self, channel, term, width, height, pixelwidth, pixelheight, modes):
+        return True
+
+    def check_channel_shell_request(self, channel):
+        self.shell_requested.set()
+        return True
+
+
+class _CliSession:
+    """Emulates the IOS command line on an SSH channel."""
+
+    def __init__(self, device: VirtualDevice, channel: paramiko.Channel):
+        self.device = device
+        self.profile = device.profile
+        self.channel = channel
+        self.mode = "user"  # user, enable, config, config-if
+        self.awaiting_secret = False
+        self._last_cr = False
+
+    @property
+    def prompt(self) -> str:
+        suffix = {"user": ">", "enable": "#", "config": "(config)#", "config-if": "(config-if)#"}[self.mode]
+        return f"{self.device.hostname}{suffix}"
+
+    def send(self, text: str, delayed: bool = False) -> None:
+        data = text.replace("\r\n", "\n").replace("\n", "\r\n").encode("utf-8")
+        if not delayed or not self.profile.byte_delay:
+            self.channel.sendall(data)
+            return
+        for start in range(0, len(data), OUTPUT_CHUNK_SIZE):
+            chunk = data[start:start + OUTPUT_CHUNK_SIZE]
+            time.sleep(self.profile.byte_delay * len(chunk))
+            self.channel.sendall(chunk)
+
+    def run(self) -> None:
+        self.send(f"\n{self.prompt}")
+        buffer = ""
+        while True:
+            data = self.channel.recv(4096)
+            if not data:
+                return
+            for char in data.decode("utf-8", errors="replace"):
+                if char in "\r\n":
+                    # Treat CRLF as a single line break
+                    if char == "\n" and buffer == "" and self._last_cr:
+                        self._last_cr = False
+                        continue
+                    self._last_cr = char == "\r"
+                    line, buffer = buffer, ""
+                    if not self.awaiting_secret:
+                        self.send("\n")
+                    if not self.handle(line.strip()):
+                        return
+                else:
+                    self._last_cr = False
+                    buffer += char
+                    if not self.awaiting_secret:
+                        self.send(char)
+
+    def handle(self, line: str) -> bool:
+        """Processes one command line; returns False when the session ends."""
+        if self.awaiting_secret:
+            self.awaiting_secret = False
+            if line == self.profile.enable_secret:
+                self.mode = "enable"
+            else:
+                self.send("% Access denied\n")
+            self.send(self.prompt)
+            return True
+        if not line:
+            self.send(self.prompt)
+            return True
+
+        self.device.count("commands")
+        if random.random() < self.profile.disconnect_rate:
+            self.device.count("injected_disconnects")
+            return False
+        if random.random() < self.profile.error_rate:
+            self.send(f"{INVALID_INPUT}\n{self.prompt}")
+            return True
+        time.sleep(self.profile.command_latency)
+
+        words = line.split()
+        command = words[0].lower()
+        if command in ("exit", "logout", "quit") and self.mode in ("user", "enable"):
+            return False
+        if self.mode in ("config", "config-if"):
+            self.handle_config(line, command)
+        elif command in ("enable", "en"):
+            if self.mode == "user":
+                self.awaiting_secret = True
+                self.send("Password: ")
+                return True
+        elif command == "disable":
+            self.mode = "user"
+        elif command == "terminal":
+            pass
+        elif line.startswith(("configure terminal", "conf t")) and self.mode == "enable":
+            self.mode = "config"
+            self.send("Enter configuration commands, one per line.  End with CNTL/Z.\n")
+        elif line.startswith(("write", "copy running-config startup-config")) and self.mode == "enable":
+            time.sleep(self.profile.save_latency)
+            self.device.count("saves")
+            self.send("Building configuration...\n[OK]\n")
+        elif command == "show":
+            self.send(self.show(line) + "\n", delayed=True)
+        else:
+            self.send(f"{INVALID_INPUT}\n")
+        self.send(self.prompt)
+        return True
+
+    def handle_config(self, line: str, command: str) -> None:
+        if command == "end":
+            self.mode = "enable"
+        elif command == "exit":
+            self.mode = "config" if self.mode == "config-if" else "enable"
+        elif command == "interface":
+            self.mode = "config-if"
+            self.device.running_config.append(line)
+        else:
+            self.device.running_config.append(line)
+            self.device.count("config_lines")
+
+    def show(self, line: str) -> str:
+        canned = self.profile.outputs.get(line)
+        if canned is not None:
+            return canned.format(hostname=self.device.hostname)
+        if line == "show running-config" or line.startswith("show run"):
+            return "\n".join(["!", f"hostname {self.device.hostname}"] + self.device.running_config + ["end"])
+        return render_output(line, self.profile.output_lines)
+
+
+class DeviceFarm:
+    """Runs many virtual devices on localhost, one listening port per device."""
+
+    def __init__(self, profile: Optional[DeviceProfile] = None, host: str = "127.0.0.1"):
+        self.profile = profile or DeviceProfile()
+        self.host = host
+        self.devices: List[VirtualDevice] = []
+        self._host_key = paramiko.RSAKey.generate(2048)
+        self._selector = selectors.DefaultSelector()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self, count: int, base_port: int = 0) -> "DeviceFarm":
+        """Starts `count` devices.
+
+        Args:
+            count (int): Number of virtual devices.
+            base_port (int): First port to use; 0 picks free ephemeral ports.
+
+        Returns:
+            DeviceFarm: The running farm.
+        """
+        for index in range(count):
+            listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            listener.bind((self.host, base_port + index if base_port else 0))
+            listener.listen(64)
+            listener.setblocking(False)
+            device = VirtualDevice(f"R{index + 1}", listener, self.profile)
+            self.devices.append(device)
+            self._selector.register(listener, selectors.EVENT_READ, device)
+        self._thread = threading.Thread(target=self._accept_loop, name="device-farm", daemon=True)
+        self._thread.start()
+        logger.info(f"Device farm started: {count} devices on {self.host}")
+        return self
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._thread:
+            self._thread.join()
+        for device in self.devices:
+            self._selector.unregister(device.listener)
+            device.listener.close()
+        self._selector.close()
+
+    def endpoints(self) -> List[Dict[str, object]]:
+        """Connection parameters of every device, usable as NetAgent arguments."""
+        return [
+            {"host": self.host, "port": device.port, "hostname": device.hostname, "device_type": "cisco_ios",
+             "username": self.profile.username, "password": self.profile.password}
+            for device in self.devices
+        ]
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {device.hostname: dict(vars(device.stats)) for device in self.devices}
+
+    def _accept_loop(self) -> None:
+        while not self._stopped.is_set():
+            for key, _ in self._selector.select(timeout=0.2):
+                device: VirtualDevice = key.data
+                try:
+                    client, _ = device.listener.accept()
+                except BlockingIOError:
+                    continue
+                client.setblocking(True)
+                if not device.try_open_session():
+                    # All VTY lines busy: drop the connection like a saturated device
+                    client.close()
+                    continue
+                threading.Thread(target=self._serve, args=(device, client), daemon=True).start()
+
+    def _serve(self, device: VirtualDevice, client: socket.socket) -> None:
+        transport = paramiko.Transport(client)
+        transport.set_log_channel(TRANSPORT_LOG_CHANNEL)
+        try:
+            transport.add_server_key(self._host_key)
+            server = _DeviceServer(device)
+            transport.start_server(server=server)
+            channel = transport.accept(timeout=30)
+            if channel is None or not server.shell_requested.wait(10):
+                return
+            _CliSession(device, channel).run()
+        except (paramiko.SSHException, EOFError, OSError) as e:
+            logger.debug(f"Session on {device.hostname} ended: {str(e)}")
+        finally:
+            transport.close()
+            device.close_session()
+
+
+def load_test(farm: DeviceFarm, rounds: int, concurrency: int, command: str = "show version") -> Dict[str, float]:
+    """Fans netmiko_show out over every device of the farm through the tools layer.
+
+    Args:
+        farm (DeviceFarm): Running farm.
+        rounds (int): Number of times every device is queried.
+        concurrency (int): Number of calls run in parallel.
+        command (str): Show command to run.
+
+    Returns:
+        Dict[str, float]: Calls, errors, wall time, throughput and mean/max call latency.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from tools import netmiko_show
+    from result_store import get_result_store
+
+    store = get_result_store()
+
+    def call(endpoint: Dict[str, object]) -> Tuple[float, bool]:
+        started = time.perf_counter()
+        with store.collect() as handles:
+            output = netmiko_show(endpoint["host"], command, endpoint["username"], endpoint["password"],
+                                  endpoint["device_type"], endpoint["port"])
+        for handle in handles:
+            store.delete(handle)
+        return time.perf_counter() - started, not output.startswith("Error")
+
+    targets = farm.endpoints() * rounds
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(call, targets))
+    wall_time = time.perf_counter() - started
+    latencies = [latency for latency, _ in results]
+    return {
+        "calls": len(results),
+        "errors": sum(1 for _, ok in results if not ok),
+        "wall_time": wall_time,
+        "throughput": len(results) / wall_time if wall_time else 0.0,
+        "mean_latency": sum(latencies) / len(latencies) if latencies else 0.0,
+        "max_latency": max(latencies, default=0.0),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run a farm of simulated cisco_ios SSH devices.")
+    parser.add_argument("--devices", type=int, default=10, help="Number of virtual devices")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Address to bind to")
+    parser.add_argument("--base-port", type=int, default=10022, help="Port of the first device (0 for ephemeral)")
+    parser.add_argument("--login-latency", type=float, default=0.0, help="Login delay in seconds")
+    parser.add_argument("--byte-delay", type=float, default=0.0, help="Output delay per byte in seconds")
+    parser.add_argument("--command-latency", type=float, default=0.0, help="Delay before command output in seconds")
+    parser.add_argument("--max-vty", type=int, default=5, help="Concurrent sessions per device")
+    parser.add_argument("--output-lines", type=int, default=48, help="Lines of generated show output")
+    parser.add_argument("--auth-failure-rate", type=float, default=0.0, help="Probability of a rejected login")
+    parser.add_argument("--disconnect-rate", type=float, default=0.0, help="Probability of a dropped session per command")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Probability of an IOS error per command")
+    parser.add_argument("--load-test", type=int, default=0, metavar="ROUNDS",
+                        help="Query every device ROUNDS times through netmiko_show, report and exit")
+    parser.add_argument("--concurrency", type=int, default=16, help="Parallel calls during --load-test")
+    args = parser.parse_args()
+
+    profile = DeviceProfile(
+        login_latency=args.login_latency,
+        byte_delay=args.byte_delay,
+        command_latency=args.command_latency,
+        max_vty=args.max_vty,
+        output_lines=args.output_lines,
+        auth_failure_rate=args.auth_failure_rate,
+        disconnect_rate=args.disconnect_rate,
+        error_rate=args.error_rate,
+    )
+    farm = DeviceFarm(profile, args.host).start(args.devices, args.base_port)
+    if args.load_test:
+        print(load_test(farm, args.load_test, args.concurrency))
+        print(farm.stats())
+        farm.stop()
+        return
+    for endpoint in farm.endpoints():
+        print(f"{endpoint['hostname']}: {endpoint['host']}:{endpoint['port']}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        farm.stop()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    main()
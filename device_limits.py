@@ -0,0 +1,306 @@
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Callable, Deque, Dict, Generator, Optional
+from config import SystemConfig
+from metrics import DEVICE_WAIT_DURATION
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+
+class DeviceBusyError(TimeoutError):
+    """Raised when a device session slot could not be obtained in time."""
+
+
+@dataclass
+class DeviceLimit:
+    """Session and command rate limits applied to a single device.
+
+    Attributes:
+        max_sessions (int): Concurrent SSH sessions allowed (VTY lines reserved for us).
+        rate (float): Commands per second allowed on the device.
+        burst (int): Commands that may be sent back-to-back before rate limiting applies.
+    """
+    max_sessions: int = 2
+    rate: float = 2.0
+    burst: int = 2
+
+    def __post_init__(self):
+        if self.max_sessions < 1:
+            raise ValueError(f"max_sessions must be positive, got {self.max_sessions}")
+        if self.rate <= 0:
+            raise ValueError(f"rate must be positive, got {self.rate}")
+        if self.burst < 1:
+            raise ValueError(f"burst must be positive, got {self.burst}")
+
+
+class FairSemaphore:
+    """Counting semaphore that grants permits strictly in arrival order."""
+
+    def __init__(self, permits: int):
+        self._permits = permits
+        self._cond = threading.Condition()
+        self._waiters: Deque[object] = deque()
+
+    def acquire(self, timeout: Optional[float] = None) -> bool:
+        """Waits for a permit.
+
+        Args:
+            timeout (Optional[float]): Maximum time to wait in seconds; None waits forever.
+
+        Returns:
+            bool: True if the permit was granted, False on timeout.
+        """
+        ticket = object()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            self._waiters.append(ticket)
+            try:
+                while self._waiters[0] is not ticket or self._permits == 0:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        return False
+                    self._cond.wait(remaining)
+                self._permits -= 1
+                return True
+            finally:
+                self._waiters.remove(ticket)
+                self._cond.notify_all()
+
+    def release(self) -> None:
+        """Returns a permit and wakes the next waiter."""
+        with self._cond:
+            self._permits += 1
+            self._cond.notify_all()
+
+    @property
+    def waiting(self) -> int:
+        """Number of threads currently queued for a permit."""
+        with self._cond:
+            return len(self._waiters)
+
+
+class TokenBucket:
+    """Token bucket that hands out reservations in arrival order.
+
+    Each call reserves the next free token and sleeps until it becomes available,
+    so concurrent callers are served first-come, first-served.
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self._lock = threading.Lock()
+        self._next_free = time.monotonic()
+
+    def acquire(self) -> float:
+        """Blocks until a token is available.
+
+        Returns:
+            float: Seconds spent waiting for the token.
+        """
+        interval = 1.0 / self.rate
+        with self._lock:
+            now = time.monotonic()
+            # Unused capacity accumulates up to `burst` tokens
+            self._next_free = max(self._next_free, now - (self.burst - 1) * interval)
+            delay = max(0.0, self._next_free - now)
+            self._next_free += interval
+        if delay:
+            time.sleep(delay)
+        return delay
+
+
+@dataclass
+class _DeviceSlot:
+    """Limiter state and accumulated timings for a single host."""
+    limit: DeviceLimit
+    sessions: FairSemaphore
+    bucket: TokenBucket
+    active: int = 0
+    session_wait: float = 0.0
+    rate_wait: float = 0.0
+    command_time: float = 0.0
+    commands: int = 0
+
+
+@dataclass
+class SessionTicket:
+    """Timings of a single limited session, filled in as the session progresses."""
+    host: str
+    session_wait: float = 0.0
+    rate_wait: float = 0.0
+    command_time: float = 0.0
+
+
+class DeviceLimiter:
+    """Per-device session semaphores and command rate limiters.
+
+    Limits are looked up by inventory group first, then by device_type, and fall back
+    to the default limit. The group of a host is obtained through `group_resolver`.
+    """
+
+    def __init__(
+        self,
+        limits: Optional[Dict[str, DeviceLimit]] = None,
+        default: Optional[DeviceLimit] = None,
+        wait_timeout: Optional[float] = None,
+        group_resolver: Optional[Callable[[str], Optional[str]]] = None,
+    ):
+        """Initializes the limiter.
+
+        Args:
+            limits (Optional[Dict[str, DeviceLimit]]): Limits keyed by inventory group or device_type.
+            default (Optional[DeviceLimit]): Limit for devices matching no key.
+            wait_timeout (Optional[float]): Maximum time to wait for a session slot; None waits forever.
+            group_resolver (Optional[Callable[[str], Optional[str]]]): Maps a host to its inventory group.
+        """
+        self.limits = dict(limits or {})
+        self.default = default or DeviceLimit()
+        self.wait_timeout = wait_timeout
+        self.group_resolver = group_resolver
+        self._slots: Dict[str, _DeviceSlot] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(
+        cls, config: SystemConfig, group_resolver: Optional[Callable[[str], Optional[str]]] = None
+    ) -> "DeviceLimiter":
+        """Builds a limiter from the device limit settings of a SystemConfig.
+
+        Args:
+            config (SystemConfig): Configuration object.
+            group_resolver (Optional[Callable[[str], Optional[str]]]): Maps a host to its inventory
+                group; None looks hosts up in the process-wide inventory.
+
+        Returns:
+            DeviceLimiter: Limiter with the configured per-group/device_type limits.
+        """
+        return cls(
+            limits={key: DeviceLimit(**value) for key, value in config.device_limits.items()},
+            default=DeviceLimit(**config.default_device_limit),
+            wait_timeout=config.device_session_wait_timeout,
+            group_resolver=group_resolver or _inventory_group,
+        )
+
+    def policy_for(self, host: str, device_type: Optional[str] = None) -> DeviceLimit:
+        """Returns the limit applying to a host."""
+        group = self.group_resolver(host) if self.group_resolver else None
+        for key in (group, device_type):
+            if key is not None and key in self.limits:
+                return self.limits[key]
+        return self.default
+
+    def _slot(self, host: str, device_type: Optional[str]) -> _DeviceSlot:
+        with self._lock:
+            slot = self._slots.get(host)
+            if slot is None:
+                limit = self.policy_for(host, device_type)
+                slot = _DeviceSlot(limit, FairSemaphore(limit.max_sessions), TokenBucket(limit.rate, limit.burst))
+                self._slots[host] = slot
+            return slot
+
+    @contextmanager
+    def session(self, host: str, device_type: Optional[str] = None) -> Generator[SessionTicket, None, None]:
+        """Holds one of the device's session slots for the duration of the block.
+
+        Args:
+            host (str): Device address.
+            device_type (Optional[str]): Netmiko device type, used to select the limit.
+
+        Yields:
+            SessionTicket: Timings of the session; `command()` blocks fill in the rest.
+
+        Raises:
+            DeviceBusyError: If no slot became free within `wait_timeout`.
+        """
+        slot = self._slot(host, device_type)
+        ticket = SessionTicket(host)
+        started = time.monotonic()
+        with span("device.wait_session", host=host):
+            acquired = slot.sessions.acquire(self.wait_timeout)
+        if not acquired:
+            raise DeviceBusyError(
+                f"Timed out after {self.wait_timeout}s waiting for a session slot on {host} "
+                f"(max_sessions={slot.limit.max_sessions})"
+            )
+        ticket.session_wait = time.monotonic() - started
+        DEVICE_WAIT_DURATION.labels(kind="session").observe(ticket.session_wait)
+        with self._lock:
+            slot.active += 1
+            slot.session_wait += ticket.session_wait
+        try:
+            yield ticket
+        finally:
+            with self._lock:
+                slot.active -= 1
+                slot.rate_wait += ticket.rate_wait
+                slot.command_time += ticket.command_time
+            slot.sessions.release()
+            logger.info(
+                f"Session on {host}: waited {ticket.session_wait:.3f}s for slot, "
+                f"{ticket.rate_wait:.3f}s for rate limit, commands took {ticket.command_time:.3f}s"
+            )
+
+    @contextmanager
+    def command(self, ticket: SessionTicket) -> Generator[None, None, None]:
+        """Rate-limits a command sent within a session and times its execution."""
+        slot = self._slot(ticket.host, None)
+        with span("device.wait_rate", host=ticket.host):
+            rate_wait = slot.bucket.acquire()
+        ticket.rate_wait += rate_wait
+        DEVICE_WAIT_DURATION.labels(kind="rate").observe(rate_wait)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            ticket.command_time += time.monotonic() - started
+            with self._lock:
+                slot.commands += 1
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """Returns per-device session usage and wait/command time totals."""
+        with self._lock:
+            return {
+                host: {
+                    "max_sessions": slot.limit.max_sessions,
+                    "active_sessions": slot.active,
+                    "waiting": slot.sessions.waiting,
+                    "commands": slot.commands,
+                    "session_wait_seconds": slot.session_wait,
+                    "rate_wait_seconds": slot.rate_wait,
+                    "command_seconds": slot.command_time,
+                }
+                for host, slot in self._slots.items()
+            }
+
+
+_limiter: Optional[DeviceLimiter] = None
+_limiter_lock = threading.Lock()
+
+
+def _inventory_group(host: str) -> Optional[str]:
+    # Imported here: the inventory itself takes device sessions for fingerprinting
+    from inventory import get_inventory
+
+    return get_inventory().group_of(host)
+
+
+def configure_device_limiter(limiter: DeviceLimiter) -> None:
+    """Replaces the process-wide DeviceLimiter."""
+    global _limiter
+    with _limiter_lock:
+        _limiter = limiter
+
+
+def get_device_limiter() -> DeviceLimiter:
+    """Returns the process-wide DeviceLimiter, creating it from SystemConfig defaults if needed."""
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = DeviceLimiter.from_config(SystemConfig())
+        return _limiter
@@ -0,0 +1,28 @@
+import contextvars
+from contextlib import contextmanager
+from typing import Any, Generator, Optional
+
+# Device sessions shared by the work the current context belongs to (e.g. a query batch); an
+# object with `show(host, port, params, command) -> str` and `invalidate(host, port)`, called
+# after a set operation on the device, or None for a session per command
+_current_sessions: contextvars.ContextVar[Optional[Any]] = contextvars.ContextVar("device_sessions", default=None)
+
+
+def current_device_sessions() -> Optional[Any]:
+    """Returns the device sessions the current context runs show commands through, if any."""
+    return _current_sessions.get()
+
+
+@contextmanager
+def using_device_sessions(sessions: Any) -> Generator[None, None, None]:
+    """Runs the show commands of the block through shared device sessions.
+
+    Args:
+        sessions (Any): Provides `show(host, port, params, command) -> str` and `invalidate(host, port)`
+            (see query_batch.DeviceSessions).
+    """
+    token = _current_sessions.set(sessions)
+    try:
+        yield
+    finally:
+        _current_sessions.reset(token)
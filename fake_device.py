@@ -0,0 +1,128 @@
+"""In-process fake device backend for offline benchmarks.
+
+Replaces Netmiko connections and the ping command with stand-ins whose latency and
+output size are configurable, so the NetAgent layer and the tools can be exercised
+without network access.
+"""
+import logging
+import subprocess
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List
+
+import DoNetAgent
+import tools
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class FakeDeviceSettings:
+    """Behaviour of the fake devices.
+
+    Attributes:
+        connect_latency (float): Time to open a session (SSH handshake, login, enable) in seconds.
+        command_latency (float): Time to run a command in seconds.
+        ping_latency (float): Time for a ping round-trip in seconds.
+        output_lines (int): Number of lines returned by a show command.
+        unreachable (bool): Make every ping fail.
+    """
+    connect_latency: float = 0.0
+    command_latency: float = 0.0
+    ping_latency: float = 0.0
+    output_lines: int = 48
+    unreachable: bool = False
+
+
+def render_output(command: str, lines: int) -> str:
+    """Builds a show command output of the requested size."""
+    if "interface" in command:
+        header = "Interface        Admin  Oper  Speed   Description"
+        rows = [f"ge-0/0/{i:<10} up     {'up' if i % 7 else 'down':<5} 1000M   uplink-{i}" for i in range(lines)]
+    elif "bgp" in command:
+        header = "Neighbor        AS     State        Up/Down   PfxRcd"
+        rows = [f"10.0.{i // 250}.{i % 250 + 1:<8} {65000 + i:<6} Established  1d02h     {i * 3}" for i in range(lines)]
+    else:
+        header = f"{command}"
+        rows = [f"entry {i}: value {i * 17 % 101}" for i in range(lines)]
+    return "\n".join([header] + rows)
+
+
+class FakeConnection:
+    """Stand-in for a Netmiko connection exposing the methods NetAgent uses."""
+
+    def __init__(self, backend: "FakeDeviceBackend", host: str, username: str = "", **_: Any):
+        self.backend = backend
+        self.host = host
+        self.username = username
+        time.sleep(backend.settings.connect_latency)
+        backend._count("connects")
+
+    def enable(self) -> str:
+        return ""
+
+    def find_prompt(self) -> str:
+        return f"{self.username or 'admin'}@sw-{self.host.replace('.', '-')}#"
+
+    def send_command(self, command: str, **_: Any) -> str:
+        time.sleep(self.backend.settings.command_latency)
+        self.backend._count("commands")
+        return render_output(command, self.backend.settings.output_lines)
+
+    def config_mode(self) -> str:
+        return ""
+
+    def send_config_set(self, commands: List[str], **_: Any) -> str:
+        time.sleep(self.backend.settings.command_latency)
+        self.backend._count("commands")
+        prompt = self.find_prompt().rstrip("#")
+        return "\n".join(f"{prompt}(config)# {command}" for command in commands)
+
+    def commit(self) -> str:
+        return ""
+
+    def exit_config_mode(self) -> str:
+        return ""
+
+    def save_config(self) -> str:
+        self.backend._count("saves")
+        return ""
+
+    def disconnect(self) -> None:
+        self.backend._count("disconnects")
+
+
+class FakeDeviceBackend:
+    """Installs fake connections and ping in place of Netmiko and the ping command."""
+
+    def __init__(self, settings: FakeDeviceSettings):
+        self.settings = settings
+        self.counters: Dict[str, int] = {"connects": 0, "commands": 0, "disconnects": 0, "pings": 0, "saves": 0}
+        self._lock = threading.Lock()
+
+    def _count(self, key: str) -> None:
+        with self._lock:
+            self.counters[key] += 1
+
+    def connect(self, **device: Any) -> FakeConnection:
+        """Connection factory with Netmiko's ConnectHandler signature."""
+        return FakeConnection(self, **device)
+
+    def ping(self, command: List[str], host: str) -> subprocess.CompletedProcess:
+        """Ping runner with the signature of tools._run_subprocess."""
+        time.sleep(self.settings.ping_latency)
+        self._count("pings")
+        if self.settings.unreachable:
+            return subprocess.CompletedProcess(command + [host], 1, "", "Destination Host Unreachable")
+        return subprocess.CompletedProcess(command + [host], 0, f"64 bytes from {host}: icmp_seq=1", "")
+
+    def install(self) -> "FakeDeviceBackend":
+        DoNetAgent.configure_connection_factory(self.connect)
+        tools.configure_ping_runner(self.ping)
+        logger.info("Fake device backend installed")
+        return self
+
+    def uninstall(self) -> None:
+        DoNetAgent.configure_connection_factory(None)
+        tools.configure_ping_runner(None)
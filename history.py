@@ -0,0 +1,236 @@
+import difflib
+import hashlib
+import logging
+import threading
+import time
+import zlib
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from config import SystemConfig
+from poller import normalize_command
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(slots=True)
+class HistoryEntry:
+    """A distinct output of a command on a device.
+
+    Attributes:
+        digest (str): SHA-256 of the output; identical outputs share one stored blob.
+        first_seen (float): Time the output was first recorded.
+        last_seen (float): Time the same output was last recorded.
+        size (int): Length of the output in characters.
+        analysis (Optional[str]): Analysis produced for the output, as JSON.
+    """
+    digest: str
+    first_seen: float
+    last_seen: float
+    size: int
+    analysis: Optional[str] = None
+
+
+@dataclass(frozen=True, slots=True)
+class OutputDelta:
+    """Line-level difference between the previous and the current output of a command.
+
+    Attributes:
+        previous (HistoryEntry): Entry the output is compared with.
+        added (int): Lines only in the current output.
+        removed (int): Lines only in the previous output.
+        unchanged (int): Lines in both.
+        diff (str): Unified diff, without file headers.
+    """
+    previous: HistoryEntry
+    added: int
+    removed: int
+    unchanged: int
+    diff: str
+
+    @property
+    def changed(self) -> bool:
+        return bool(self.added or self.removed)
+
+    def render(self) -> str:
+        """Short description of the change for the analyzer prompt."""
+        if not self.changed:
+            return f"Без изменений ({self.unchanged} строк)."
+        return f"+{self.added} / -{self.removed} строк, без изменений {self.unchanged}:\n{self.diff}"
+
+
+def diff_outputs(previous: str, current: str, context: int = 1) -> Tuple[int, int, int, str]:
+    """Compares two outputs line by line.
+
+    Returns:
+        Tuple[int, int, int, str]: Added, removed and unchanged line counts, and a unified diff.
+    """
+    old_lines, new_lines = previous.splitlines(), current.splitlines()
+    added = removed = 0
+    diff: List[str] = []
+    for line in difflib.unified_diff(old_lines, new_lines, n=context, lineterm=""):
+        if line.startswith(("---", "+++")):
+            continue
+        if line.startswith("+"):
+            added += 1
+        elif line.startswith("-"):
+            removed += 1
+        diff.append(line)
+    return added, removed, len(new_lines) - added, "\n".join(diff)
+
+
+class OutputHistory:
+    """Recent outputs per (device, command), compressed and deduplicated.
+
+    Every distinct output is stored once, zlib-compressed and reference-counted, so repeated
+    runs of a mostly static command cost a digest and a timestamp. Keys are evicted least
+    recently recorded first when `max_keys` or `max_bytes` (compressed) is exceeded.
+    """
+
+    def __init__(self, max_entries: int, max_keys: int, max_bytes: int, diff_context: int = 1):
+        """Initializes the history.
+
+        Args:
+            max_entries (int): Distinct outputs kept per (device, command).
+            max_keys (int): Maximum number of (device, command) pairs.
+            max_bytes (int): Maximum total size of the compressed outputs.
+            diff_context (int): Unchanged lines shown around each change in deltas.
+
+        Raises:
+            ValueError: If a limit is not positive.
+        """
+        if max_entries < 1 or max_keys < 1 or max_bytes < 1 or diff_context < 0:
+            raise ValueError("Output history limits must be positive")
+        self.max_entries = max_entries
+        self.max_keys = max_keys
+        self.max_bytes = max_bytes
+        self.diff_context = diff_context
+        self._entries: "OrderedDict[Tuple[str, str], Deque[HistoryEntry]]" = OrderedDict()
+        # digest -> [compressed output, reference count]
+        self._blobs: Dict[str, List[Any]] = {}
+        self._bytes = 0
+        self._raw_bytes = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config: SystemConfig) -> "OutputHistory":
+        return cls(config.history_max_entries, config.history_max_keys, config.history_max_bytes,
+                   config.history_diff_context)
+
+    @staticmethod
+    def _key(device: str, command: str) -> Tuple[str, str]:
+        return device, normalize_command(command)
+
+    def _load(self, digest: str) -> str:
+        return zlib.decompress(self._blobs[digest][0]).decode("utf-8")
+
+    def _release(self, entry: HistoryEntry) -> None:
+        blob = self._blobs[entry.digest]
+        blob[1] -= 1
+        if blob[1] == 0:
+            self._bytes -= len(blob[0])
+            self._raw_bytes -= entry.size
+            del self._blobs[entry.digest]
+
+    def latest(self, device: str, command: str) -> Optional[HistoryEntry]:
+        """Returns the most recent entry of a command on a device, if any."""
+        with self._lock:
+            entries = self._entries.get(self._key(device, command))
+            return entries[-1] if entries else None
+
+    def record(self, device: str, command: str, output: str,
+               collected_at: Optional[float] = None) -> Tuple[HistoryEntry, Optional[OutputDelta]]:
+        """Stores an output and compares it with the previous one.
+
+        Args:
+            device (str): Device key (`host` or `host:port`).
+            command (str): Show command.
+            output (str): Command output.
+            collected_at (Optional[float]): Collection time; defaults to now.
+
+        Returns:
+            Tuple[HistoryEntry, Optional[OutputDelta]]: The entry of the output, and its
+                delta against the previous output (None on the first run).
+        """
+        collected_at = collected_at or time.time()
+        digest = hashlib.sha256(output.encode("utf-8")).hexdigest()
+        key = self._key(device, command)
+        with self._lock:
+            entries = self._entries.get(key)
+            previous = entries[-1] if entries else None
+            if previous is not None and previous.digest == digest:
+                # Same output as last time: nothing to store or diff
+                delta = OutputDelta(HistoryEntry(previous.digest, previous.first_seen, previous.last_seen,
+                                                 previous.size, previous.analysis),
+                                    0, 0, len(output.splitlines()), "")
+                previous.last_seen = collected_at
+                self._entries.move_to_end(key)
+                return previous, delta
+            previous_output = self._load(previous.digest) if previous is not None else None
+            if digest in self._blobs:
+                self._blobs[digest][1] += 1
+            else:
+                compressed = zlib.compress(output.encode("utf-8"))
+                self._blobs[digest] = [compressed, 1]
+                self._bytes += len(compressed)
+                self._raw_bytes += len(output)
+            entry = HistoryEntry(digest, collected_at, collected_at, len(output))
+            if entries is None:
+                entries = self._entries[key] = deque()
+            entries.append(entry)
+            while len(entries) > self.max_entries:
+                self._release(entries.popleft())
+            self._entries.move_to_end(key)
+            self._evict(keep=key)
+        if previous_output is None:
+            return entry, None
+        # Diff outside the lock; large tables take a while
+        added, removed, unchanged, diff = diff_outputs(previous_output, output, self.diff_context)
+        return entry, OutputDelta(previous, added, removed, unchanged, diff)
+
+    def annotate(self, device: str, command: str, digest: str, analysis: str) -> None:
+        """Attaches an analysis to the entry of an output, so later deltas can refer to it."""
+        with self._lock:
+            for entry in self._entries.get(self._key(device, command), ()):
+                if entry.digest == digest:
+                    entry.analysis = analysis
+
+    def _evict(self, keep: Tuple[str, str]) -> None:
+        while len(self._entries) > 1 and (len(self._entries) > self.max_keys or self._bytes > self.max_bytes):
+            oldest = next(iter(self._entries))
+            if oldest == keep:
+                break
+            for entry in self._entries.pop(oldest):
+                self._release(entry)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "keys": len(self._entries),
+                "entries": sum(len(entries) for entries in self._entries.values()),
+                "blobs": len(self._blobs),
+                "bytes": self._bytes,
+                "raw_bytes": self._raw_bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+
+_history: Optional[OutputHistory] = None
+_history_lock = threading.Lock()
+
+
+def configure_output_history(history: OutputHistory) -> None:
+    """Replaces the process-wide output history."""
+    global _history
+    with _history_lock:
+        _history = history
+
+
+def get_output_history() -> OutputHistory:
+    """Returns the process-wide output history, creating it from SystemConfig defaults if needed."""
+    global _history
+    with _history_lock:
+        if _history is None:
+            _history = OutputHistory.from_config(SystemConfig())
+        return _history
@@ -0,0 +1,286 @@
+import json
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import yaml
+
+from config import SystemConfig
+from device_limits import get_device_limiter
+from metrics import INVENTORY_FINGERPRINTS
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+AUTODETECT = "autodetect"
+
+
+def device_key(host: str, port: int = 22) -> str:
+    """Identifies a device; non-standard ports distinguish devices sharing an address."""
+    return host if port == 22 else f"{host}:{port}"
+
+
+@dataclass(slots=True)
+class Credentials:
+    """Login data referenced by inventory entries."""
+    username: str
+    password: str
+
+
+@dataclass(slots=True)
+class Device:
+    """An inventory entry.
+
+    Attributes:
+        host (str): IP address or hostname.
+        port (int): SSH port.
+        name (Optional[str]): Device name.
+        group (Optional[str]): Inventory group, also used to select device limits.
+        credentials (str): Name of the credentials entry.
+        platform (Optional[str]): Netmiko device_type; None or "autodetect" to fingerprint the device.
+    """
+    host: str
+    port: int = 22
+    name: Optional[str] = None
+    group: Optional[str] = None
+    credentials: str = "default"
+    platform: Optional[str] = None
+
+    @property
+    def key(self) -> str:
+        return device_key(self.host, self.port)
+
+
+def _ssh_detect(host: str, port: int, username: str, password: str) -> Optional[str]:
+    """Fingerprints a device with Netmiko's SSHDetect."""
+    from netmiko import SSHDetect
+
+    detector = SSHDetect(device_type=AUTODETECT, host=host, port=port, username=username, password=password)
+    try:
+        return detector.autodetect()
+    finally:
+        detector.connection.disconnect()
+
+
+class FingerprintCache:
+    """Detected device types persisted to a JSON file, keyed by device key."""
+
+    def __init__(self, path: Optional[str]):
+        """Loads the cache.
+
+        Args:
+            path (Optional[str]): JSON file; None keeps fingerprints in memory only.
+        """
+        self.path = Path(path) if path else None
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        if self.path and self.path.exists():
+            try:
+                self._entries = json.loads(self.path.read_text())
+            except (OSError, json.JSONDecodeError) as e:
+                logger.warning(f"Ignoring unreadable fingerprint cache {self.path}: {str(e)}")
+
+    def get(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        return entry["device_type"] if entry else None
+
+    def set(self, key: str, device_type: str) -> None:
+        """Stores a fingerprint and rewrites the file atomically."""
+        with self._lock:
+            self._entries[key] = {"device_type": device_type, "detected_at": time.time()}
+            if self.path:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                tmp = self.path.with_suffix(self.path.suffix + ".tmp")
+                tmp.write_text(json.dumps(self._entries, indent=2, sort_keys=True))
+                os.replace(tmp, self.path)
+
+
+class Inventory:
+    """Devices, groups and credentials loaded from an inventory file.
+
+    The file is YAML (or JSON) with three sections:
+
+        credentials:
+          core: {username: admin, password_env: CORE_PASSWORD}
+        groups:
+          core: {credentials: core, platform: cisco_ios}
+        devices:
+          - {host: 10.0.0.1, name: core-sw1, group: core}
+          - {host: 10.0.0.2, group: access, platform: autodetect}
+
+    Device fields left out are taken from the device's group. Devices without a platform
+    are fingerprinted once; the result is kept in the FingerprintCache so later queries,
+    and later processes, skip detection. Hosts missing from the inventory use the
+    `default` credentials and `default_platform`.
+    """
+
+    def __init__(
+        self,
+        devices: List[Device],
+        credentials: Dict[str, Credentials],
+        fingerprints: FingerprintCache,
+        default_platform: str = "cisco_ios",
+        detector: Optional[Callable[[str, int, str, str], Optional[str]]] = None,
+    ):
+        """Builds the lookup indexes.
+
+        Args:
+            devices (List[Device]): Inventory entries.
+            credentials (Dict[str, Credentials]): Credentials by name; "default" applies to unknown hosts.
+            fingerprints (FingerprintCache): Cache of detected device types.
+            default_platform (str): device_type of unknown hosts ("autodetect" to fingerprint them too).
+            detector (Optional[Callable]): Returns the device_type of (host, port, username, password).
+
+        Raises:
+            ValueError: If a device references unknown credentials.
+        """
+        self.credentials = dict(credentials)
+        self.fingerprints = fingerprints
+        self.default_platform = default_platform
+        self.detector = detector or _ssh_detect
+        self._by_key: Dict[str, Device] = {}
+        self._by_group: Dict[str, List[Device]] = {}
+        for device in devices:
+            if device.credentials not in self.credentials:
+                raise ValueError(f"Device {device.key} references unknown credentials '{device.credentials}'")
+            self._by_key[device.key] = device
+            if device.group:
+                self._by_group.setdefault(device.group, []).append(device)
+        self._detect_locks: Dict[str, threading.Lock] = {}
+        self._detect_locks_lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path: Optional[str], fingerprints: FingerprintCache, default_credentials: Dict[str, str],
+             default_platform: str = "cisco_ios") -> "Inventory":
+        """Loads an inventory file; a missing file gives an empty inventory.
+
+        Args:
+            path (Optional[str]): Inventory file.
+            fingerprints (FingerprintCache): Cache of detected device types.
+            default_credentials (Dict[str, str]): username/password used when the file defines no "default".
+            default_platform (str): device_type of hosts without a platform in the file.
+
+        Raises:
+            ValueError: If the file is malformed.
+        """
+        data: Dict[str, Any] = {}
+        if path and Path(path).exists():
+            data = yaml.safe_load(Path(path).read_text()) or {}
+            logger.info(f"Inventory loaded from {path}: {len(data.get('devices', []))} devices")
+        credentials = {"default": Credentials(default_credentials["username"], default_credentials["password"])}
+        for name, entry in (data.get("credentials") or {}).items():
+            password = os.environ.get(entry["password_env"], "") if "password_env" in entry else entry.get("password", "")
+            credentials[name] = Credentials(entry["username"], password)
+        groups = data.get("groups") or {}
+        devices = []
+        for entry in data.get("devices") or []:
+            if "host" not in entry:
+                raise ValueError(f"Inventory device without host: {entry}")
+            merged = {**groups.get(entry.get("group"), {}), **entry}
+            devices.append(Device(
+                host=str(merged["host"]),
+                port=int(merged.get("port", 22)),
+                name=merged.get("name"),
+                group=merged.get("group"),
+                credentials=merged.get("credentials", "default"),
+                platform=merged.get("platform"),
+            ))
+        return cls(devices, credentials, fingerprints, data.get("default_platform", default_platform))
+
+    @classmethod
+    def from_config(cls, config: SystemConfig) -> "Inventory":
+        return cls.load(config.inventory_path, FingerprintCache(config.fingerprint_cache_path),
+                        config.default_device_credentials, config.default_device_credentials["device_type"])
+
+    def lookup(self, host: str, port: int = 22) -> Optional[Device]:
+        """Returns the inventory entry of a device, if any."""
+        return self._by_key.get(device_key(host, port))
+
+    def group_of(self, key: str) -> Optional[str]:
+        """Returns the group of a device key (`host` or `host:port`), if any."""
+        device = self._by_key.get(key)
+        return device.group if device else None
+
+    def devices_in(self, group: str) -> List[Device]:
+        """Returns the devices of a group."""
+        return list(self._by_group.get(group, []))
+
+    @property
+    def groups(self) -> List[str]:
+        return list(self._by_group)
+
+    def resolve(self, host: str, port: int = 22) -> Dict[str, Any]:
+        """Returns the connection parameters of a device, fingerprinting it if its platform is unknown.
+
+        Args:
+            host (str): IP address or hostname.
+            port (int): SSH port.
+
+        Returns:
+            Dict[str, Any]: username, password and device_type, plus port if it is not 22.
+
+        Raises:
+            ValueError: If the device type cannot be detected.
+        """
+        device = self.lookup(host, port) or Device(host, port, platform=self.default_platform)
+        credentials = self.credentials[device.credentials]
+        device_type = device.platform
+        if not device_type or device_type == AUTODETECT:
+            device_type = self._fingerprint(device, credentials)
+        params: Dict[str, Any] = {"username": credentials.username, "password": credentials.password,
+                                  "device_type": device_type}
+        if port != 22:
+            params["port"] = port
+        return params
+
+    def _fingerprint(self, device: Device, credentials: Credentials) -> str:
+        cached = self.fingerprints.get(device.key)
+        if cached:
+            INVENTORY_FINGERPRINTS.labels(source="cache").inc()
+            return cached
+        with self._detect_locks_lock:
+            lock = self._detect_locks.setdefault(device.key, threading.Lock())
+        # Concurrent queries for the same device wait for a single detection
+        with lock:
+            cached = self.fingerprints.get(device.key)
+            if cached:
+                INVENTORY_FINGERPRINTS.labels(source="cache").inc()
+                return cached
+            with span("inventory.autodetect", host=device.key):
+                try:
+                    with get_device_limiter().session(device.key):
+                        device_type = self.detector(device.host, device.port, credentials.username, credentials.password)
+                except Exception as e:
+                    INVENTORY_FINGERPRINTS.labels(source="failed").inc()
+                    raise ValueError(f"Не удалось определить тип устройства {device.key}: {str(e)}")
+            if not device_type:
+                INVENTORY_FINGERPRINTS.labels(source="failed").inc()
+                raise ValueError(f"Не удалось определить тип устройства {device.key}")
+            INVENTORY_FINGERPRINTS.labels(source="detected").inc()
+            logger.info(f"Detected device type {device_type} for {device.key}")
+            self.fingerprints.set(device.key, device_type)
+            return device_type
+
+
+_inventory: Optional[Inventory] = None
+_inventory_lock = threading.Lock()
+
+
+def configure_inventory(inventory: Inventory) -> None:
+    """Replaces the process-wide inventory."""
+    global _inventory
+    with _inventory_lock:
+        _inventory = inventory
+
+
+def get_inventory() -> Inventory:
+    """Returns the process-wide inventory, loading it from SystemConfig defaults if needed."""
+    global _inventory
+    with _inventory_lock:
+        if _inventory is None:
+            _inventory = Inventory.from_config(SystemConfig())
+        return _inventory
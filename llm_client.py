@@ -0,0 +1,785 @@
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Callable, Deque, Dict, List, Optional, Sequence, Set, Tuple, TypeVar
+
+import httpx
+import openai
+from autogen.oai.client import OpenAIClient
+
+from config import SystemConfig, DEFAULT_LLM_BACKEND_SLOTS
+from metrics import (
+    LLM_BACKEND_ERRORS, LLM_BACKEND_HEALTHY, LLM_BACKEND_IN_FLIGHT, LLM_BACKEND_REQUEST_DURATION,
+    LLM_CONCURRENCY_LIMIT, LLM_CONCURRENCY_QUEUED, LLM_CONCURRENCY_REJECTED, LLM_CONCURRENCY_WAIT,
+    LLM_PROMPT_CACHED_TOKENS, LLM_SLOT_ASSIGNMENTS,
+)
+from tracing import current_trace_id, span
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Smoothing factor of the per-backend latency moving average
+LATENCY_EWMA_ALPHA = 0.2
+HEALTH_CHECK_TIMEOUT_SECONDS = 5.0
+# Errors that indicate a broken or overloaded backend rather than a bad request
+FAILOVER_ERRORS = (openai.APIConnectionError, openai.APITimeoutError, openai.InternalServerError)
+# Keys of an autogen config_list entry that configure the client rather than the completion request
+CLIENT_ONLY_PARAMS = ("model_client_cls", "base_url", "api_key", "slot_role")
+# Factor applied to the concurrency limit on congestion, and the number of recent successful
+# requests whose minimum latency is the baseline, so it follows a slower model or longer prompts
+CONCURRENCY_BACKOFF = 0.9
+LATENCY_BASELINE_WINDOW = 100
+# Cost of a prompt token relative to a generated one when normalizing latency (prefill is batched)
+PROMPT_TOKEN_WEIGHT = 0.1
+
+
+class NoBackendAvailableError(TimeoutError):
+    """Raised when no LLM backend could take a request in time."""
+
+
+class LLMOverloadedError(NoBackendAvailableError):
+    """Raised when the adaptive concurrency limiter sheds a completion request."""
+
+
+@dataclass(slots=True)
+class ConcurrencyTicket:
+    """A completion request admitted by, or waiting for, the adaptive concurrency limiter."""
+    pipeline: str
+    queued_at: float = field(default_factory=time.monotonic)
+    started_at: float = 0.0
+    in_flight_at_start: int = 0
+    granted: bool = False
+
+
+def token_cost(usage: Any) -> Optional[float]:
+    """Work of a completion in generated-token equivalents, from its usage; None if unknown."""
+    if usage is None:
+        return None
+    return (getattr(usage, "completion_tokens", 0) or 0) + PROMPT_TOKEN_WEIGHT * (getattr(usage, "prompt_tokens", 0) or 0)
+
+
+class AdaptiveConcurrencyLimiter:
+    """AIMD limit on concurrent completion requests, found from observed latency.
+
+    A backend with a fixed number of slots gets no faster past them; extra requests only
+    queue on the server and eventually time out. The limit grows by one per limit's worth of
+    requests (about one per round-trip) while the limit is in use and latency stays within
+    `tolerance` times the best latency of the last LATENCY_BASELINE_WINDOW successes, and shrinks by CONCURRENCY_BACKOFF, at most once
+    per round-trip, when latency exceeds it while the limit is in use or requests fail. Latency
+    is taken per token when the response reports usage, so long answers are not mistaken for
+    congestion.
+
+    Requests over the limit wait here and are admitted round-robin across pipelines (traces),
+    so one pipeline's burst does not starve the others. A request is rejected with
+    LLMOverloadedError when `max_queue` requests are already waiting or it waited `queue_timeout`.
+    """
+
+    def __init__(self, initial: int, min_limit: int, max_limit: int, tolerance: float = 2.0,
+                 queue_timeout: float = 300.0, max_queue: int = 256):
+        """Initializes the limiter.
+
+        Args:
+            initial (int): Starting limit, normally the total slots of the backends.
+            min_limit (int): Lowest limit.
+            max_limit (int): Highest limit.
+            tolerance (float): Latency multiple of the baseline treated as congestion.
+            queue_timeout (float): Seconds a request may wait for admission.
+            max_queue (int): Requests allowed to wait at once.
+
+        Raises:
+            ValueError: If the limits are inconsistent.
+        """
+        if not (1 <= min_limit <= max_limit) or tolerance <= 1.0 or queue_timeout <= 0 or max_queue < 1:
+            raise ValueError("Invalid adaptive concurrency limits")
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.tolerance = tolerance
+        self.queue_timeout = queue_timeout
+        self.max_queue = max_queue
+        self.limit = float(min(max(initial, min_limit), max_limit))
+        self.baseline: Optional[float] = None
+        self._latencies: Deque[float] = deque(maxlen=LATENCY_BASELINE_WINDOW)
+        self.in_flight = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.increases = 0
+        self.decreases = 0
+        self._last_decrease = 0.0
+        self._queues: Dict[str, Deque[ConcurrencyTicket]] = {}
+        # Pipelines with waiting requests, in round-robin order
+        self._order: Deque[str] = deque()
+        self._waiting = 0
+        self._cond = threading.Condition()
+
+    def _admit(self, ticket: ConcurrencyTicket) -> None:
+        ticket.granted = True
+        ticket.started_at = time.monotonic()
+        ticket.in_flight_at_start = self.in_flight
+        self.in_flight += 1
+        self.admitted += 1
+
+    def _dispatch(self) -> None:
+        """Admits waiting requests while the limit allows, one pipeline at a time; callers hold the lock."""
+        admitted = False
+        while self._order and self.in_flight < int(self.limit):
+            pipeline = self._order.popleft()
+            queue = self._queues[pipeline]
+            self._admit(queue.popleft())
+            self._waiting -= 1
+            admitted = True
+            if queue:
+                self._order.append(pipeline)
+            else:
+                del self._queues[pipeline]
+        if admitted:
+            self._cond.notify_all()
+
+    def _withdraw(self, ticket: ConcurrencyTicket) -> None:
+        queue = self._queues[ticket.pipeline]
+        queue.remove(ticket)
+        self._waiting -= 1
+        if not queue:
+            del self._queues[ticket.pipeline]
+            self._order.remove(ticket.pipeline)
+
+    def acquire(self, pipeline: Optional[str] = None) -> ConcurrencyTicket:
+        """Waits until the request may run.
+
+        Args:
+            pipeline (Optional[str]): Pipeline the request belongs to; defaults to the current trace.
+
+        Returns:
+            ConcurrencyTicket: Pass it to `release` when the request is done.
+
+        Raises:
+            LLMOverloadedError: If the queue is full or the request waited too long.
+        """
+        ticket = ConcurrencyTicket(pipeline or current_trace_id() or "default")
+        with self._cond:
+            if not self._order and self.in_flight < int(self.limit):
+                self._admit(ticket)
+                return ticket
+            if self._waiting >= self.max_queue:
+                self.rejected += 1
+                LLM_CONCURRENCY_REJECTED.labels(reason="queue_full").inc()
+                raise LLMOverloadedError(f"{self._waiting} LLM requests already waiting for the concurrency limit")
+            self._queues.setdefault(ticket.pipeline, deque()).append(ticket)
+            if len(self._queues[ticket.pipeline]) == 1:
+                self._order.append(ticket.pipeline)
+            self._waiting += 1
+            deadline = ticket.queued_at + self.queue_timeout
+            while not ticket.granted:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._withdraw(ticket)
+                    self.rejected += 1
+                    LLM_CONCURRENCY_REJECTED.labels(reason="timeout").inc()
+                    raise LLMOverloadedError(f"LLM request waited {self.queue_timeout}s for the concurrency limit "
+                                             f"({int(self.limit)})")
+                self._cond.wait(remaining)
+        LLM_CONCURRENCY_WAIT.observe(ticket.started_at - ticket.queued_at)
+        return ticket
+
+    def release(self, ticket: ConcurrencyTicket, tokens: Optional[float] = None,
+                congested: Optional[bool] = None) -> None:
+        """Frees the request's place and adapts the limit.
+
+        Args:
+            ticket (ConcurrencyTicket): The ticket from `acquire`.
+            tokens (Optional[float]): Tokens processed (see `token_cost`), to normalize the latency.
+            congested (Optional[bool]): True for a timeout or server error, False for a success,
+                None for an outcome that says nothing about load (e.g. a rejected request).
+        """
+        now = time.monotonic()
+        with self._cond:
+            self.in_flight -= 1
+            if congested is False:
+                latency = (now - ticket.started_at) / max(tokens or 1.0, 1.0)
+                self._latencies.append(latency)
+                self.baseline = min(self._latencies)
+                # Latency only says something about our concurrency when the limit was in use
+                saturated = ticket.in_flight_at_start + 1 >= int(self.limit)
+                congested = saturated and latency > self.baseline * self.tolerance
+                if saturated and not congested and self.limit < self.max_limit:
+                    previous = int(self.limit)
+                    self.limit = min(self.limit + 1 / self.limit, float(self.max_limit))
+                    if int(self.limit) > previous:
+                        self.increases += 1
+                        logger.info(f"LLM concurrency limit raised to {int(self.limit)}")
+            # Requests started before the last cut reflect the old limit; cut once per round-trip
+            if congested and ticket.started_at > self._last_decrease and self.limit > self.min_limit:
+                previous = int(self.limit)
+                self.limit = max(self.limit * CONCURRENCY_BACKOFF, float(self.min_limit))
+                self._last_decrease = now
+                self.decreases += 1
+                if int(self.limit) < previous:
+                    logger.warning(f"LLM concurrency limit lowered to {int(self.limit)}")
+            self._dispatch()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "limit": int(self.limit),
+                "min_limit": self.min_limit,
+                "max_limit": self.max_limit,
+                "in_flight": self.in_flight,
+                "waiting": self._waiting,
+                "pipelines_waiting": len(self._order),
+                "baseline_latency": self.baseline,
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "increases": self.increases,
+                "decreases": self.decreases,
+            }
+
+
+class LLMBackend:
+    """One OpenAI-compatible server with its own keep-alive connection pool and statistics."""
+
+    def __init__(self, base_url: str, api_key: str, slots: int = DEFAULT_LLM_BACKEND_SLOTS, timeout: float = 600.0):
+        """Creates the backend's pooled HTTP client.
+
+        Args:
+            base_url (str): OpenAI-compatible base URL, e.g. `http://gpu1:8080/v1`.
+            api_key (str): API key sent to the backend.
+            slots (int): Requests the backend generates in parallel (llama.cpp `--parallel`).
+            timeout (float): Read timeout of a completion request in seconds.
+
+        Raises:
+            ValueError: If slots is not positive.
+        """
+        if slots < 1:
+            raise ValueError(f"LLM backend slots must be positive, got {slots}")
+        self.base_url = base_url.rstrip("/")
+        self.slots = slots
+        self.http = httpx.Client(
+            timeout=httpx.Timeout(timeout, connect=10.0),
+            limits=httpx.Limits(max_connections=slots * 2, max_keepalive_connections=slots),
+        )
+        # Retries are handled by the pool, which fails over to another backend instead
+        self.client = openai.OpenAI(base_url=self.base_url, api_key=api_key, http_client=self.http, max_retries=0)
+        self.in_flight = 0
+        self.healthy = True
+        self.consecutive_failures = 0
+        self.requests = 0
+        self.failures = 0
+        self.latency_ewma: Optional[float] = None
+        self.last_error: Optional[str] = None
+        # Prompt prefix whose KV cache each server slot holds, and the slots our requests occupy
+        self.slot_prefixes: List[Optional[str]] = [None] * slots
+        self.slot_roles: List[Optional[str]] = [None] * slots
+        self.slot_busy: List[bool] = [False] * slots
+        self.slot_used: List[float] = [0.0] * slots
+        # Per role: [requests, prompt tokens, prompt tokens served from the KV cache]
+        self.prompt_cache: Dict[str, List[int]] = {}
+        LLM_BACKEND_HEALTHY.labels(backend=self.base_url).set(1)
+
+    @property
+    def load(self) -> float:
+        """Share of the backend's slots in use."""
+        return self.in_flight / self.slots
+
+    def record(self, duration: float, error: Optional[str] = None) -> None:
+        """Updates the statistics after a request; callers hold the pool lock."""
+        self.requests += 1
+        LLM_BACKEND_REQUEST_DURATION.labels(backend=self.base_url).observe(duration)
+        if error:
+            self.failures += 1
+            self.consecutive_failures += 1
+            self.last_error = error
+            LLM_BACKEND_ERRORS.labels(backend=self.base_url).inc()
+            return
+        self.consecutive_failures = 0
+        if self.latency_ewma is None:
+            self.latency_ewma = duration
+        else:
+            self.latency_ewma += LATENCY_EWMA_ALPHA * (duration - self.latency_ewma)
+
+    def warm_slot(self, prefix: str) -> Optional[int]:
+        """Returns a free slot already holding the prefix; callers hold the pool lock."""
+        for slot, held in enumerate(self.slot_prefixes):
+            if held == prefix and not self.slot_busy[slot]:
+                return slot
+        return None
+
+    def take_slot(self, prefix: str, role: str) -> Tuple[Optional[int], str]:
+        """Reserves a free slot for a prompt prefix; callers hold the pool lock.
+
+        A slot already holding the prefix is preferred. Otherwise an empty slot is used, then
+        one whose prefix is also held elsewhere, then the least recently used one.
+
+        Returns:
+            Tuple[Optional[int], str]: The slot, None if all are busy, and the outcome:
+                "warm", "cold" or "unpinned".
+        """
+        slot = self.warm_slot(prefix)
+        outcome = "warm"
+        if slot is None:
+            free = [index for index, busy in enumerate(self.slot_busy) if not busy]
+            if not free:
+                return None, "unpinned"
+            slot = min(free, key=lambda index: (self.slot_prefixes[index] is not None,
+                                                self.slot_prefixes.count(self.slot_prefixes[index]) == 1,
+                                                self.slot_used[index]))
+            outcome = "cold"
+        self.slot_busy[slot] = True
+        self.slot_prefixes[slot] = prefix
+        self.slot_roles[slot] = role
+        return slot, outcome
+
+    def free_slot(self, slot: int) -> None:
+        self.slot_busy[slot] = False
+        self.slot_used[slot] = time.monotonic()
+
+    def record_prompt_cache(self, role: str, prompt_tokens: int, cached_tokens: int) -> None:
+        """Accumulates KV cache reuse of a role's prompts; callers hold the pool lock."""
+        totals = self.prompt_cache.setdefault(role, [0, 0, 0])
+        totals[0] += 1
+        totals[1] += prompt_tokens
+        totals[2] += cached_tokens
+
+    def set_healthy(self, healthy: bool) -> None:
+        if healthy != self.healthy:
+            logger.warning(f"LLM backend {self.base_url} {'restored' if healthy else 'ejected'}")
+        self.healthy = healthy
+        if healthy:
+            self.consecutive_failures = 0
+        LLM_BACKEND_HEALTHY.labels(backend=self.base_url).set(1 if healthy else 0)
+
+    def probe(self) -> bool:
+        """Checks that the backend answers `GET /models`."""
+        try:
+            response = self.http.get(f"{self.base_url}/models", timeout=HEALTH_CHECK_TIMEOUT_SECONDS)
+            return response.status_code == 200
+        except httpx.HTTPError:
+            return False
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "base_url": self.base_url,
+            "healthy": self.healthy,
+            "slots": self.slots,
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "failures": self.failures,
+            "latency_ewma": self.latency_ewma,
+            "last_error": self.last_error,
+            "slot_roles": list(self.slot_roles),
+            "prompt_cache": {
+                role: {"requests": requests, "prompt_tokens": prompt_tokens, "cached_tokens": cached_tokens,
+                       "avg_cached_tokens": round(cached_tokens / requests, 1)}
+                for role, (requests, prompt_tokens, cached_tokens) in self.prompt_cache.items()
+            },
+        }
+
+    def close(self) -> None:
+        self.http.close()
+
+
+class LLMBackendPool:
+    """Dispatches completion requests over several backends.
+
+    With `least_loaded` dispatch a request goes to the healthy backend with the lowest
+    share of busy slots (ties go to the lower average latency) and queues on the server
+    if all are busy. With `slots` dispatch a request waits here until a backend has a
+    free slot, so no server ever queues more than it can generate at once.
+
+    Backends failing `failure_threshold` requests in a row are ejected; a background
+    health check probes every backend and restores ejected ones once they answer again.
+    """
+
+    def __init__(
+        self,
+        backends: Sequence[LLMBackend],
+        dispatch: str = "least_loaded",
+        failure_threshold: int = 3,
+        health_check_interval: float = 15.0,
+        wait_timeout: Optional[float] = None,
+        limiter: Optional[AdaptiveConcurrencyLimiter] = None,
+        slot_affinity: bool = False,
+    ):
+        """Initializes the pool.
+
+        Args:
+            backends (Sequence[LLMBackend]): Backends to dispatch to.
+            dispatch (str): "least_loaded" or "slots".
+            failure_threshold (int): Consecutive failures after which a backend is ejected.
+            health_check_interval (float): Seconds between health checks; 0 disables them.
+            wait_timeout (Optional[float]): Maximum time to wait for a free slot, None to wait forever.
+            limiter (Optional[AdaptiveConcurrencyLimiter]): Admits requests before they reach a backend.
+            slot_affinity (bool): Pin requests sharing a prompt prefix to the server slots that
+                hold its KV cache (llama.cpp `id_slot` and `cache_prompt`).
+
+        Raises:
+            ValueError: If there are no backends or the dispatch mode is unknown.
+        """
+        if not backends:
+            raise ValueError("LLMBackendPool needs at least one backend")
+        if dispatch not in ("least_loaded", "slots"):
+            raise ValueError(f"Unknown LLM dispatch mode: {dispatch}")
+        self.backends = list(backends)
+        self.dispatch = dispatch
+        self.failure_threshold = failure_threshold
+        self.health_check_interval = health_check_interval
+        self.wait_timeout = wait_timeout
+        self.limiter = limiter
+        self.slot_affinity = slot_affinity
+        self._cond = threading.Condition()
+        self._stopped = threading.Event()
+        self._health_thread: Optional[threading.Thread] = None
+        for backend in self.backends:
+            LLM_BACKEND_IN_FLIGHT.labels(backend=backend.base_url).set_function(lambda b=backend: b.in_flight)
+        if health_check_interval > 0:
+            self._health_thread = threading.Thread(target=self._health_loop, name="llm-health", daemon=True)
+            self._health_thread.start()
+
+    def _candidates(self, exclude: Set[LLMBackend]) -> List[LLMBackend]:
+        remaining = [backend for backend in self.backends if backend not in exclude]
+        healthy = [backend for backend in remaining if backend.healthy]
+        # With every backend ejected, keep trying them rather than failing all requests
+        return healthy or remaining
+
+    def acquire(self, exclude: Optional[Set[LLMBackend]] = None, prefix: Optional[str] = None,
+                role: str = "default") -> Tuple[LLMBackend, Optional[int]]:
+        """Reserves a slot on the backend chosen by the dispatch mode.
+
+        With a prompt prefix, a backend with a free server slot already holding the prefix
+        is preferred, and a server slot is pinned for the request.
+
+        Args:
+            exclude (Optional[Set[LLMBackend]]): Backends already tried for this request.
+            prefix (Optional[str]): Digest of the request's fixed prompt prefix; None pins no slot.
+            role (str): Agent role the prefix belongs to, for statistics.
+
+        Returns:
+            Tuple[LLMBackend, Optional[int]]: The backend and the pinned server slot, if any;
+                release them with `release`.
+
+        Raises:
+            NoBackendAvailableError: If all backends are excluded or no slot freed up in time.
+        """
+        exclude = exclude or set()
+        deadline = None if self.wait_timeout is None else time.monotonic() + self.wait_timeout
+        with self._cond:
+            while True:
+                candidates = self._candidates(exclude)
+                if not candidates:
+                    raise NoBackendAvailableError("All LLM backends failed for this request")
+                if self.dispatch == "slots":
+                    candidates = [backend for backend in candidates if backend.in_flight < backend.slots]
+                if candidates:
+                    backend = min(candidates, key=lambda b: (prefix is not None and b.warm_slot(prefix) is None,
+                                                             b.load, b.latency_ewma or 0.0))
+                    backend.in_flight += 1
+                    slot = None
+                    if prefix is not None:
+                        slot, outcome = backend.take_slot(prefix, role)
+                        LLM_SLOT_ASSIGNMENTS.labels(outcome=outcome).inc()
+                    return backend, slot
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise NoBackendAvailableError(f"No LLM backend slot freed up within {self.wait_timeout}s")
+                self._cond.wait(remaining)
+
+    def release(self, backend: LLMBackend, duration: float, error: Optional[str] = None,
+                slot: Optional[int] = None) -> None:
+        """Frees the slot and records the outcome, ejecting the backend after repeated failures."""
+        with self._cond:
+            backend.in_flight -= 1
+            if slot is not None:
+                backend.free_slot(slot)
+            backend.record(duration, error)
+            if error and backend.consecutive_failures >= self.failure_threshold:
+                backend.set_healthy(False)
+            self._cond.notify_all()
+
+    def call(self, func: Callable[[LLMBackend, Optional[int]], T], prefix: Optional[str] = None,
+             role: str = "default") -> T:
+        """Runs a request on a backend, failing over to the next one on connection or server errors.
+
+        With a limiter the request first waits for admission, and its latency or failure
+        adapts the concurrency limit.
+
+        Args:
+            func (Callable[[LLMBackend, Optional[int]], T]): Performs the request against the
+                given backend, pinned to the given server slot if not None.
+            prefix (Optional[str]): Digest of the fixed prompt prefix, to pin a server slot.
+            role (str): Agent role of the request.
+
+        Returns:
+            T: The result of `func`.
+
+        Raises:
+            LLMOverloadedError: If the limiter sheds the request.
+            NoBackendAvailableError: If no backend could be reserved.
+            openai.APIError: The last error if every backend failed, or any client-side error.
+        """
+        if self.limiter is None:
+            return self._call(func, prefix, role)
+        ticket = self.limiter.acquire()
+        try:
+            result = self._call(func, prefix, role)
+        except (NoBackendAvailableError, *FAILOVER_ERRORS):
+            self.limiter.release(ticket, congested=True)
+            raise
+        except BaseException:
+            self.limiter.release(ticket)
+            raise
+        self.limiter.release(ticket, tokens=token_cost(getattr(result, "usage", None)), congested=False)
+        return result
+
+    def _call(self, func: Callable[[LLMBackend, Optional[int]], T], prefix: Optional[str], role: str) -> T:
+        tried: Set[LLMBackend] = set()
+        last_error: Optional[Exception] = None
+        for _ in range(len(self.backends)):
+            try:
+                backend, slot = self.acquire(tried, prefix, role)
+            except NoBackendAvailableError:
+                if last_error is not None:
+                    raise last_error
+                raise
+            tried.add(backend)
+            started = time.perf_counter()
+            try:
+                result = func(backend, slot)
+            except FAILOVER_ERRORS as e:
+                self.release(backend, time.perf_counter() - started, error=str(e) or type(e).__name__, slot=slot)
+                logger.warning(f"LLM backend {backend.base_url} failed: {str(e)}; trying another backend")
+                last_error = e
+                continue
+            except Exception:
+                # Client-side errors (bad request, parsing) say nothing about the backend's health
+                self.release(backend, time.perf_counter() - started, slot=slot)
+                raise
+            self.release(backend, time.perf_counter() - started, slot=slot)
+            return result
+        raise last_error
+
+    def check_health(self) -> None:
+        """Probes every backend once and updates its health."""
+        for backend in self.backends:
+            healthy = backend.probe()
+            with self._cond:
+                backend.set_healthy(healthy)
+                self._cond.notify_all()
+
+    def _health_loop(self) -> None:
+        while not self._stopped.wait(self.health_check_interval):
+            try:
+                self.check_health()
+            except Exception as e:
+                logger.error(f"LLM health check failed: {str(e)}")
+
+    def stats(self) -> List[Dict[str, Any]]:
+        with self._cond:
+            return [backend.stats() for backend in self.backends]
+
+    def record_prompt_cache(self, backend: LLMBackend, role: str, prompt_tokens: int, cached_tokens: int) -> None:
+        with self._cond:
+            backend.record_prompt_cache(role, prompt_tokens, cached_tokens)
+
+    def limiter_stats(self) -> Optional[Dict[str, Any]]:
+        return self.limiter.stats() if self.limiter else None
+
+    def close(self) -> None:
+        self._stopped.set()
+        for backend in self.backends:
+            backend.close()
+
+
+def prompt_prefix_key(params: Dict[str, Any]) -> Optional[str]:
+    """Digest of the fixed start of a request's prompt: the system message and the tools.
+
+    Chat templates render both first, so requests of one agent role share this prefix and
+    can reuse its KV cache. Returns None for requests without a system message.
+    """
+    messages = params.get("messages") or []
+    if not messages or messages[0].get("role") != "system":
+        return None
+    fixed = json.dumps([messages[0].get("content"), params.get("tools") or []], sort_keys=True, default=str)
+    return hashlib.sha256(fixed.encode("utf-8")).hexdigest()[:16]
+
+
+def cached_prompt_tokens(response: Any) -> Optional[int]:
+    """Prompt tokens the server reused from its KV cache: OpenAI usage details or llama.cpp timings."""
+    usage = getattr(response, "usage", None)
+    cached = getattr(getattr(usage, "prompt_tokens_details", None), "cached_tokens", None)
+    if cached is None:
+        timings = (getattr(response, "model_extra", None) or {}).get("timings") or {}
+        cached = timings.get("cache_n")
+    return cached
+
+
+# Wraps every completion request as interceptor(params, send); cassettes record or replay through it
+_interceptor: Optional[Callable[[Dict[str, Any], Callable[[], Any]], Any]] = None
+
+
+def configure_llm_interceptor(interceptor: Optional[Callable[[Dict[str, Any], Callable[[], Any]], Any]]) -> None:
+    """Installs a wrapper around completion requests; None removes it.
+
+    Args:
+        interceptor (Optional[Callable]): Called with the request params and a function sending
+            the request; returns the response.
+    """
+    global _interceptor
+    _interceptor = interceptor
+
+
+class PooledLLMClient:
+    """autogen model client sending completions through an LLMBackendPool.
+
+    Used via a config_list entry with `"model_client_cls": "PooledLLMClient"` and
+    `agent.register_model_client(PooledLLMClient, pool=...)`. Request building and
+    response handling are delegated to autogen's OpenAIClient.
+    """
+
+    def __init__(self, config: Dict[str, Any], pool: Optional[LLMBackendPool] = None, **kwargs: Any):
+        self.config = config
+        self.pool = pool or get_llm_pool(SystemConfig())
+        self._formatter = OpenAIClient(self.pool.backends[0].client)
+
+    def create(self, params: Dict[str, Any]) -> Any:
+        role = params.get("slot_role") or "default"
+        params = {key: value for key, value in params.items() if key not in CLIENT_ONLY_PARAMS}
+        prefix = prompt_prefix_key(params) if self.pool.slot_affinity else None
+
+        def request(backend: LLMBackend, slot: Optional[int]) -> Any:
+            request_params = dict(params)
+            if slot is not None:
+                request_params["extra_body"] = {**params.get("extra_body", {}), "id_slot": slot, "cache_prompt": True}
+            with span("llm.request", backend=backend.base_url, in_flight=backend.in_flight, slot=slot):
+                response = OpenAIClient(backend.client).create(request_params)
+            cached = cached_prompt_tokens(response)
+            usage = getattr(response, "usage", None)
+            if cached is not None and usage is not None:
+                LLM_PROMPT_CACHED_TOKENS.labels(role=role).observe(cached)
+                self.pool.record_prompt_cache(backend, role, usage.prompt_tokens or 0, cached)
+            return response
+
+        interceptor = _interceptor
+        if interceptor is not None:
+            return interceptor(params, lambda: self.pool.call(request, prefix, role))
+        return self.pool.call(request, prefix, role)
+
+    def message_retrieval(self, response: Any) -> List[Any]:
+        return self._formatter.message_retrieval(response)
+
+    def cost(self, response: Any) -> float:
+        return 0.0
+
+    @staticmethod
+    def get_usage(response: Any) -> Dict[str, Any]:
+        return OpenAIClient.get_usage(response)
+
+
+def backends_from_config(config: SystemConfig) -> List[Dict[str, Any]]:
+    """Returns the backend entries of a config, falling back to the single llm_base_url."""
+    return config.llm_backends or [{"base_url": config.llm_base_url}]
+
+
+def _pool_key(config: SystemConfig) -> Tuple:
+    """Every setting pool_from_config reads, so configs differing in any of them get their own pool."""
+    backends = tuple(
+        (entry["base_url"], entry.get("api_key", config.llm_api_key), entry.get("slots", DEFAULT_LLM_BACKEND_SLOTS))
+        for entry in backends_from_config(config)
+    )
+    return (
+        backends,
+        config.llm_dispatch,
+        config.llm_request_timeout,
+        config.llm_failure_threshold,
+        config.llm_health_check_interval,
+        config.llm_backend_wait_timeout,
+        config.llm_adaptive_concurrency,
+        config.llm_concurrency_min,
+        config.llm_concurrency_max,
+        config.llm_latency_tolerance,
+        config.llm_queue_timeout,
+        config.llm_max_queue,
+        config.llm_slot_affinity,
+    )
+
+
+def pool_from_config(config: SystemConfig) -> LLMBackendPool:
+    """Builds an LLMBackendPool for the backends and dispatch settings of a config."""
+    backends = [
+        LLMBackend(base_url, api_key, slots, config.llm_request_timeout)
+        for base_url, api_key, slots in _pool_key(config)[0]
+    ]
+    limiter = None
+    if config.llm_adaptive_concurrency:
+        # Start at the slots the backends advertise; the limiter finds the real capacity from there
+        limiter = AdaptiveConcurrencyLimiter(
+            sum(backend.slots for backend in backends),
+            config.llm_concurrency_min,
+            config.llm_concurrency_max,
+            config.llm_latency_tolerance,
+            config.llm_queue_timeout,
+            config.llm_max_queue,
+        )
+    return LLMBackendPool(
+        backends,
+        dispatch=config.llm_dispatch,
+        failure_threshold=config.llm_failure_threshold,
+        health_check_interval=config.llm_health_check_interval,
+        wait_timeout=config.llm_backend_wait_timeout,
+        limiter=limiter,
+        slot_affinity=config.llm_slot_affinity,
+    )
+
+
+# Process-wide pools keyed by backend set and pool settings, so connections are reused across requests
+_pools: Dict[Tuple, LLMBackendPool] = {}
+_pools_lock = threading.Lock()
+
+
+def configure_llm_pool(config: SystemConfig, pool: LLMBackendPool) -> None:
+    """Registers a pool for the backends of a config, replacing any existing one."""
+    with _pools_lock:
+        previous = _pools.get(_pool_key(config))
+        _pools[_pool_key(config)] = pool
+    if previous is not None and previous is not pool:
+        previous.close()
+
+
+def get_llm_pool(config: SystemConfig) -> LLMBackendPool:
+    """Returns the process-wide pool for the backends of a config, creating it if needed."""
+    key = _pool_key(config)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = pool_from_config(config)
+            logger.info(f"LLM backend pool created: {[backend.base_url for backend in pool.backends]}")
+        return pool
+
+
+def llm_pool_stats() -> List[Dict[str, Any]]:
+    """Returns the statistics of every backend of every pool."""
+    with _pools_lock:
+        pools = list(_pools.values())
+    return [stats for pool in pools for stats in pool.stats()]
+
+
+def llm_limiter_stats() -> List[Dict[str, Any]]:
+    """Returns the adaptive concurrency state of every pool that has a limiter."""
+    with _pools_lock:
+        pools = list(_pools.values())
+    return [
+        {"backends": [backend.base_url for backend in pool.backends], **pool.limiter_stats()}
+        for pool in pools if pool.limiter is not None
+    ]
+
+
+def _registered_limiters() -> List[AdaptiveConcurrencyLimiter]:
+    with _pools_lock:
+        return [pool.limiter for pool in _pools.values() if pool.limiter is not None]
+
+
+# Totals over the registered pools; llm_limiter_stats has each pool's own values
+LLM_CONCURRENCY_LIMIT.set_function(lambda: sum(int(limiter.limit) for limiter in _registered_limiters()))
+LLM_CONCURRENCY_QUEUED.set_function(lambda: sum(limiter._waiting for limiter in _registered_limiters()))
@@ -1,11 +1,31 @@
 # main.py with CORS support покажи статус интерфейсов на хосте 10.27.214.28
 import logging
 import argparse
+import itertools
 from flask import Flask, request, Response, jsonify
 from flask_cors import CORS  # New import for CORS
 from orchestrator import CoopetitionSystem
 from config import SystemConfig
+from scheduler import JobScheduler, Priority, QueueFullError
+from metrics import REGISTRY, SCHEDULER_QUEUE_DEPTH, SCHEDULER_ACTIVE_JOBS
+from llm_client import get_llm_pool, llm_limiter_stats, llm_pool_stats
+from sessions import get_session_store
+from state import recent_events
+from poller import get_poller, start_prefetch
+from change_queue import ChangeQueue, configure_change_queue, get_change_queue
+from device_limits import DeviceLimiter, configure_device_limiter
+from history import OutputHistory, configure_output_history
+from inventory import Inventory, configure_inventory
+from result_store import ResultStore, configure_result_store
+from rollout import Rollout, RolloutBusyError
+from query_batch import QueryBatch
+from speculation import Speculator, configure_speculator, get_speculator
+from profiler import PROFILE_KINDS, Profiler, configure_profiler, get_profiler
 import json
+import threading
+from typing import Any, Dict
+import uuid
+import yaml
 
 # Configure logging
 logging.basicConfig(
@@ -17,12 +37,41 @@ logger = logging.getLogger(__name__)
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes; you can customize if needed, e.g., CORS(app, origins=["http://your-web-interface-origin"])
 
+# SystemConfig field overrides applied to every request (set from the command line or by benchmarks)
+SYSTEM_CONFIG_OVERRIDES: Dict[str, Any] = {}
+
+def make_system_config() -> SystemConfig:
+    """Builds the SystemConfig for a request, applying SYSTEM_CONFIG_OVERRIDES."""
+    return SystemConfig(**SYSTEM_CONFIG_OVERRIDES)
+
+# Process-wide job scheduler; created by main() or lazily with SystemConfig defaults
+scheduler: JobScheduler = None
+_scheduler_lock = threading.Lock()
+
+def get_scheduler() -> JobScheduler:
+    """Returns the process-wide JobScheduler, creating it from SystemConfig defaults if needed."""
+    global scheduler
+    with _scheduler_lock:
+        if scheduler is None:
+            config = make_system_config()
+            scheduler = JobScheduler(config.scheduler_workers, config.scheduler_queue_size, config.scheduler_retry_after)
+    return scheduler
+
+SCHEDULER_QUEUE_DEPTH.set_function(lambda: get_scheduler().stats()["queue_depth"])
+SCHEDULER_ACTIVE_JOBS.set_function(lambda: get_scheduler().stats()["active"])
+
 @app.route('/process', methods=['POST'])
 def process_query_endpoint():
     """
     Endpoint to process a user query received from a web interface.
     Expects a JSON payload with a 'query' field, e.g., {"query": "просканируй порты на хосте 10.27.192.116"}
+    and an optional 'priority' field ("interactive" or "batch", default "interactive").
+    Clients that want follow-up queries to reuse earlier results pass a session id of their choosing,
+    either as a 'session_id' field or as an X-Session-Id request header; queries without one keep no session.
+    With profiling enabled, an X-Profile request header records a sampling profile of the run,
+    available from /debug/profile/<id> with the id returned in the X-Profile-Id response header.
     Streams the response in OpenAI-compatible format to match JS expectations.
+    Responds with 429 and a Retry-After header when the job queue is full.
     """
     try:
         data = request.get_json()
@@ -30,15 +79,38 @@ def process_query_endpoint():
             return jsonify({"error": "Missing 'query' in JSON payload"}), 400
         
         query = data['query']
+        priority_name = str(data.get('priority', 'interactive')).upper()
+        if priority_name not in Priority.__members__:
+            return jsonify({"error": f"Invalid 'priority': {data.get('priority')}"}), 400
         logger.info(f"Received query: {query}")
         
-        def generate():
+        trace_id = uuid.uuid4().hex
+        session_id = data.get('session_id') or request.headers.get('X-Session-Id')
+        session_id = str(session_id) if session_id else None
+        profile = None
+        if request.headers.get('X-Profile') and make_system_config().profiling_enabled:
+            profile = get_profiler().start(trace_id)
+
+        def run_pipeline():
             # Initialize config and system for each request
-            config = SystemConfig()
+            config = make_system_config()
             system = CoopetitionSystem(config)
             
             # Use a streaming version of process_query
-            for chunk in system.process_query_stream(query):
+            stream = system.process_query_stream(query, trace_id=trace_id, session_id=session_id)
+            return get_profiler().profiled(profile, "pipeline", stream) if profile else stream
+
+        try:
+            job = get_scheduler().submit(run_pipeline, Priority[priority_name])
+        except QueueFullError as e:
+            if profile:
+                get_profiler().finish(profile)
+            response = jsonify({"error": str(e)})
+            response.headers["Retry-After"] = str(e.retry_after)
+            return response, 429
+
+        def generate():
+            for chunk in job.stream():
                 # Format as OpenAI stream chunk
                 stream_data = {
                     "choices": [
@@ -54,12 +126,224 @@ def process_query_endpoint():
             # End of stream
             yield "data: [DONE]\n\n"
         
-        return Response(generate(), mimetype='text/event-stream')
+        headers = {"X-Job-Id": job.id, "X-Trace-Id": trace_id}
+        if session_id:
+            headers["X-Session-Id"] = session_id
+        if not profile:
+            return Response(generate(), mimetype='text/event-stream', headers=headers)
+        headers["X-Profile-Id"] = profile.profile_id
+        response = Response(get_profiler().profiled(profile, "sse", generate()), mimetype='text/event-stream', headers=headers)
+        response.call_on_close(lambda: get_profiler().finish(profile))
+        return response
     
     except Exception as e:
         logger.error(f"Failed to process query: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/rollout', methods=['POST'])
+def rollout_endpoint():
+    """
+    Endpoint applying a configuration change to many devices in waves.
+    Expects a JSON payload with 'commands' (list of configuration lines) and either 'hosts'
+    (list of "host" or "host:port") or an inventory 'group', e.g.
+    {"commands": ["ntp server 10.0.0.1"], "group": "access", "parallelism": 16}.
+    Optional 'canary', 'parallelism' (at most rollout_max_parallelism), 'wave_size' and
+    'max_error_rate' override SystemConfig.
+    The rollout does not take a scheduler worker; at most rollout_max_concurrent rollouts run at once,
+    further ones get 429 with a Retry-After header. Streams one JSON event per line (device results,
+    waves, final summary).
+    """
+    data = request.get_json(silent=True) or {}
+    commands = data.get('commands')
+    if not isinstance(commands, list) or not commands:
+        return jsonify({"error": "Missing 'commands' list in JSON payload"}), 400
+    config = make_system_config()
+    try:
+        rollout = Rollout.from_request(
+            config, [str(command) for command in commands], data.get('hosts'), data.get('group'),
+            canary=data.get('canary'), parallelism=data.get('parallelism'), wave_size=data.get('wave_size'),
+            max_error_rate=data.get('max_error_rate'),
+        )
+    except (ValueError, TypeError) as e:
+        return jsonify({"error": str(e)}), 400
+
+    events = rollout.run()
+    try:
+        first = next(events)  # Admits the rollout
+    except RolloutBusyError as e:
+        response = jsonify({"error": str(e)})
+        response.headers["Retry-After"] = str(config.scheduler_retry_after)
+        return response, 429
+
+    def generate():
+        for event in itertools.chain([first], events):
+            yield json.dumps(event, ensure_ascii=False) + "\n"
+
+    return Response(generate(), mimetype='application/x-ndjson')
+
+@app.route('/process_batch', methods=['POST'])
+def process_batch_endpoint():
+    """
+    Endpoint processing many queries in one request.
+    Expects a JSON payload with 'queries', a list of query strings or {"query": ..., "id": ...}
+    objects, and an optional 'parallelism', e.g. {"queries": ["покажи bgp на хосте 10.0.0.1"], "parallelism": 4}.
+    The queries share device sessions and show outputs. Each query runs as its own batch-priority
+    job, so interactive queries keep precedence. Streams one JSON line per query in completion
+    order (answer or error, timing), then a summary line.
+    Responds with 429 and a Retry-After header when the job queue has no room for the batch.
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        batch = QueryBatch.from_request(make_system_config(), data.get('queries'), CoopetitionSystem,
+                                        parallelism=data.get('parallelism'))
+    except (ValueError, TypeError) as e:
+        return jsonify({"error": str(e)}), 400
+
+    events = batch.run(get_scheduler())
+    try:
+        first = next(events)  # Queues the first queries
+    except QueueFullError as e:
+        response = jsonify({"error": str(e)})
+        response.headers["Retry-After"] = str(e.retry_after)
+        return response, 429
+
+    def generate():
+        for event in itertools.chain([first], events):
+            yield json.dumps(event, ensure_ascii=False) + "\n"
+
+    return Response(generate(), mimetype='application/x-ndjson')
+
+@app.route('/scheduler', methods=['GET'])
+def scheduler_stats_endpoint():
+    """
+    Endpoint exposing the job scheduler state: queue depth, active jobs and wait times.
+    """
+    return jsonify(get_scheduler().stats())
+
+@app.route('/sessions', methods=['GET'])
+def sessions_stats_endpoint():
+    """
+    Endpoint exposing the session store usage: number of sessions and bytes held.
+    """
+    return jsonify(get_session_store().stats())
+
+@app.route('/prefetch', methods=['GET'])
+def prefetch_stats_endpoint():
+    """
+    Endpoint exposing the background pre-fetch poller: scheduled groups, polls and snapshot ages.
+    """
+    poller = get_poller()
+    return jsonify(poller.stats() if poller else {"running": False})
+
+@app.route('/speculation', methods=['GET'])
+def speculation_stats_endpoint():
+    """
+    Endpoint exposing speculative show execution: hits, misses, hit rate and latency saved.
+    """
+    return jsonify(get_speculator().stats())
+
+@app.route('/changes', methods=['GET'])
+def change_queue_endpoint():
+    """
+    Endpoint exposing the per-device change queues: pending set operations and applied batches.
+    """
+    return jsonify(get_change_queue().stats())
+
+@app.route('/debug/steps', methods=['GET'])
+def recent_steps_endpoint():
+    """
+    Endpoint exposing the most recent pipeline step transitions with truncated state snapshots.
+    Accepts an optional 'limit' query parameter.
+    """
+    limit = request.args.get('limit', type=int)
+    return jsonify(recent_events(limit))
+
+def _profiling_disabled():
+    if make_system_config().profiling_enabled:
+        return None
+    return jsonify({"error": "Profiling is disabled; start the server with --profiling"}), 403
+
+def _profile_response(profile, kind: str) -> Response:
+    return Response(profile.folded(kind), mimetype='text/plain', headers={
+        "Content-Disposition": f"attachment; filename={profile.profile_id}.{kind}.folded",
+        "X-Profile-Samples": str(profile.samples),
+    })
+
+@app.route('/debug/profile', methods=['GET'])
+def capture_profile_endpoint():
+    """
+    Endpoint sampling every thread of the process for a while and returning the profile as
+    folded stacks (flamegraph.pl, speedscope). Accepts 'seconds' (default 10) and 'kind'
+    ("wall" or "cpu", default "wall") query parameters.
+    """
+    disabled = _profiling_disabled()
+    if disabled:
+        return disabled
+    seconds = request.args.get('seconds', 10.0, type=float)
+    kind = request.args.get('kind', 'wall')
+    if kind not in PROFILE_KINDS or seconds <= 0:
+        return jsonify({"error": f"Invalid 'kind' or 'seconds': {kind}, {seconds}"}), 400
+    return _profile_response(get_profiler().capture(seconds), kind)
+
+@app.route('/debug/profiles', methods=['GET'])
+def profiles_endpoint():
+    """
+    Endpoint listing the kept request profiles: duration, samples, wall and CPU seconds.
+    """
+    disabled = _profiling_disabled()
+    if disabled:
+        return disabled
+    return jsonify(get_profiler().profiles())
+
+@app.route('/debug/profile/<profile_id>', methods=['GET'])
+def request_profile_endpoint(profile_id: str):
+    """
+    Endpoint returning the profile of a request sent with an X-Profile header as folded stacks.
+    Accepts a 'kind' query parameter ("wall" or "cpu", default "wall"); a profile still being
+    recorded is returned as sampled so far.
+    """
+    disabled = _profiling_disabled()
+    if disabled:
+        return disabled
+    kind = request.args.get('kind', 'wall')
+    if kind not in PROFILE_KINDS:
+        return jsonify({"error": f"Invalid 'kind': {kind}"}), 400
+    profile = get_profiler().get(profile_id)
+    if profile is None:
+        return jsonify({"error": f"Unknown profile: {profile_id}"}), 404
+    return _profile_response(profile, kind)
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """
+    Endpoint exposing pipeline metrics in the Prometheus text exposition format.
+    """
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/llm/backends', methods=['GET'])
+def llm_backends_endpoint():
+    """
+    Endpoint exposing the LLM backends: health, busy slots, request counts and latency.
+    """
+    return jsonify(llm_pool_stats())
+
+@app.route('/llm/concurrency', methods=['GET'])
+def llm_concurrency_endpoint():
+    """
+    Endpoint exposing the adaptive LLM concurrency limit: current limit, queue and rejections.
+    """
+    return jsonify(llm_limiter_stats())
+
+def warm_up_llm(config: SystemConfig) -> None:
+    """
+    Loads the agents' fixed prompt prefixes into the LLM backend's KV cache.
+    """
+    try:
+        prompt_tokens = CoopetitionSystem(config).warm_up_prompts()
+        logger.info(f"LLM prompt warm-up done, prompt tokens per agent: {prompt_tokens}")
+    except Exception as e:
+        logger.warning(f"LLM prompt warm-up failed: {str(e)}")
+
 def main() -> None:
     """
     Main entry point for the application.
@@ -78,9 +362,103 @@ def main() -> None:
         default=5000,
         help="Port to run the server on (default: 5000)"
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of pipelines processed concurrently (default: from SystemConfig)"
+    )
+    parser.add_argument(
+        "--queue-size",
+        type=int,
+        default=None,
+        help="Maximum number of queued pipelines before answering 429 (default: from SystemConfig)"
+    )
+    parser.add_argument(
+        "--llm-base-url",
+        type=str,
+        default=None,
+        help="OpenAI-compatible LLM endpoint (default: from SystemConfig)"
+    )
+    parser.add_argument(
+        "--llm-backend",
+        action="append",
+        default=[],
+        metavar="URL[,SLOTS]",
+        help="Add an OpenAI-compatible LLM backend with its number of parallel slots; repeat for several backends"
+    )
+    parser.add_argument(
+        "--llm-dispatch",
+        choices=["least_loaded", "slots"],
+        default=None,
+        help="How requests are spread over LLM backends (default: from SystemConfig)"
+    )
+    parser.add_argument(
+        "--reachability",
+        choices=["icmp", "ssh"],
+        default=None,
+        help="Reachability check of the ping step: ICMP ping or TCP connect to the SSH port (default: from SystemConfig)"
+    )
+    parser.add_argument(
+        "--prefetch",
+        type=str,
+        default=None,
+        metavar="SCHEDULE",
+        help="YAML file of show commands polled in the background per inventory group (see prefetch.example.yaml)"
+    )
+    parser.add_argument(
+        "--speculate",
+        action="store_true",
+        help="Run the likely show command while the LLM is still determining it"
+    )
+    parser.add_argument(
+        "--profiling",
+        action="store_true",
+        help="Enable sampling profiles of requests sent with an X-Profile header and the /debug/profile endpoints"
+    )
     args = parser.parse_args()
 
+    global scheduler
     try:
+        if args.llm_base_url:
+            SYSTEM_CONFIG_OVERRIDES["llm_base_url"] = args.llm_base_url
+        if args.llm_backend:
+            backends = []
+            for spec in args.llm_backend:
+                base_url, _, slots = spec.partition(",")
+                backends.append({"base_url": base_url, "slots": int(slots)} if slots else {"base_url": base_url})
+            SYSTEM_CONFIG_OVERRIDES["llm_backends"] = backends
+        if args.llm_dispatch:
+            SYSTEM_CONFIG_OVERRIDES["llm_dispatch"] = args.llm_dispatch
+        if args.reachability:
+            SYSTEM_CONFIG_OVERRIDES["reachability_check"] = args.reachability
+        if args.prefetch:
+            with open(args.prefetch) as f:
+                SYSTEM_CONFIG_OVERRIDES["prefetch_schedule"] = yaml.safe_load(f) or {}
+            SYSTEM_CONFIG_OVERRIDES["prefetch_enabled"] = True
+        if args.speculate:
+            SYSTEM_CONFIG_OVERRIDES["speculation_enabled"] = True
+        if args.profiling:
+            SYSTEM_CONFIG_OVERRIDES["profiling_enabled"] = True
+        config = make_system_config()
+        # Process-wide components are built from the effective config, overrides included
+        configure_inventory(Inventory.from_config(config))
+        configure_device_limiter(DeviceLimiter.from_config(config))
+        configure_result_store(ResultStore.from_config(config))
+        configure_output_history(OutputHistory.from_config(config))
+        configure_change_queue(ChangeQueue.from_config(config))
+        start_prefetch(config)
+        configure_speculator(Speculator.from_config(config))
+        configure_profiler(Profiler.from_config(config))
+        # Open the backend connection pools and start health checks before the first request
+        get_llm_pool(config)
+        if config.llm_prompt_warmup:
+            threading.Thread(target=warm_up_llm, args=(config,), name="llm-warmup", daemon=True).start()
+        scheduler = JobScheduler(
+            args.workers or config.scheduler_workers,
+            args.queue_size or config.scheduler_queue_size,
+            config.scheduler_retry_after,
+        )
         logger.info(f"Starting server on {args.host}:{args.port}")
         app.run(host=args.host, port=args.port, debug=False)
     
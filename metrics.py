@@ -0,0 +1,367 @@
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Generator, Iterable, List, Optional, Sequence, Tuple
+
+# Default histogram buckets in seconds, from fast tool calls up to multi-minute LLM generations
+DEFAULT_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+# Buckets for payload sizes in bytes (1 KiB ... 16 MiB)
+SIZE_BUCKETS = tuple(float(1024 * 4 ** i) for i in range(8))
+# Buckets for generation speed in tokens per second
+RATE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+TOKEN_BUCKETS = (0, 64, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    """Base class for metrics with optional labels."""
+
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], "_Metric"] = {}
+        self._lock = threading.Lock()
+
+    def _new_child(self) -> "_Metric":
+        raise NotImplementedError
+
+    def labels(self, **labels: str) -> "_Metric":
+        """Returns the child metric for the given label values.
+
+        Raises:
+            ValueError: If the label names do not match the metric's label names.
+        """
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"Metric {self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            child = self._children.get(key)
+            if child is None:
+                child = self._children[key] = self._new_child()
+            return child
+
+    def _samples(self) -> Iterable[Tuple[str, Tuple[str, ...], Optional[Tuple[str, str]], float]]:
+        """Yields (suffix, label values, extra label, value) tuples for rendering."""
+        with self._lock:
+            children = list(self._children.items())
+        if not self.labelnames:
+            children = [((), self)]
+        for key, child in children:
+            for suffix, extra, value in child._child_samples():
+                yield suffix, key, extra, value
+
+    def _child_samples(self) -> Iterable[Tuple[str, Optional[Tuple[str, str]], float]]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        """Renders the metric in the Prometheus text exposition format."""
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        for suffix, key, extra, value in self._samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(self.labelnames, key, extra)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    """Monotonically increasing counter."""
+
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._value = 0.0
+
+    def _new_child(self) -> "Counter":
+        return Counter(self.name, self.documentation)
+
+    def inc(self, amount: float = 1.0) -> None:
+        """Increments the counter.
+
+        Raises:
+            ValueError: If amount is negative.
+        """
+        if amount < 0:
+            raise ValueError(f"Counter {self.name} can only increase, got {amount}")
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self) -> float:
+        return self._value
+
+    def _child_samples(self):
+        yield "_total" if not self.name.endswith("_total") else "", None, self._value
+
+
+class Gauge(_Metric):
+    """Value that can go up and down, or be computed at scrape time."""
+
+    type_name = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._value = 0.0
+        self._function: Optional[Callable[[], float]] = None
+
+    def _new_child(self) -> "Gauge":
+        return Gauge(self.name, self.documentation)
+
+    def set(self, value: float) -> None:
+        with self._lock:
+            self._value = float(value)
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self._value -= amount
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        """Computes the gauge value by calling `function` at scrape time."""
+        self._function = function
+
+    @property
+    def value(self) -> float:
+        return float(self._function()) if self._function else self._value
+
+    def _child_samples(self):
+        yield "", None, self.value
+
+
+class Histogram(_Metric):
+    """Cumulative histogram of observed values."""
+
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._counts = [0] * len(self.buckets)
+        self._sum = 0.0
+        self._count = 0
+
+    def _new_child(self) -> "Histogram":
+        return Histogram(self.name, self.documentation, buckets=self.buckets[:-1])
+
+    def observe(self, value: float) -> None:
+        with self._lock:
+            self._sum += value
+            self._count += 1
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self._counts[i] += 1
+                    break
+
+    @contextmanager
+    def time(self) -> Generator[None, None, None]:
+        """Observes the wall-clock duration of the block."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+    @property
+    def count(self) -> int:
+        return self._count
+
+    @property
+    def sum(self) -> float:
+        return self._sum
+
+    def _child_samples(self):
+        with self._lock:
+            counts, total, count = list(self._counts), self._sum, self._count
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            yield "_bucket", ("le", _format_value(bound)), cumulative
+        yield "_sum", None, total
+        yield "_count", None, count
+
+
+class MetricsRegistry:
+    """Collection of metrics rendered together by the /metrics endpoint."""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        """Adds a metric to the registry.
+
+        Raises:
+            ValueError: If a metric with the same name is already registered.
+        """
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_LATENCY_BUCKETS,
+    ) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def get(self, name: str) -> Optional[_Metric]:
+        return self._metrics.get(name)
+
+    def render(self) -> str:
+        """Renders all metrics in the Prometheus text exposition format."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines: List[str] = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# Process-wide registry and the metrics shared by the pipeline modules
+REGISTRY = MetricsRegistry()
+
+STEP_DURATION = REGISTRY.histogram(
+    "netagents_step_duration_seconds", "Duration of a pipeline step.", ["step"])
+STEP_ERRORS = REGISTRY.counter(
+    "netagents_step_errors_total", "Pipeline runs aborted by an error, by step.", ["step"])
+LLM_CALL_DURATION = REGISTRY.histogram(
+    "netagents_llm_chat_duration_seconds", "Duration of an agent chat (initiate_chat).", ["agent", "step"])
+LLM_PROMPT_TOKENS = REGISTRY.counter(
+    "netagents_llm_prompt_tokens_total", "Prompt tokens sent to the LLM.", ["agent"])
+LLM_COMPLETION_TOKENS = REGISTRY.counter(
+    "netagents_llm_completion_tokens_total", "Completion tokens generated by the LLM.", ["agent"])
+LLM_TOKENS_PER_SECOND = REGISTRY.histogram(
+    "netagents_llm_tokens_per_second", "Completion tokens per second of an agent chat.", ["agent"], RATE_BUCKETS)
+SSH_CONNECT_DURATION = REGISTRY.histogram(
+    "netagents_ssh_connect_duration_seconds", "Time to open an SSH session and enter privileged mode.", ["device_type"])
+SSH_COMMAND_DURATION = REGISTRY.histogram(
+    "netagents_ssh_command_duration_seconds", "Time to run commands within an SSH session.", ["kind"])
+DEVICE_WAIT_DURATION = REGISTRY.histogram(
+    "netagents_device_wait_duration_seconds", "Time spent waiting for device session slots and rate limits.", ["kind"])
+OUTPUT_BYTES = REGISTRY.histogram(
+    "netagents_output_bytes", "Size of command outputs and LLM responses.", ["source"], SIZE_BUCKETS)
+JOB_WAIT_DURATION = REGISTRY.histogram(
+    "netagents_job_wait_duration_seconds", "Time a /process job waited in the scheduler queue.", ["priority"])
+JOB_REJECTED = REGISTRY.counter(
+    "netagents_jobs_rejected_total", "Jobs rejected with 429 because the scheduler queue was full.")
+SCHEDULER_QUEUE_DEPTH = REGISTRY.gauge(
+    "netagents_scheduler_queue_depth", "Jobs waiting in the scheduler queue.")
+SCHEDULER_ACTIVE_JOBS = REGISTRY.gauge(
+    "netagents_scheduler_active_jobs", "Jobs currently being processed by scheduler workers.")
+LLM_BACKEND_REQUEST_DURATION = REGISTRY.histogram(
+    "netagents_llm_backend_request_duration_seconds", "Duration of a single completion request, by LLM backend.",
+    ["backend"])
+LLM_BACKEND_ERRORS = REGISTRY.counter(
+    "netagents_llm_backend_errors_total", "Completion requests that failed on a backend and were retried elsewhere.",
+    ["backend"])
+LLM_BACKEND_IN_FLIGHT = REGISTRY.gauge(
+    "netagents_llm_backend_in_flight", "Completion requests currently running on a backend.", ["backend"])
+LLM_BACKEND_HEALTHY = REGISTRY.gauge(
+    "netagents_llm_backend_healthy", "1 if the backend receives traffic, 0 if it is ejected.", ["backend"])
+LLM_CONCURRENCY_LIMIT = REGISTRY.gauge(
+    "netagents_llm_concurrency_limit",
+    "Current adaptive limits on concurrent completion requests, summed over the LLM backend pools.")
+LLM_CONCURRENCY_QUEUED = REGISTRY.gauge(
+    "netagents_llm_concurrency_queued",
+    "Completion requests waiting for the adaptive concurrency limits, summed over the LLM backend pools.")
+LLM_CONCURRENCY_WAIT = REGISTRY.histogram(
+    "netagents_llm_concurrency_wait_seconds", "Time completion requests waited for the adaptive concurrency limit.")
+LLM_SLOT_ASSIGNMENTS = REGISTRY.counter(
+    "netagents_llm_slot_assignments_total",
+    "Server slots pinned for completion requests: warm (slot held the prompt prefix), cold or unpinned (all busy).",
+    ["outcome"])
+LLM_PROMPT_CACHED_TOKENS = REGISTRY.histogram(
+    "netagents_llm_prompt_cached_tokens", "Prompt tokens served from the backend's KV cache per request, by role.",
+    ["role"], TOKEN_BUCKETS)
+LLM_CONCURRENCY_REJECTED = REGISTRY.counter(
+    "netagents_llm_concurrency_rejected_total",
+    "Completion requests shed by the adaptive concurrency limit, by reason (queue_full or timeout).", ["reason"])
+LLM_PARSE_RESULTS = REGISTRY.counter(
+    "netagents_llm_parse_results_total", "Validation of structured LLM replies, by step and outcome (ok or invalid).",
+    ["step", "outcome"])
+SESSION_REUSE = REGISTRY.counter(
+    "netagents_session_reuse_total", "Pipeline steps answered from session data instead of the device.", ["step"])
+INVENTORY_FINGERPRINTS = REGISTRY.counter(
+    "netagents_inventory_fingerprints_total", "Device type lookups for devices without a platform, by source.",
+    ["source"])
+PREFETCH_POLLS = REGISTRY.counter(
+    "netagents_prefetch_polls_total", "Background show command polls, by outcome (ok or error).", ["outcome"])
+PREFETCH_LOOKUPS = REGISTRY.counter(
+    "netagents_prefetch_lookups_total", "Snapshot lookups by the execute step, by result (hit, stale or miss).",
+    ["result"])
+HISTORY_ANALYSIS_INPUT = REGISTRY.counter(
+    "netagents_history_analysis_input_total",
+    "What the analyzer received for show outputs, by kind (full, delta, unchanged or chunked).", ["kind"])
+REQUEST_RSS_GROWTH = REGISTRY.histogram(
+    "netagents_request_rss_growth_bytes",
+    "Peak growth of the process RSS while a pipeline run was in progress, by whether its output was spooled.",
+    ["output"], SIZE_BUCKETS + (float(256 * 1024 ** 2), float(1024 ** 3)))
+RESULT_STORE_BYTES = REGISTRY.histogram(
+    "netagents_result_store_bytes", "Size of tool outputs stored out of band, by location (memory or disk).",
+    ["location"], buckets=SIZE_BUCKETS)
+CHANGE_BATCH_SIZE = REGISTRY.histogram(
+    "netagents_change_batch_size", "Set operations applied per config session.", buckets=RATE_BUCKETS)
+CHANGE_QUEUE_WAIT = REGISTRY.histogram(
+    "netagents_change_queue_wait_seconds", "Time set operations waited in the change queue.")
+ROLLOUT_DEVICES = REGISTRY.counter(
+    "netagents_rollout_devices_total", "Devices handled by rollouts, by outcome (ok, error or skipped).", ["outcome"])
+QUERY_BATCH_QUERIES = REGISTRY.counter(
+    "netagents_query_batch_queries_total", "Queries processed by /process_batch, by outcome (ok or error).",
+    ["outcome"])
+QUERY_BATCH_SHOWS = REGISTRY.counter(
+    "netagents_query_batch_shows_total",
+    "Show commands of batch queries, by source (connects: new session, reused: open session, cached: shared output).",
+    ["source"])
+SSH_PROBES = REGISTRY.counter(
+    "netagents_ssh_probes_total", "TCP connects to device SSH ports, by outcome (reachable or unreachable).",
+    ["outcome"])
+SSH_WARM_SOCKETS = REGISTRY.counter(
+    "netagents_ssh_warm_sockets_total", "Probe sockets taken over by a login, expired or discarded unused, by outcome.",
+    ["outcome"])
+SPECULATIONS = REGISTRY.counter(
+    "netagents_speculations_total",
+    "Show commands run while the command was being determined, by outcome (hit, miss, error or abandoned).",
+    ["outcome"])
+SPECULATION_SAVED = REGISTRY.histogram(
+    "netagents_speculation_saved_seconds", "Execute step latency saved by confirmed speculative show commands.")
@@ -0,0 +1,320 @@
+"""OpenAI-compatible mock LLM server for offline benchmarks.
+
+Emulates the replies the pipeline expects from each agent (tool calls for NetworkAgent,
+command JSON for DominantAgent, analyses and summaries) with configurable latency,
+output size, number of parallel generation slots and per-slot prompt caching, like a
+llama.cpp server.
+
+Run standalone:
+    python mock_llm.py --port 8080 --latency 0.2 --token-delay 0.01
+"""
+import argparse
+import json
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Keyword rules mirroring DOMINANT_PROMPT, used to answer command determination
+COMMAND_RULES = [
+    (("bgp", "соседств"), "show bgp summary"),
+    (("qos", "качества обслуживания"), "show qos classifiers dscp"),
+    (("интерфейс", "interface"), "show interface brief"),
+]
+DEFAULT_COMMAND = "show interface brief"
+CHARS_PER_TOKEN = 4
+
+
+@dataclass
+class MockLLMSettings:
+    """Behaviour of the mock server.
+
+    Attributes:
+        latency (float): Fixed delay per request in seconds (prefill stand-in).
+        token_delay (float): Delay per generated token in seconds.
+        output_chars (int): Size of analyzer and summary replies in characters.
+        slots (int): Requests generated concurrently; the rest wait like on a llama.cpp server.
+        thinking_tokens (int): Reasoning tokens generated before the answer unless the request
+            disables thinking with `chat_template_kwargs.enable_thinking`, like Qwen3.
+        prefill_token_delay (float): Delay per prompt token not found in the slot's cache.
+    """
+    latency: float = 0.0
+    token_delay: float = 0.0
+    output_chars: int = 400
+    slots: int = 4
+    thinking_tokens: int = 0
+    prefill_token_delay: float = 0.0
+
+
+def _tokens(text: str) -> int:
+    return max(1, len(text) // CHARS_PER_TOKEN)
+
+
+def _message_text(message: Dict[str, Any]) -> str:
+    content = message.get("content")
+    if isinstance(content, list):
+        return "".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return content or ""
+
+
+def _pad(text: str, size: int) -> str:
+    filler = " Интерфейсы в норме, ошибок не обнаружено."
+    while len(text) < size:
+        text += filler
+    return text[:max(size, 1)]
+
+
+def _render(messages: List[Dict[str, Any]], tools: Optional[List[Dict[str, Any]]]) -> str:
+    """Prompt as a chat template lays it out: the system turn with the tools, then the rest."""
+    parts = [json.dumps(m.get("role")) + _message_text(m) for m in messages]
+    if parts and messages[0].get("role") == "system":
+        parts[0] += json.dumps(tools or [], ensure_ascii=False, sort_keys=True)
+    return "".join(parts)
+
+
+def choose_command(query: str) -> str:
+    """Picks the show command for a query with the same keyword rules as the prompt."""
+    lowered = query.lower()
+    for keywords, command in COMMAND_RULES:
+        if any(keyword in lowered for keyword in keywords):
+            return command
+    return DEFAULT_COMMAND
+
+
+class MockLLM:
+    """Produces chat completion replies for the pipeline's agents."""
+
+    def __init__(self, settings: MockLLMSettings):
+        self.settings = settings
+        self._lock = threading.Lock()
+        # Like llama.cpp, each slot keeps the KV cache of the last prompt it processed
+        self._slot_cond = threading.Condition()
+        self._slot_busy = [False] * settings.slots
+        self._slot_used = [0.0] * settings.slots
+        self._slot_prompts = [""] * settings.slots
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cached_tokens = 0
+
+    def _take_slot(self, id_slot: Optional[int]) -> int:
+        """Waits for the requested slot, or for the least recently used free one."""
+        with self._slot_cond:
+            while True:
+                if id_slot is not None and 0 <= id_slot < len(self._slot_busy):
+                    if not self._slot_busy[id_slot]:
+                        slot = id_slot
+                        break
+                else:
+                    free = [i for i, busy in enumerate(self._slot_busy) if not busy]
+                    if free:
+                        slot = min(free, key=lambda i: self._slot_used[i])
+                        break
+                self._slot_cond.wait()
+            self._slot_busy[slot] = True
+            return slot
+
+    def _free_slot(self, slot: int, prompt: str) -> None:
+        with self._slot_cond:
+            self._slot_busy[slot] = False
+            self._slot_used[slot] = time.monotonic()
+            self._slot_prompts[slot] = prompt
+            self._slot_cond.notify_all()
+
+    def _tool_call(self, text: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """Derives the tool call the NetworkAgent would make for an orchestrator message."""
+        ip_match = re.search(r"(\d{1,3}(?:\.\d{1,3}){3})", text)
+        host = ip_match.group(1) if ip_match else "127.0.0.1"
+        execute = re.search(r"Выполни (\w+) на IP \S+ с командой (.*) и credentials (\{.*\})", text, re.DOTALL)
+        if execute:
+            tool, command, creds = execute.group(1), execute.group(2).strip(), json.loads(execute.group(3))
+            args = {"host": host, "username": creds.get("username", ""), "password": creds.get("password", ""),
+                    "device_type": creds.get("device_type", "cisco_ios")}
+            if "port" in creds:
+                args["port"] = creds["port"]
+            if tool == "netmiko_set":
+                try:
+                    commands = json.loads(command.replace("'", '"'))
+                except json.JSONDecodeError:
+                    commands = [command]
+                args["commands"] = commands if isinstance(commands, list) else [str(commands)]
+            else:
+                args["command"] = command
+            return tool, args
+        tool_match = re.search(r"Выполни (\w+)", text)
+        if tool_match and tool_match.group(1) != "ping":
+            return tool_match.group(1), {"host": host}
+        if "ping" in text.lower():
+            return "ping_host", {"host": host}
+        return None
+
+    def reply(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        """Builds the chat completion response for a request body."""
+        messages: List[Dict[str, Any]] = body.get("messages", [])
+        system = _message_text(messages[0]) if messages and messages[0].get("role") == "system" else ""
+        last = messages[-1] if messages else {}
+        text = _message_text(last)
+        # First user message of the chat; later ones may be correction requests
+        request = next((_message_text(m) for m in messages if m.get("role") == "user"), text)
+        tool_calls = None
+        content: Optional[str]
+
+        if "Вы - NetworkAgent" in system:
+            call = self._tool_call(text) if body.get("tools") and last.get("role") == "user" else None
+            if call:
+                name, args = call
+                tool_calls = [{"id": f"call_{uuid.uuid4().hex[:12]}", "type": "function",
+                               "function": {"name": name, "arguments": json.dumps(args, ensure_ascii=False)}}]
+                content = None
+            else:
+                key = "ping_result" if "reachable" in text or "ping" in text.lower() else "show_result"
+                # Like the real model, the tool output is echoed back in full
+                content = json.dumps({key: text}, ensure_ascii=False) + "\nTERMINATE"
+        elif "Вы - DominantAgent" in system and "Определи подходящую команду" in request:
+            content = json.dumps({"command": choose_command(request), "command_type": "show"})
+        elif "Вы - Analyzer" in system:
+            analysis = {"status": "ok", "summary": _pad("Анализ выполнен.", self.settings.output_chars),
+                        "issues": [], "recommendations": []}
+            content = json.dumps(analysis, ensure_ascii=False)
+        else:
+            content = _pad("📊 Итог: устройство работает штатно.", self.settings.output_chars) + "\nTERMINATE"
+
+        if content is not None and not content.endswith("TERMINATE") and not body.get("response_format"):
+            # Schema-constrained replies have no room for the termination word
+            content += "\nTERMINATE"
+        thinking = body.get("chat_template_kwargs", {}).get("enable_thinking", True)
+        if content is not None and thinking and self.settings.thinking_tokens:
+            content = "<think>\n" + "хм " * self.settings.thinking_tokens + "\n</think>\n" + content
+        finish_reason = "tool_calls" if tool_calls else "stop"
+        max_tokens = body.get("max_tokens")
+        if content is not None and max_tokens and _tokens(content) > max_tokens:
+            content = content[:max_tokens * CHARS_PER_TOKEN]
+            finish_reason = "length"
+
+        prompt_tokens = sum(_tokens(_message_text(m)) for m in messages)
+        completion_tokens = _tokens(content or json.dumps(tool_calls))
+        prompt = _render(messages, body.get("tools"))
+        slot = self._take_slot(body.get("id_slot"))
+        cached_tokens = 0
+        if body.get("cache_prompt", True):
+            cached_tokens = min(len(os.path.commonprefix([prompt, self._slot_prompts[slot]])) // CHARS_PER_TOKEN,
+                                prompt_tokens)
+        try:
+            time.sleep(self.settings.latency + self.settings.prefill_token_delay * (prompt_tokens - cached_tokens)
+                       + self.settings.token_delay * completion_tokens)
+        finally:
+            self._free_slot(slot, prompt)
+        with self._lock:
+            self.requests += 1
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+            self.cached_tokens += cached_tokens
+
+        message: Dict[str, Any] = {"role": "assistant", "content": content}
+        if tool_calls:
+            message["tool_calls"] = tool_calls
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "mock"),
+            "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens,
+                      "prompt_tokens_details": {"cached_tokens": cached_tokens}},
+            "timings": {"cache_n": cached_tokens, "prompt_n": prompt_tokens - cached_tokens},
+        }
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: "MockLLMServer"
+
+    def _send_json(self, status: int, payload: Dict[str, Any]) -> None:
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self._send_json(200, {"object": "list", "data": [{"id": "mock", "object": "model"}]})
+        elif self.path == "/health":
+            self._send_json(200, {"status": "ok"})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": "not found"})
+            return
+        self._send_json(200, self.server.llm.reply(body))
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+class MockLLMServer(ThreadingHTTPServer):
+    """Threaded HTTP server serving the mock LLM on localhost."""
+
+    daemon_threads = True
+
+    def __init__(self, settings: Optional[MockLLMSettings] = None, host: str = "127.0.0.1", port: int = 0):
+        super().__init__((host, port), _Handler)
+        self.llm = MockLLM(settings or MockLLMSettings())
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        """OpenAI-compatible base URL, suitable for SystemConfig.llm_base_url."""
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "MockLLMServer":
+        """Serves requests on a background thread."""
+        self._thread = threading.Thread(target=self.serve_forever, name="mock-llm", daemon=True)
+        self._thread.start()
+        logger.info(f"Mock LLM listening on {self.base_url}")
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run an OpenAI-compatible mock LLM server.")
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Host to bind to (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8080, help="Port to listen on (default: 8080)")
+    parser.add_argument("--latency", type=float, default=0.0, help="Fixed delay per request in seconds")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="Delay per generated token in seconds")
+    parser.add_argument("--output-chars", type=int, default=400, help="Size of analyses and summaries")
+    parser.add_argument("--slots", type=int, default=4, help="Requests generated concurrently")
+    parser.add_argument("--thinking-tokens", type=int, default=0, help="Reasoning tokens unless thinking is disabled")
+    parser.add_argument("--prefill-token-delay", type=float, default=0.0, help="Delay per uncached prompt token")
+    args = parser.parse_args()
+
+    settings = MockLLMSettings(args.latency, args.token_delay, args.output_chars, args.slots, args.thinking_tokens,
+                               args.prefill_token_delay)
+    server = MockLLMServer(settings, args.host, args.port)
+    logger.info(f"Mock LLM listening on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    main()
@@ -1,15 +1,32 @@
 # Updated orchestrator.py with improved streaming and formatting
+import itertools
 import logging, time
 import json
 import re
 from pathlib import Path
-from typing import Dict, List, Optional, Generator
+from typing import Dict, List, Optional, Generator, Tuple
 from autogen import UserProxyAgent, AssistantAgent, register_function
 from autogen.coding import LocalCommandLineCodeExecutor
 from config import SystemConfig
-from agents import create_dominant_agent, create_network_agent, create_analyzer_agent
+from agents import create_dominant_agent, create_network_agent, create_analyzer_agent, register_llm_client
+from llm_client import NoBackendAvailableError, PooledLLMClient, get_llm_pool
 from state import SystemState
-from tools import ping_host, netmiko_show, netmiko_set  # Removed port_scan if not needed; add if required
+from schemas import AnalysisResult, CommandDecision, merge_analyses, parse_model
+from sessions import SessionRecord, get_session_store
+from inventory import device_key, get_inventory
+from poller import get_snapshot_store
+from history import OutputDelta, get_output_history
+from result_store import get_result_store
+from speculation import Speculation, get_speculator
+from spool import RssWatch, SpooledOutput
+from ssh_probe import get_warm_sockets
+from tools import ping_host, ssh_probe, netmiko_show, netmiko_set  # Removed port_scan if not needed; add if required
+import tracing
+from metrics import (
+    STEP_DURATION, STEP_ERRORS, LLM_CALL_DURATION, LLM_PROMPT_TOKENS,
+    LLM_COMPLETION_TOKENS, LLM_TOKENS_PER_SECOND, OUTPUT_BYTES, LLM_PARSE_RESULTS,
+    SESSION_REUSE, HISTORY_ANALYSIS_INPUT, REQUEST_RSS_GROWTH,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -26,12 +43,14 @@ class CoopetitionSystem:
             config (SystemConfig): Configuration object containing system settings.
         """
         self.config = config
-        self.state = SystemState()
+        self.state = SystemState(config.state_event_buffer, config.state_log_value_chars)
         self.code_executor = self._setup_code_executor()
         self.config.code_execution_config = {"executor": self.code_executor}
         self.dominant: AssistantAgent = None
+        self.summarizer: AssistantAgent = None
         self.network: AssistantAgent = None
         self.analyzer1: AssistantAgent = None
+        self.user_proxy: Optional[UserProxyAgent] = None
         #self.analyzer2: AssistantAgent = None
         self._setup_agents()
 
@@ -48,6 +67,8 @@ class CoopetitionSystem:
     def _setup_agents(self) -> None:
         """Initializes all agents using the provided configuration and state."""
         self.dominant = create_dominant_agent(self.config, self.state)
+        # Same prompt as the DominantAgent, with a generation budget sized for the final answer
+        self.summarizer = create_dominant_agent(self.config, self.state, profile="summary")
         self.network = create_network_agent(self.config, self.state)
         self.analyzer1 = create_analyzer_agent(1, self.config, self.state)
         #self.analyzer2 = create_analyzer_agent(2, self.config, self.state)
@@ -63,7 +84,7 @@ class CoopetitionSystem:
 
     def _register_tools(self, user_proxy: UserProxyAgent) -> None:
 
-        for func, desc in [(ping_host, ping_host.__doc__), (netmiko_show, netmiko_show.__doc__), (netmiko_set, netmiko_set.__doc__)]:
+        for func, desc in [(ping_host, ping_host.__doc__), (ssh_probe, ssh_probe.__doc__), (netmiko_show, netmiko_show.__doc__), (netmiko_set, netmiko_set.__doc__)]:
             register_function(
                 func,
                 caller=self.network,
@@ -71,6 +92,137 @@ class CoopetitionSystem:
                 name=func.__name__,
                 description=desc
             )
+        # Registering a tool rebuilds the agent's LLM client
+        register_llm_client(self.network, self.config)
+
+    def warm_up_prompts(self) -> Dict[str, Optional[int]]:
+        """Has the LLM backend process each agent's fixed prompt prefix once.
+
+        Each request carries an agent's system message and tools with a one-token reply
+        budget, so the prefix is left in a server slot's KV cache. With slot affinity, the
+        agent's real requests are then routed to that slot.
+
+        Returns:
+            Dict[str, Optional[int]]: Prompt tokens per agent, None where the request failed.
+        """
+        self._register_tools(self._create_user_proxy())
+        client = PooledLLMClient({}, pool=get_llm_pool(self.config))
+        prompt_tokens: Dict[str, Optional[int]] = {}
+        for agent in (self.dominant, self.network, self.analyzer1):
+            entry = agent.llm_config["config_list"][0]
+            params = {
+                "model": entry["model"],
+                "messages": [{"role": "system", "content": agent.system_message}, {"role": "user", "content": "."}],
+                "max_tokens": 1,
+                "extra_body": entry.get("extra_body", {}),
+                "slot_role": entry.get("slot_role"),
+            }
+            if agent.llm_config.get("tools"):
+                params["tools"] = agent.llm_config["tools"]
+            try:
+                prompt_tokens[agent.name] = client.create(params).usage.prompt_tokens
+            except Exception as e:
+                logger.warning(f"Prompt warm-up of {agent.name} failed: {str(e)}")
+                prompt_tokens[agent.name] = None
+        return prompt_tokens
+
+    def _speculate(self, user_query: str, ip: str, session: Optional[SessionRecord]) -> Optional[Speculation]:
+        """Starts the query's likely show command unless the execute step would not need it.
+
+        Returns:
+            Optional[Speculation]: The running command, or None if no command is predicted or
+                its output would come from the session or a prefetch snapshot anyway.
+        """
+        speculator = get_speculator()
+        command = speculator.predict(user_query)
+        if command is None:
+            return None
+        creds = self.state.get("credentials")
+        port = creds.get("port", 22)
+        if session and session.result_for(ip, command, self.config.session_result_max_age) is not None:
+            return None
+        if self.config.prefetch_enabled and get_snapshot_store().get(
+                device_key(ip, port), command, self.config.prefetch_max_age) is not None:
+            return None
+        return speculator.start(ip, port, creds, command)
+
+    @staticmethod
+    def _usage_totals(agent: AssistantAgent) -> Tuple[int, int]:
+        """Returns the cumulative (prompt, completion) token counts of an agent's LLM client."""
+        summary = agent.client.total_usage_summary if agent.client else None
+        prompt_tokens = completion_tokens = 0
+        for usage in (summary or {}).values():
+            if isinstance(usage, dict):
+                prompt_tokens += usage.get("prompt_tokens", 0)
+                completion_tokens += usage.get("completion_tokens", 0)
+        return prompt_tokens, completion_tokens
+
+    def _initiate_chat(self, user_proxy: UserProxyAgent, agent: AssistantAgent, message: str, step: str, **kwargs):
+        """Runs a chat between the user proxy and an agent, recording latency and token usage.
+
+        Args:
+            user_proxy (UserProxyAgent): Proxy initiating the chat and executing tools.
+            agent (AssistantAgent): Agent answering the message.
+            message (str): Message sent to the agent.
+            step (str): Pipeline step the chat belongs to.
+            **kwargs: Further `initiate_chat` arguments, e.g. max_turns or clear_history.
+
+        Returns:
+            ChatResult: Result of the chat.
+        """
+        prompt_before, completion_before = self._usage_totals(agent)
+        started = time.perf_counter()
+        with tracing.span(f"chat.{agent.name}", agent=agent.name, step=step) as chat_span:
+            result = user_proxy.initiate_chat(agent, message=message, **kwargs)
+            prompt_after, completion_after = self._usage_totals(agent)
+            completion_tokens = completion_after - completion_before
+            if chat_span:
+                chat_span.set_attribute("prompt_tokens", prompt_after - prompt_before)
+                chat_span.set_attribute("completion_tokens", completion_tokens)
+        elapsed = time.perf_counter() - started
+        LLM_CALL_DURATION.labels(agent=agent.name, step=step).observe(elapsed)
+        LLM_PROMPT_TOKENS.labels(agent=agent.name).inc(prompt_after - prompt_before)
+        LLM_COMPLETION_TOKENS.labels(agent=agent.name).inc(completion_tokens)
+        if completion_tokens and elapsed > 0:
+            LLM_TOKENS_PER_SECOND.labels(agent=agent.name).observe(completion_tokens / elapsed)
+        return result
+
+    def _structured_chat(self, user_proxy: UserProxyAgent, agent: AssistantAgent, message: str, step: str, model):
+        """Runs a chat whose reply must match a schema, asking the agent to correct invalid replies.
+
+        With `config.structured_output` the backend constrains the reply to the schema, which
+        leaves no room for TERMINATE, so the chat is limited to a single reply.
+
+        Args:
+            user_proxy (UserProxyAgent): Proxy initiating the chat.
+            agent (AssistantAgent): Agent answering the message.
+            message (str): Message sent to the agent.
+            step (str): Pipeline step the chat belongs to.
+            model: Pydantic model the reply is validated against.
+
+        Returns:
+            The validated model instance.
+
+        Raises:
+            ValueError: If the reply is still invalid after `config.structured_output_retries` corrections.
+        """
+        max_turns = 1 if self.config.structured_output else None
+        self._initiate_chat(user_proxy, agent, message, step, max_turns=max_turns)
+        for attempt in range(self.config.structured_output_retries + 1):
+            content = agent.last_message(user_proxy)["content"]
+            try:
+                parsed = parse_model(model, content, self.config.termination_msg)
+            except ValueError as e:
+                LLM_PARSE_RESULTS.labels(step=step, outcome="invalid").inc()
+                if attempt == self.config.structured_output_retries:
+                    raise
+                logger.warning(f"Invalid {model.__name__} from {agent.name} in step {step}: {str(e)}; asking to correct")
+                # Continue the same chat so the backend reuses the cached prompt prefix
+                correction = f"Ответ не соответствует формату: {str(e)}. Верни только исправленный JSON."
+                self._initiate_chat(user_proxy, agent, correction, step, max_turns=1, clear_history=False)
+                continue
+            LLM_PARSE_RESULTS.labels(step=step, outcome="ok").inc()
+            return parsed
 
     def _parse_json_response(self, response: Dict, step: str, key: str) -> Dict:
 
@@ -83,24 +235,66 @@ class CoopetitionSystem:
             logger.error(f"Failed to parse JSON from Network in step {step}: {response}")
             raise ValueError(f"Invalid JSON from Network in step {step}: {str(e)}")
 
-    def process_query_stream(self, user_query: str) -> Generator[str, None, None]:
+    def process_query_stream(
+        self, user_query: str, trace_id: Optional[str] = None, session_id: Optional[str] = None
+    ) -> Generator[str, None, None]:
+        """Processes a query, streaming progress and the final answer as text chunks.
+
+        Every run is recorded as a trace with one span per step, agent chat and tool call.
+        Queries sharing a session id are follow-ups: they default to the session's device,
+        skip the ping and reuse the show output while it is fresh, and see prior analyses.
+
+        Args:
+            user_query (str): The user's query.
+            trace_id (Optional[str]): Id for the recorded trace; generated when omitted.
+            session_id (Optional[str]): Client session id; None processes the query on its own.
+
+        Yields:
+            str: Chunks of the streamed response.
+        """
+        with tracing.start_trace("process_query", trace_id=trace_id, query=user_query, session_id=session_id or ""):
+            yield from self._process_query_stream(user_query, session_id)
+
+    def _process_query_stream(self, user_query: str, session_id: Optional[str] = None) -> Generator[str, None, None]:
 
+        step = "init"
+        step_span = None
+        result_handle = None
+        speculation = None
+        output = None
+        probed = None
+        rss = RssWatch(self.config.request_rss_limit)
+        # Every run starts from a fresh state and agents without earlier conversations,
+        # so one system can process several queries
+        self.state = SystemState(self.config.state_event_buffer, self.config.state_log_value_chars)
         try:
+            self.state.run_id = tracing.current_trace_id() or ""
             self.state.update("query", user_query)
             ip_match = re.search(r'(\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})', user_query)
-            ip = ip_match.group(1) if ip_match else self.DEFAULT_IP
+            session = get_session_store().get(session_id) if session_id else None
+            pinged_at = None
+            reused_result = None
+            result_at = None
+            history_entry = None
+            delta = None
+            if ip_match:
+                ip = ip_match.group(1)
+            else:
+                ip = session.ip if session and session.ip else self.DEFAULT_IP
             self.state.update("ip", ip)
-            # Hardcoded credentials for demo; replace with secure loading
-            self.state.update("credentials", {"username": "wbos", "password": "welcome", "device_type": "cisco_ios"})
-
-            user_proxy = self._create_user_proxy()
-            self._register_tools(user_proxy)
 
+            if self.user_proxy is None:
+                self.user_proxy = self._create_user_proxy()
+                self._register_tools(self.user_proxy)
+            else:
+                for agent in (self.user_proxy, self.dominant, self.summarizer, self.network, self.analyzer1):
+                    agent.reset()
+            user_proxy = self.user_proxy
             start_message = f"🔄 **Начинаю обработку запроса...**\n"            
             yield "<think>\n"
 
             for char in start_message:
-                time.sleep(0.013)
+                time.sleep(self.config.stream_char_delay)
                 yield char      
             #yield f"**Начинаю обработку запроса...**\n"
             yield f"Запрос: {user_query}\n"
@@ -111,38 +305,53 @@ class CoopetitionSystem:
             self.STEPS = ["ping", "credential_check", "determine_command", "execute", "analyze"]  # Изменение: удалён "select"
 
             for step in self.STEPS:
+                step_started = time.perf_counter()
+                step_span = tracing.begin_span(f"step.{step}", step=step)
                 self.state.advance_step(step)
-                logger.info(f"Current step: {step}, State: {self.state.data}")
+                # Lazy %-formatting: the state is rendered (truncated) only if INFO is enabled
+                logger.info("Current step: %s, State: %s", step, self.state)
                 yield "<think>\n"
                 yield f"**Шаг: {step}**\n"
                 #yield f"Состояние: ```json\n{json.dumps(self.state.data, indent=2, ensure_ascii=False)}\n```\n"
                 yield "</think>\n"
 
                 if step == "ping":
-                    check_ping_message = f"🏓 Проверяю доступность хоста {ip} с помощью ping...\n"
+                    method = "подключения к порту SSH" if self.config.reachability_check == "ssh" else "ping"
+                    check_ping_message = f"🏓 Проверяю доступность хоста {ip} с помощью {method}...\n"
                     yield "<think>\n"
 
                     for char in check_ping_message:
-                        time.sleep(0.013)
+                        time.sleep(self.config.stream_char_delay)
                         yield char
 
                     #yield f"🏓 Проверяю доступность хоста **{ip}** с помощью ping ...\n"
                     yield "</think>\n"
-                    user_proxy.initiate_chat(self.network, message=f"Выполни ping на IP {ip}. Обнови state.")
-                    last_message = self.network.last_message()
-                    if isinstance(last_message, dict) and "tool_calls" in last_message:
-                        tool_response = user_proxy.last_message()["content"]
-                        print(f"Ответ инструмента: {tool_response}\n")
-                        yield "<think>\n"
-                        yield f"Ответ инструмента: {tool_response}\n"
-                        yield "</think>\n"
-                        result_json = self._parse_json_response({"content": tool_response}, "ping", "ping_result")
+                    if session and session.host_checked(ip, self.config.session_result_max_age):
+                        SESSION_REUSE.labels(step=step).inc()
+                        self.state.update("ping_result", f"{ip} reachable (проверено ранее в этой сессии)")
                     else:
-                        yield "<think>\n"
-                        #yield f"Ответ Network: ```json\n{json.dumps(last_message, indent=2, ensure_ascii=False)}\n```\n"
-                        yield "</think>\n"
-                        result_json = self._parse_json_response(last_message, "ping", "ping_result")
-                    self.state.update("ping_result", result_json.get("ping_result", "Нет результата"))
+                        pinged_at = time.time()
+                        if self.config.reachability_check == "ssh":
+                            # TCP connect to the SSH port; the socket is reused by the login in the execute step
+                            probed = device_key(ip)
+                            probe_message = f"Выполни ssh_probe на IP {ip}. Обнови state."
+                        else:
+                            probe_message = f"Выполни ping на IP {ip}. Обнови state."
+                        self._initiate_chat(user_proxy, self.network, probe_message, step)
+                        last_message = self.network.last_message()
+                        if isinstance(last_message, dict) and "tool_calls" in last_message:
+                            tool_response = user_proxy.last_message()["content"]
+                            print(f"Ответ инструмента: {tool_response}\n")
+                            yield "<think>\n"
+                            yield f"Ответ инструмента: {tool_response}\n"
+                            yield "</think>\n"
+                            result_json = self._parse_json_response({"content": tool_response}, "ping", "ping_result")
+                        else:
+                            yield "<think>\n"
+                            #yield f"Ответ Network: ```json\n{json.dumps(last_message, indent=2, ensure_ascii=False)}\n```\n"
+                            yield "</think>\n"
+                            result_json = self._parse_json_response(last_message, "ping", "ping_result")
+                        self.state.update("ping_result", str(result_json.get("ping_result", "Нет результата")))
                     yield "<think>\n"
                     yield f"**Результат ping: {self.state.get('ping_result')}**\n"
                     if "unreachable" in self.state.get('ping_result').lower():
@@ -157,11 +366,13 @@ class CoopetitionSystem:
                     yield "<think>\n"
 
                     for char in credes_check_message:
-                        time.sleep(0.013)
+                        time.sleep(self.config.stream_char_delay)
                         yield char
 
                     #yield f"Проверяю наличие данных для входа на хост {ip}...\n"
                     yield "</think>\n"
+                    # Credentials and driver come from the inventory; unknown platforms are fingerprinted once
+                    self.state.update("credentials", get_inventory().resolve(ip))
                     creds = self.state.get("credentials")
                     if creds and all(key in creds for key in ["username", "password", "device_type"]):
                         self.state.update("credential_status", "Доступны")
@@ -175,43 +386,28 @@ class CoopetitionSystem:
                     determ_cmd_message = "🧩 Определяю подходящую команду для запроса ...\n"
                     yield "<think>\n"
                     for char in determ_cmd_message:
-                        time.sleep(0.013)
+                        time.sleep(self.config.stream_char_delay)
                         yield char
                     
                     #yield "🧩 Определяю подходящую команду для запроса ...\n"
                     yield "</think>\n"
-                    user_proxy.initiate_chat(self.dominant, message=f"Определи подходящую команду (show или set) для запроса: {user_query}. Обнови state с 'command' (строка или список для set) и 'command_type' (show/set).")
-                    determine_content = self.dominant.last_message()["content"]
-                    yield "<think>\n"
-                    #yield f"Ответ Dominant: ```\n{determine_content}\n```\n"
-                    yield "</think>\n"
+                    if self.config.speculation_enabled:
+                        speculation = self._speculate(user_query, ip, session)
                     try:
-                        content = determine_content.split("TERMINATE")[0].strip()
-                        # Ищем JSON-подобный блок (после [ACT] или напрямую)
-                        json_match = re.search(r'\{.*\}', content, re.DOTALL)
-                        if json_match:
-                            det_json = json.loads(json_match.group(0))
-                        else:
-                            # Альтернативный парсинг из текста, если нет чистого JSON
-                            command_line = re.search(r'command`?: (.*)', content)
-                            type_line = re.search(r'command_type`?: (.*)', content)
-                            if command_line and type_line:
-                                command = command_line.group(1).strip('"')
-                                command_type = type_line.group(1).strip('"')
-                                det_json = {"command": command, "command_type": command_type}
-                            else:
-                                raise ValueError("Не удалось извлечь команду из ответа DominantAgent")
+                        decision = self._structured_chat(user_proxy, self.dominant, f"Определи подходящую команду (show или set) для запроса: {user_query}. Обнови state с 'command' (строка или список для set) и 'command_type' (show/set).", step, CommandDecision)
                         
-                        self.state.update("command", det_json.get("command"))
-                        self.state.update("command_type", det_json.get("command_type", "show"))
+                        self.state.update("command", decision.command)
+                        self.state.update("command_type", decision.command_type)
                         yield "<think>\n"
                         yield f"Команда: **{self.state.get('command')}**, Тип: {self.state.get('command_type')}\n"
                         
                         for char in "Команда определена, перехожу к следующему шагу.\n":
-                            time.sleep(0.013)
+                            time.sleep(self.config.stream_char_delay)
                             yield char
                         #yield "Команда определена, перехожу к следующему шагу.\n"
                         yield "</think>\n"
+                    except NoBackendAvailableError:
+                        raise
                     except Exception as e:
                         raise ValueError(f"Не удалось определить команду: {str(e)}")
                     
@@ -221,65 +417,104 @@ class CoopetitionSystem:
                     command = self.state.get("command")
                     command_type = self.state.get("command_type")
                     creds = self.state.get("credentials")
-                    exec_cmd_message = f"⏳ Выполняю команду **'{command}'** на wbos@{ip} ...\n"
-                    yield "<think>\n"
-                    for char in exec_cmd_message:
-                        time.sleep(0.013)
-                        yield char
-                    #yield f"⏳ Выполняю команду **'{command}'** на wbos@{ip} ...\n"
-                    yield "</think>\n"
-                    tool_name = "netmiko_show" if command_type == "show" else "netmiko_set"
-                    message = f"Выполни {tool_name} на IP {ip} с командой {command} и credentials {json.dumps(creds)}."
-                    user_proxy.initiate_chat(self.network, message=message)
-                    
-                    # Изменено: Захватите сырой output из истории чата self.network
-                    raw_tool_output = None
-                    chat_history = self.network.chat_messages.get(user_proxy, [])  # Получаем список сообщений от user_proxy к network
-                    for msg in chat_history:
-                        # Изменено: Добавлена проверка на наличие и не-None content
-                        if "content" in msg and msg["content"] is not None and "Response from calling tool" in msg["content"]:
-                            # Извлеките полный output (он между ***** Response ... ***** и ***** )
-                            try:
-                                print(f'raw_tool_output_for_artem: {raw_tool_output}')
-                                raw_tool_output = msg["content"].split("***** Response from calling tool")[1].split("*****")[1].strip()
-                            except IndexError:
-                                raw_tool_output = msg["content"].strip()  # Fallback, если парсинг не удался
-                            break  # Прерываем после нахождения
-                    
-                    # Добавлено: Отладка, если raw_tool_output не найден (можно убрать позже)
-                    if raw_tool_output is None:
-                        logger.warning("Не удалось найти сырой output в истории чата. Использую parsed результат.")
-                    
-                    last_message = self.network.last_message()
-                    print(f"*********************************************************************** last_message ********************************************************************************\n {last_message}")
-                    
-                    if isinstance(last_message, dict) and "tool_calls" in last_message:
-                        tool_response = user_proxy.last_message()["content"]
+                    reused_result = session.result_for(ip, command, self.config.session_result_max_age) if session else None
+                    snapshot = None
+                    if reused_result is None and self.config.prefetch_enabled and command_type == "show" and isinstance(command, str):
+                        snapshot = get_snapshot_store().lookup(
+                            device_key(ip, creds.get("port", 22)), command, self.config.prefetch_max_age)
+                    speculative_result = None
+                    if speculation is not None:
+                        speculative_result = speculation.resolve(
+                            command if command_type == "show" and isinstance(command, str) else None)
+                    if reused_result is not None:
+                        SESSION_REUSE.labels(step=step).inc()
+                        execute_result = reused_result
+                        yield "<think>\n"
+                        yield f"Использую результат команды **'{command}'** из текущей сессии.\n"
+                        yield "</think>\n"
+                    elif snapshot is not None:
+                        execute_result = snapshot.output
+                        result_at = snapshot.collected_at
                         yield "<think>\n"
-                        yield f"Ответ инструмента: {tool_response}\n"
+                        yield f"Использую снимок команды **'{command}'**, собранный {snapshot.age:.0f} с назад.\n"
+                        yield "</think>\n"
+                    elif speculative_result is not None:
+                        execute_result = speculative_result
+                        result_at = speculation.started_at
+                        yield "<think>\n"
+                        yield f"Команда **'{command}'** уже выполнена параллельно с её определением.\n"
                         yield "</think>\n"
-                        result_json = self._parse_json_response({"content": tool_response}, "execute", f"{command_type}_result")
                     else:
+                        result_at = time.time()
+                        exec_cmd_message = f"⏳ Выполняю команду **'{command}'** на {creds['username']}@{ip} ...\n"
                         yield "<think>\n"
-                        #yield f"Ответ Network: ```json\n{json.dumps(last_message, indent=2, ensure_ascii=False)}\n```\n"
+                        for char in exec_cmd_message:
+                            time.sleep(self.config.stream_char_delay)
+                            yield char
+                        #yield f"⏳ Выполняю команду **'{command}'** на {creds['username']}@{ip} ...\n"
                         yield "</think>\n"
-                        result_json = self._parse_json_response(last_message, "execute", f"{command_type}_result")
-                        print(f"************VIEW ********** result_json *********** \n {result_json}")
-                    
-                    # Используйте сырой output, если он доступен (fallback на parsed, если нет)
-                    execute_result = raw_tool_output or result_json.get(f"{command_type}_result", "Нет результата")
+                        tool_name = "netmiko_show" if command_type == "show" else "netmiko_set"
+                        message = f"Выполни {tool_name} на IP {ip} с командой {command} и credentials {json.dumps(creds)}."
+                        store = get_result_store()
+                        with store.collect() as handles:
+                            self._initiate_chat(user_proxy, self.network, message, step)
+
+                        if handles:
+                            # The tool kept the output out of band; the chat only carried its handle.
+                            # It is copied chunk by chunk, so a large output never becomes one string.
+                            result_handle = handles[-1]
+                            self.state.update("result_handle", result_handle)
+                            output = SpooledOutput(self.config.result_store_spill_threshold, self.config.result_store_spill_dir)
+                            for data in store.iter_bytes(result_handle):
+                                output.write_bytes(data)
+                            execute_result = None
+                        else:
+                            # No stored output (e.g. the tool failed): use the agent's answer
+                            last_message = self.network.last_message()
+                            if isinstance(last_message, dict) and "tool_calls" in last_message:
+                                tool_response = user_proxy.last_message()["content"]
+                                yield "<think>\n"
+                                yield f"Ответ инструмента: {tool_response}\n"
+                                yield "</think>\n"
+                                result_json = self._parse_json_response({"content": tool_response}, "execute", f"{command_type}_result")
+                            else:
+                                result_json = self._parse_json_response(last_message, "execute", f"{command_type}_result")
+                            execute_result = result_json.get(f"{command_type}_result", "Нет результата")
+                        if execute_result is not None and not isinstance(execute_result, str):
+                            execute_result = json.dumps(execute_result, ensure_ascii=False)
+                    if output is None:
+                        output = SpooledOutput.from_text(
+                            execute_result, self.config.result_store_spill_threshold, self.config.result_store_spill_dir)
+                    OUTPUT_BYTES.labels(source="execute_result").observe(output.size)
+                    output_inline = output.size <= self.config.output_inline_limit
+                    if output_inline:
+                        execute_result = output.text() if execute_result is None else execute_result
+                    else:
+                        # State, session and prompts keep only the head; the whole output stays in the spool
+                        execute_result = (f"{output.head(self.config.output_inline_limit)}\n"
+                                          f"… [{output.size} bytes, {output.lines} lines]")
+                        logger.info(f"Output of '{command}' is {output.size} bytes, kept spooled")
                     self.state.update("execute_result", execute_result)
+                    if self.config.history_enabled and command_type == "show" and isinstance(command, str) \
+                            and output_inline and not execute_result.startswith("Error"):
+                        history_entry, delta = get_output_history().record(
+                            device_key(ip, creds.get("port", 22)), command, execute_result, result_at)
                     yield "<think>\n"
                     #yield f"Результат выполнения: {execute_result}\n"  # Теперь полный
                     yield "Команда выполнена, перехожу к анализу.\n"
                     yield "</think>\n"
                     
-                    # Display the raw tool output to the user immediately as plain text
-                    if execute_result:
-                        execute_result_char = f"Результат выполнения команды:\n```\n{execute_result}\n```\n"
-                        for char in execute_result_char:
-                            time.sleep(0.0095) 
-                            yield char                    
+                    # Display the raw tool output to the user immediately as plain text, read from the
+                    # spool line by line; large outputs go in bigger pieces without the typing delay
+                    if output.size:
+                        yield "Результат выполнения команды:\n```\n"
+                        if output_inline:
+                            for line in output.iter_lines():
+                                time.sleep(self.config.stream_output_char_delay * len(line))
+                                yield line
+                        else:
+                            yield from output.iter_text()
+                        yield "\n```\n"
                         #yield f"Результат выполнения команды:\n```\n{execute_result}\n```\n"
 ##############################################################################################################
                 elif step == "analyze":
@@ -289,16 +524,25 @@ class CoopetitionSystem:
                     start_analysis_message = f"🧠 Начинаю анализ с {self.analyzer1.name} ...\n"
                     yield "<think>\n"
                     for char in start_analysis_message:
-                        time.sleep(0.013)
+                        time.sleep(self.config.stream_char_delay)
                         yield char
                     #yield f"🧠 Начинаю анализ с {self.analyzer1.name}...\n"
                     yield "</think>\n"
-                    user_proxy.initiate_chat(self.analyzer1, message=f"Анализируй данные из state: {self.state.get('execute_result')}")
-                    analysis_content = self.analyzer1.last_message()["content"]
+                    context = ""
+                    if session and session.analyses:
+                        context = f"Уточняющий вопрос пользователя: {user_query}\nПредыдущий анализ: {session.analyses[-1]}\n"
+                    if output is not None and output.size > self.config.output_inline_limit:
+                        analysis_result = self._analyze_in_chunks(user_proxy, self.state.get("command"), output, context, step)
+                    else:
+                        analysis_message = self._analysis_message(self.state.get("command"), self.state.get("execute_result"), delta)
+                        analysis_result = self._structured_chat(user_proxy, self.analyzer1, context + analysis_message, step, AnalysisResult)
                     yield "<think>\n"
-                    #yield f"Ответ {self.analyzer1.name}: ```json\n{analysis_content}\n```\n"
+                    #yield f"Ответ {self.analyzer1.name}: ```json\n{analysis_result.model_dump_json(indent=2)}\n```\n"
                     yield "</think>\n"
-                    analysis = analysis_content.split("TERMINATE")[0].strip()
+                    analysis = analysis_result.model_dump_json()
+                    if history_entry is not None:
+                        get_output_history().annotate(device_key(ip, creds.get("port", 22)), self.state.get("command"),
+                                                      history_entry.digest, analysis)
                     # Изменено: убрали self.state.update("analysis", analysis) — храним как локальную переменную, чтобы избежать ошибки валидации
                     # yield "<think>\n"
                     # #yield f"Анализ добавлен: {analysis}\n"
@@ -311,12 +555,12 @@ class CoopetitionSystem:
                     finally_analysis_message = "📊 Анализ завершен, подвожу резюме на основе анализа ...\n"
                     yield "<think>\n"
                     for char in finally_analysis_message:
-                        time.sleep(0.013)
+                        time.sleep(self.config.stream_char_delay)
                         yield char
                     #yield "Анализ завершен, подвожу резюме на основе анализа ...\n"
                     yield "</think>\n"
-                    user_proxy.initiate_chat(self.dominant, message=f"Сформируй финальный ответ на русском на основе анализа: {analysis} и результата выполнения: {self.state.get('execute_result')}. пусть ответ будет структурированным и разделен по логике повествования а так же пусть будут строгие эмодзи обозначающие разделы ответа")
-                    summary_content = self.dominant.last_message()["content"]
+                    self._initiate_chat(user_proxy, self.summarizer, f"Сформируй финальный ответ на русском на основе анализа: {analysis} и результата выполнения: {self.state.get('execute_result')}. пусть ответ будет структурированным и разделен по логике повествования а так же пусть будут строгие эмодзи обозначающие разделы ответа", step)
+                    summary_content = self.summarizer.last_message()["content"]
                     yield "<think>\n"
                     #yield f"Резюме: ```\n{summary_content}\n```\n"
                     yield "</think>\n"
@@ -325,7 +569,7 @@ class CoopetitionSystem:
                     self.state.update("best_analysis", final_response)  # Изменено: используем "best_analysis" вместо "final_response" для совместимости с валидацией state
                     # Stream final response
                     for char in final_response:
-                        time.sleep(0.0095) 
+                        time.sleep(self.config.stream_output_char_delay) 
                         yield char
                     yield "\n"
 
@@ -333,11 +577,125 @@ class CoopetitionSystem:
                 last_message = self.state.get("best_analysis") or self.state.get("execute_result") or self.state.get("ping_result")  # Изменено: используем "best_analysis" вместо "final_response"
                 if last_message and isinstance(last_message, str) and "error" in last_message.lower():
                     raise ValueError(f"Ошибка на шаге {step}: {last_message}")
+                if not rss.check():
+                    raise ValueError(f"Превышен лимит памяти запроса: RSS вырос на {rss.growth // (1024 * 1024)} МБ")
+                STEP_DURATION.labels(step=step).observe(time.perf_counter() - step_started)
+                if step_span:
+                    step_span.finish()
+
+            if session:
+                self._save_session(session, ip, user_query, analysis, pinged_at, result_at,
+                                   output is None or output.size <= self.config.output_inline_limit)
         except Exception as e:
-            logger.error(f"Error: {e}")
+            STEP_ERRORS.labels(step=step).inc()
+            error = f"LLM недоступна: {str(e)}" if isinstance(e, NoBackendAvailableError) else str(e)
+            self.state.update("error", error)
+            if step_span:
+                step_span.finish(error=error)
+            logger.error(f"Error: {error}")
             yield "<think>\n"
-            yield f"Произошла ошибка: {str(e)}\n"
+            yield f"Произошла ошибка: {error}\n"
             yield "</think>\n"
+        finally:
+            if speculation is not None:
+                speculation.abandon()
+            if probed is not None:
+                # No-op when the execute step logged in over the probe socket
+                get_warm_sockets().discard(probed)
+            rss.check()
+            spooled = output is not None and output.size > self.config.output_inline_limit
+            REQUEST_RSS_GROWTH.labels(output="spooled" if spooled else "inline").observe(rss.growth)
+            if output is not None:
+                output.close()
+            if result_handle:
+                # The output lives on in the state and the session; the stored copy is no longer needed
+                get_result_store().delete(result_handle)
+
+    def _analysis_message(self, command: str, output: str, delta: Optional[OutputDelta]) -> str:
+        """Builds the analyzer request, sending only the changes when a show output was seen before.
+
+        The delta is used for outputs of at least `history_min_output_chars` characters when it is
+        at most `history_delta_max_ratio` of the output; otherwise the full output is sent.
+
+        Args:
+            command (str): The command that was run.
+            output (str): Its output.
+            delta (Optional[OutputDelta]): Difference to the previous output, None if there is none.
+
+        Returns:
+            str: Message for the analyzer.
+        """
+        if delta is not None and len(output) >= self.config.history_min_output_chars:
+            rendered = delta.render()
+            if len(rendered) <= self.config.history_delta_max_ratio * len(output):
+                HISTORY_ANALYSIS_INPUT.labels(kind="delta" if delta.changed else "unchanged").inc()
+                OUTPUT_BYTES.labels(source="analysis_delta").observe(len(rendered.encode("utf-8")))
+                age = time.time() - delta.previous.last_seen
+                message = (f"Анализируй изменения вывода команды '{command}' ({len(output)} символов) "
+                           f"с предыдущего запуска {age:.0f} с назад: {rendered}")
+                if delta.previous.analysis:
+                    message += f"\nАнализ предыдущего вывода: {delta.previous.analysis}"
+                return message
+        HISTORY_ANALYSIS_INPUT.labels(kind="full").inc()
+        return f"Анализируй данные из state: {output}"
+
+    def _analyze_in_chunks(
+        self, user_proxy: UserProxyAgent, command: str, output: SpooledOutput, context: str, step: str
+    ) -> AnalysisResult:
+        """Analyzes an output too large for one prompt part by part and merges the analyses.
+
+        Parts of about `analysis_chunk_bytes` bytes are read from the spool one at a time, and
+        each chat clears the previous one, so only one part is held in memory and prompts.
+
+        Args:
+            user_proxy (UserProxyAgent): Proxy initiating the chats.
+            command (str): The command that was run.
+            output (SpooledOutput): Its output.
+            context (str): Follow-up context prepended to every part.
+            step (str): Pipeline step the chats belong to.
+
+        Returns:
+            AnalysisResult: The merged analysis.
+        """
+        HISTORY_ANALYSIS_INPUT.labels(kind="chunked").inc()
+        parts = []
+        analyzed = 0
+        for chunk in itertools.islice(output.iter_text(self.config.analysis_chunk_bytes), self.config.analysis_max_chunks):
+            message = (f"{context}Анализируй часть {len(parts) + 1} вывода команды '{command}' "
+                       f"(всего {output.size} байт, {output.lines} строк): {chunk}")
+            parts.append(self._structured_chat(user_proxy, self.analyzer1, message, step, AnalysisResult))
+            analyzed += len(chunk.encode("utf-8"))
+        note = ""
+        if analyzed < output.size:
+            note = f"Проанализированы первые {analyzed} из {output.size} байт вывода."
+        return merge_analyses(parts, note)
+
+    def _save_session(
+        self, session: SessionRecord, ip: str, user_query: str, analysis: str,
+        pinged_at: Optional[float], result_at: Optional[float], keep_output: bool = True
+    ) -> None:
+        """Keeps the results of a completed query for follow-ups in the same session.
+
+        Args:
+            session (SessionRecord): The session's record.
+            ip (str): Device queried.
+            user_query (str): The query.
+            analysis (str): Analysis produced for the query, as JSON.
+            pinged_at (Optional[float]): Time of the ping, None if it was reused from the session.
+            result_at (Optional[float]): Time the command output was collected, None if it was reused from the session.
+            keep_output (bool): False for spooled outputs, whose head in the state must not be reused.
+        """
+        changes = {
+            "ip": ip,
+            "command": self.state.get("command"),
+            "command_type": self.state.get("command_type"),
+            "execute_result": self.state.get("execute_result") if keep_output else None,
+        }
+        if pinged_at is not None:
+            changes["reachable_at"] = pinged_at
+        if result_at is not None:
+            changes["result_at"] = result_at
+        get_session_store().save(session.session_id, changes, analysis, user_query)
 
     def process_query(self, user_query: str) -> str:
         """Non-streaming version for compatibility."""
@@ -0,0 +1,343 @@
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from config import SystemConfig
+from DoNetAgent import NetAgent
+from device_limits import get_device_limiter
+from inventory import Device, Inventory, get_inventory
+from metrics import PREFETCH_LOOKUPS, PREFETCH_POLLS
+
+logger = logging.getLogger(__name__)
+
+SHOW_ERROR_PREFIX = "Error executing show command"
+
+
+def normalize_command(command: str) -> str:
+    """Collapses whitespace so equivalent spellings of a command share a snapshot."""
+    return " ".join(command.split()).lower()
+
+
+@dataclass(frozen=True, slots=True)
+class Snapshot:
+    """Output of a show command collected in the background.
+
+    Attributes:
+        device (str): Device key (`host` or `host:port`).
+        command (str): The show command as configured.
+        output (str): Command output.
+        collected_at (float): Collection time (time.time()).
+        duration (float): Seconds the command took.
+    """
+    device: str
+    command: str
+    output: str
+    collected_at: float
+    duration: float
+
+    @property
+    def age(self) -> float:
+        return time.time() - self.collected_at
+
+
+class SnapshotStore:
+    """Latest show outputs per device and command, shared by the poller and the pipelines.
+
+    Whatever applies a configuration change to a device calls `invalidate`, so show commands
+    asked after the change are not answered from a pre-change snapshot.
+    """
+
+    def __init__(self):
+        self._snapshots: Dict[Tuple[str, str], Snapshot] = {}
+        # device -> time of the last configuration change (time.time())
+        self._changed_at: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def put(self, snapshot: Snapshot, started_at: Optional[float] = None) -> bool:
+        """Stores a snapshot unless the device was changed after its collection started.
+
+        Args:
+            snapshot (Snapshot): The snapshot.
+            started_at (Optional[float]): Time the collection started; defaults to `collected_at`.
+
+        Returns:
+            bool: False if the snapshot was dropped as predating a change.
+        """
+        started_at = snapshot.collected_at if started_at is None else started_at
+        with self._lock:
+            if started_at < self._changed_at.get(snapshot.device, 0.0):
+                return False
+            self._snapshots[(snapshot.device, normalize_command(snapshot.command))] = snapshot
+            return True
+
+    def invalidate(self, device: str) -> int:
+        """Drops the snapshots of a device after a configuration change.
+
+        Polls of the device already running when the change was made are dropped too.
+
+        Args:
+            device (str): Device key (`host` or `host:port`).
+
+        Returns:
+            int: Number of snapshots dropped.
+        """
+        with self._lock:
+            self._changed_at[device] = time.time()
+            stale = [key for key in self._snapshots if key[0] == device]
+            for key in stale:
+                del self._snapshots[key]
+        if stale:
+            logger.info(f"Dropped {len(stale)} snapshot(s) of {device} after a configuration change")
+        return len(stale)
+
+    def get(self, device: str, command: str, max_age: Optional[float] = None) -> Optional[Snapshot]:
+        """Returns the snapshot of a command on a device if it is recent enough.
+
+        Args:
+            device (str): Device key (`host` or `host:port`).
+            command (str): Show command.
+            max_age (Optional[float]): Maximum age in seconds; None accepts any age.
+        """
+        with self._lock:
+            snapshot = self._snapshots.get((device, normalize_command(command)))
+        if snapshot is not None and max_age is not None and snapshot.age > max_age:
+            return None
+        return snapshot
+
+    def lookup(self, device: str, command: str, max_age: float) -> Optional[Snapshot]:
+        """Like `get`, counting the lookup as a hit, stale snapshot or miss."""
+        snapshot = self.get(device, command)
+        if snapshot is None:
+            PREFETCH_LOOKUPS.labels(result="miss").inc()
+            return None
+        if snapshot.age > max_age:
+            PREFETCH_LOOKUPS.labels(result="stale").inc()
+            return None
+        PREFETCH_LOOKUPS.labels(result="hit").inc()
+        return snapshot
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            snapshots = list(self._snapshots.values())
+        now = time.time()
+        return {
+            "snapshots": len(snapshots),
+            "bytes": sum(len(snapshot.output.encode("utf-8")) for snapshot in snapshots),
+            "oldest_age": max((now - snapshot.collected_at for snapshot in snapshots), default=None),
+            "devices": len({snapshot.device for snapshot in snapshots}),
+        }
+
+
+def _collect(device: Device, params: Dict[str, Any], commands: List[str]) -> Dict[str, str]:
+    """Runs show commands over a single SSH session; failed commands are left out."""
+    limiter = get_device_limiter()
+    outputs = {}
+    with limiter.session(device.key, params["device_type"]) as ticket:
+        agent = NetAgent(host=device.host, username=params["username"], password=params["password"],
+                         device_type=params["device_type"], port=device.port)
+        try:
+            for command in commands:
+                with limiter.command(ticket):
+                    output = agent.execute_show(command)
+                if output.startswith(SHOW_ERROR_PREFIX):
+                    logger.warning(f"Prefetch of '{command}' on {device.key} failed: {output}")
+                    continue
+                outputs[command] = output
+        finally:
+            agent.disconnect()
+    return outputs
+
+
+class PrefetchPoller:
+    """Background collector keeping the outputs of frequently queried show commands warm.
+
+    Every device of a scheduled inventory group is polled once per interval; all commands of
+    the group run over one SSH session. Poll times are jittered so devices are not hit in
+    lockstep, at most `concurrency` devices are polled at once, and every session goes through
+    the device limiter like interactive queries do.
+    """
+
+    def __init__(
+        self,
+        inventory: Inventory,
+        store: SnapshotStore,
+        schedule: Dict[str, Dict[str, Any]],
+        interval: float,
+        concurrency: int,
+        jitter: float,
+        collector: Optional[Callable[[Device, Dict[str, Any], List[str]], Dict[str, str]]] = None,
+    ):
+        """Initializes the poller.
+
+        Args:
+            inventory (Inventory): Inventory providing the devices of each group.
+            store (SnapshotStore): Store receiving the snapshots.
+            schedule (Dict[str, Dict[str, Any]]): Per group: "commands" to poll and an optional "interval".
+            interval (float): Seconds between polls of groups without their own interval.
+            concurrency (int): Maximum number of devices polled at once.
+            jitter (float): Poll times are spread by +/- this fraction of the interval.
+            collector (Optional[Callable]): Returns the outputs of (device, connection params, commands).
+        """
+        self.inventory = inventory
+        self.store = store
+        self.schedule = schedule
+        self.interval = interval
+        self.concurrency = concurrency
+        self.jitter = jitter
+        self.collector = collector or _collect
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._in_flight: set = set()
+        self._next_due: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._polls = 0
+        self._errors = 0
+
+    @classmethod
+    def from_config(cls, config: SystemConfig, store: SnapshotStore) -> "PrefetchPoller":
+        return cls(get_inventory(), store, config.prefetch_schedule, config.prefetch_interval,
+                   config.prefetch_concurrency, config.prefetch_jitter)
+
+    def targets(self) -> List[Tuple[Device, List[str], float]]:
+        """Returns (device, commands, interval) for every scheduled device."""
+        targets = []
+        for group, entry in self.schedule.items():
+            devices = self.inventory.devices_in(group)
+            if not devices:
+                logger.warning(f"Prefetch group '{group}' has no devices in the inventory")
+            for device in devices:
+                targets.append((device, list(entry["commands"]), float(entry.get("interval", self.interval))))
+        return targets
+
+    def _jittered(self, interval: float) -> float:
+        return interval * (1 + random.uniform(-self.jitter, self.jitter))
+
+    def start(self) -> None:
+        """Starts polling in a daemon thread."""
+        if self._thread is not None:
+            return
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="prefetch")
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="prefetch-scheduler", daemon=True)
+        self._thread.start()
+        logger.info(f"Prefetch poller started for groups {sorted(self.schedule)}")
+
+    def stop(self, wait: bool = True) -> None:
+        """Stops scheduling polls; running polls finish if `wait` is set."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+            self._executor = None
+
+    def _run(self) -> None:
+        targets = self.targets()
+        now = time.monotonic()
+        # Spread the first round over one interval instead of polling everything at start-up
+        for device, _, interval in targets:
+            self._next_due[device.key] = now + random.uniform(0, interval * max(self.jitter, 0.1))
+        while not self._stop.is_set():
+            now = time.monotonic()
+            for device, commands, interval in targets:
+                if self._next_due[device.key] > now:
+                    continue
+                with self._lock:
+                    if device.key in self._in_flight:
+                        continue
+                    self._in_flight.add(device.key)
+                self._next_due[device.key] = now + self._jittered(interval)
+                self._executor.submit(self.poll, device, commands)
+            wake = min(self._next_due.values(), default=now + 1.0)
+            self._stop.wait(min(max(wake - time.monotonic(), 0.05), 1.0))
+
+    def poll(self, device: Device, commands: List[str]) -> int:
+        """Collects the commands of one device into the store.
+
+        Returns:
+            int: Number of snapshots stored.
+        """
+        started = time.perf_counter()
+        started_at = time.time()
+        try:
+            params = self.inventory.resolve(device.host, device.port)
+            outputs = self.collector(device, params, commands)
+            finished = time.time()
+            duration = time.perf_counter() - started
+            for command, output in outputs.items():
+                self.store.put(Snapshot(device.key, command, output, finished, duration), started_at)
+            outcome = "ok" if len(outputs) == len(commands) else "error"
+            return len(outputs)
+        except Exception as e:
+            logger.warning(f"Prefetch poll of {device.key} failed: {str(e)}")
+            outcome = "error"
+            return 0
+        finally:
+            PREFETCH_POLLS.labels(outcome=outcome).inc()
+            with self._lock:
+                self._in_flight.discard(device.key)
+                self._polls += 1
+                self._errors += outcome == "error"
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            in_flight = len(self._in_flight)
+            polls, errors = self._polls, self._errors
+        return {
+            "running": self._thread is not None,
+            "groups": sorted(self.schedule),
+            "devices": len(self._next_due),
+            "in_flight": in_flight,
+            "polls": polls,
+            "errors": errors,
+            "concurrency": self.concurrency,
+            **self.store.stats(),
+        }
+
+
+_store: Optional[SnapshotStore] = None
+_poller: Optional[PrefetchPoller] = None
+_prefetch_lock = threading.Lock()
+
+
+def get_snapshot_store() -> SnapshotStore:
+    """Returns the process-wide snapshot store."""
+    global _store
+    with _prefetch_lock:
+        if _store is None:
+            _store = SnapshotStore()
+        return _store
+
+
+def configure_poller(poller: Optional[PrefetchPoller]) -> None:
+    """Replaces the process-wide poller, stopping the previous one."""
+    global _poller
+    with _prefetch_lock:
+        previous, _poller = _poller, poller
+    if previous is not None and previous is not poller:
+        previous.stop(wait=False)
+
+
+def get_poller() -> Optional[PrefetchPoller]:
+    """Returns the process-wide poller, None if pre-fetching is not running."""
+    return _poller
+
+
+def start_prefetch(config: SystemConfig) -> Optional[PrefetchPoller]:
+    """Starts the process-wide poller if pre-fetching is enabled and scheduled.
+
+    Returns:
+        Optional[PrefetchPoller]: The running poller, None if pre-fetching is off.
+    """
+    if not config.prefetch_enabled or not config.prefetch_schedule:
+        return None
+    poller = PrefetchPoller.from_config(config, get_snapshot_store())
+    configure_poller(poller)
+    poller.start()
+    return poller
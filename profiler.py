@@ -0,0 +1,297 @@
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from types import CodeType, FrameType
+from typing import Any, Dict, Generator, Iterable, List, Optional, TypeVar
+
+from config import SystemConfig
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+PROFILE_KINDS = ("wall", "cpu")
+# Innermost frames kept per stack; deeper stacks lose their outermost frames
+MAX_STACK_DEPTH = 128
+
+
+def _cpu_clock(ident: int) -> Optional[int]:
+    """Returns the CPU-time clock of a thread, or None where the platform has none."""
+    try:
+        return time.pthread_getcpuclockid(ident)
+    except (AttributeError, OSError):
+        return None
+
+
+class Profile:
+    """Wall-clock and CPU samples of a set of threads, aggregated as folded stacks.
+
+    Each sample adds the time elapsed since the thread's previous sample to its current stack:
+    wall-clock time for the wall profile, the thread's CPU time for the CPU profile. Weights are
+    in microseconds, so both profiles render in the folded format read by flamegraph.pl,
+    speedscope and inferno.
+    """
+
+    def __init__(self, profile_id: str, max_seconds: float, all_threads: bool = False):
+        self.profile_id = profile_id
+        self.max_seconds = max_seconds
+        self.all_threads = all_threads
+        self.started = time.monotonic()
+        self.started_at = time.time()
+        self.finished: Optional[float] = None
+        self.truncated = False
+        self.samples = 0
+        self.sampling_seconds = 0.0
+        self.stacks: Dict[str, Dict[str, int]] = {kind: {} for kind in PROFILE_KINDS}
+        # Thread ident -> (label, CPU clock, wall and CPU time at the previous sample)
+        self._threads: Dict[int, List[Any]] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self.finished is None
+
+    def attach(self, ident: int, label: str) -> None:
+        clock = _cpu_clock(ident)
+        with self._lock:
+            self._threads[ident] = [label, clock, time.monotonic(), self._cpu_time(clock)]
+
+    def detach(self, ident: int) -> None:
+        with self._lock:
+            self._threads.pop(ident, None)
+
+    @staticmethod
+    def _cpu_time(clock: Optional[int]) -> Optional[float]:
+        if clock is None:
+            return None
+        try:
+            return time.clock_gettime(clock)
+        except OSError:
+            # The thread has exited
+            return None
+
+    def sample(self, frames: Dict[int, FrameType], labels: "FrameLabels", names: Dict[int, str]) -> None:
+        """Adds one sample of every attached thread (or every thread for process-wide profiles)."""
+        now = time.monotonic()
+        with self._lock:
+            if self.all_threads:
+                for ident in frames:
+                    if ident not in self._threads:
+                        clock = _cpu_clock(ident)
+                        self._threads[ident] = [names.get(ident, str(ident)), clock, now, self._cpu_time(clock)]
+            for ident, entry in list(self._threads.items()):
+                frame = frames.get(ident)
+                if frame is None:
+                    if self.all_threads:
+                        del self._threads[ident]
+                    continue
+                label, clock, last_wall, last_cpu = entry
+                stack = labels.stack(label, frame)
+                wall = int((now - last_wall) * 1e6)
+                if wall > 0:
+                    self.stacks["wall"][stack] = self.stacks["wall"].get(stack, 0) + wall
+                cpu_time = self._cpu_time(clock)
+                if cpu_time is not None and last_cpu is not None:
+                    cpu = int((cpu_time - last_cpu) * 1e6)
+                    if cpu > 0:
+                        self.stacks["cpu"][stack] = self.stacks["cpu"].get(stack, 0) + cpu
+                entry[2], entry[3] = now, cpu_time
+            self.samples += 1
+
+    def folded(self, kind: str) -> str:
+        """Returns the profile as folded stacks, one "frame;frame;frame weight" line per stack.
+
+        Raises:
+            ValueError: If kind is not "wall" or "cpu".
+        """
+        if kind not in PROFILE_KINDS:
+            raise ValueError(f"Profile kind must be one of {PROFILE_KINDS}, got {kind}")
+        with self._lock:
+            stacks = sorted(self.stacks[kind].items())
+        return "".join(f"{stack} {weight}\n" for stack, weight in stacks)
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            totals = {kind: round(sum(self.stacks[kind].values()) / 1e6, 3) for kind in PROFILE_KINDS}
+            return {
+                "id": self.profile_id,
+                "started_at": self.started_at,
+                "duration": round((self.finished or time.monotonic()) - self.started, 3),
+                "running": self.running,
+                "truncated": self.truncated,
+                "samples": self.samples,
+                "wall_seconds": totals["wall"],
+                "cpu_seconds": totals["cpu"],
+                "sampling_seconds": round(self.sampling_seconds, 3),
+            }
+
+
+class FrameLabels:
+    """Caches the flamegraph label of each code object, so a sample costs a frame walk only."""
+
+    def __init__(self):
+        self._labels: Dict[CodeType, str] = {}
+
+    def label(self, code: CodeType) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            module = os.path.splitext(os.path.basename(code.co_filename))[0]
+            # ';' separates frames and the last space separates the weight in the folded format
+            label = f"{code.co_name} ({module}:{code.co_firstlineno})".replace(";", ":")
+            self._labels[code] = label
+        return label
+
+    def stack(self, thread_label: str, frame: FrameType) -> str:
+        names = []
+        while frame is not None and len(names) < MAX_STACK_DEPTH:
+            names.append(self.label(frame.f_code))
+            frame = frame.f_back
+        names.append(thread_label.replace(";", ":").replace(" ", "_"))
+        return ";".join(reversed(names))
+
+
+class Profiler:
+    """Samples the stacks of profiled pipeline runs from a background thread.
+
+    The sampler thread runs only while a profile is active, so a process that never profiles
+    pays nothing. Threads join a profile while they run part of a request (the scheduler worker
+    running the pipeline, the server thread framing the SSE stream); threads the pipeline hands
+    work to, such as speculative commands, are not followed.
+    """
+
+    def __init__(self, interval: float, max_seconds: float, keep: int):
+        """Initializes the profiler.
+
+        Args:
+            interval (float): Seconds between samples.
+            max_seconds (float): Sampling of a profile stops after this many seconds.
+            keep (int): Finished profiles kept for retrieval.
+
+        Raises:
+            ValueError: If interval, max_seconds or keep is not positive.
+        """
+        if interval <= 0 or max_seconds <= 0 or keep < 1:
+            raise ValueError(f"Profiler interval, max_seconds and keep must be positive, got {interval}, {max_seconds}, {keep}")
+        self.interval = interval
+        self.max_seconds = max_seconds
+        self.keep = keep
+        self._labels = FrameLabels()
+        self._active: List[Profile] = []
+        self._profiles: "OrderedDict[str, Profile]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._sampler: Optional[threading.Thread] = None
+
+    @classmethod
+    def from_config(cls, config: SystemConfig) -> "Profiler":
+        return cls(config.profile_interval, config.profile_max_seconds, config.profile_keep)
+
+    def start(self, profile_id: Optional[str] = None, all_threads: bool = False) -> Profile:
+        """Starts a profile; threads join it with `attach` unless all_threads is set."""
+        profile = Profile(profile_id or uuid.uuid4().hex, self.max_seconds, all_threads)
+        with self._lock:
+            self._profiles[profile.profile_id] = profile
+            while len(self._profiles) > self.keep:
+                self._profiles.popitem(last=False)
+            self._active.append(profile)
+            if self._sampler is None:
+                self._sampler = threading.Thread(target=self._run, name="profiler", daemon=True)
+                self._sampler.start()
+        logger.info(f"Profile {profile.profile_id} started")
+        return profile
+
+    def finish(self, profile: Profile) -> None:
+        """Stops sampling a profile; repeated calls are ignored."""
+        with self._lock:
+            if profile in self._active:
+                self._active.remove(profile)
+        if profile.finished is None:
+            profile.finished = time.monotonic()
+            summary = profile.summary()
+            logger.info(f"Profile {profile.profile_id} finished: {summary['samples']} samples, "
+                        f"{summary['wall_seconds']}s wall, {summary['cpu_seconds']}s CPU")
+
+    @contextmanager
+    def attach(self, profile: Profile, label: str) -> Generator[None, None, None]:
+        """Samples the current thread into the profile while the block runs."""
+        ident = threading.get_ident()
+        profile.attach(ident, label)
+        try:
+            yield
+        finally:
+            profile.detach(ident)
+
+    def profiled(self, profile: Profile, label: str, iterable: Iterable[T]) -> Generator[T, None, None]:
+        """Iterates an iterable, sampling the thread that consumes it.
+
+        The thread stays attached between items, so the profile also covers what the consumer
+        does with each item (e.g. the server writing SSE frames to the socket).
+        """
+        with self.attach(profile, label):
+            yield from iterable
+
+    def capture(self, seconds: float) -> Profile:
+        """Samples every thread of the process for a number of seconds (at most max_seconds)."""
+        profile = self.start(all_threads=True)
+        try:
+            time.sleep(min(seconds, self.max_seconds))
+        finally:
+            self.finish(profile)
+        return profile
+
+    def get(self, profile_id: str) -> Optional[Profile]:
+        with self._lock:
+            return self._profiles.get(profile_id)
+
+    def profiles(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            profiles = list(self._profiles.values())
+        return [profile.summary() for profile in profiles]
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        while True:
+            with self._lock:
+                active = list(self._active)
+                if not active:
+                    self._sampler = None
+                    return
+            started = time.monotonic()
+            frames = sys._current_frames()
+            frames.pop(own, None)
+            names = {thread.ident: thread.name for thread in threading.enumerate()} \
+                if any(profile.all_threads for profile in active) else {}
+            for profile in active:
+                profile.sample(frames, self._labels, names)
+                if started - profile.started >= profile.max_seconds:
+                    profile.truncated = True
+                    self.finish(profile)
+            del frames
+            elapsed = time.monotonic() - started
+            for profile in active:
+                profile.sampling_seconds += elapsed
+            time.sleep(max(self.interval - elapsed, 0.0))
+
+
+_profiler: Optional[Profiler] = None
+_profiler_lock = threading.Lock()
+
+
+def configure_profiler(profiler: Profiler) -> None:
+    """Replaces the process-wide profiler."""
+    global _profiler
+    with _profiler_lock:
+        _profiler = profiler
+
+
+def get_profiler() -> Profiler:
+    """Returns the process-wide profiler, creating it from SystemConfig defaults if needed."""
+    global _profiler
+    with _profiler_lock:
+        if _profiler is None:
+            _profiler = Profiler.from_config(SystemConfig())
+        return _profiler
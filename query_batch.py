@@ -0,0 +1,359 @@
+import functools
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from contextlib import ExitStack
+from dataclasses import dataclass, replace
+from typing import Any, Callable, Dict, Generator, List, Optional, Tuple
+
+from change_queue import batched_changes
+from config import SystemConfig
+from DoNetAgent import NetAgent
+from device_limits import get_device_limiter
+from device_sessions import using_device_sessions
+from inventory import device_key
+from metrics import QUERY_BATCH_QUERIES, QUERY_BATCH_SHOWS
+from poller import SHOW_ERROR_PREFIX, normalize_command
+from scheduler import JobGroup, JobScheduler, Priority
+import tracing
+
+logger = logging.getLogger(__name__)
+
+def _open(host: str, port: int, params: Dict[str, Any]) -> NetAgent:
+    return NetAgent(host=host, username=params["username"], password=params["password"],
+                    device_type=params["device_type"], port=port)
+
+
+class _DeviceConnection:
+    """An open session on one device, used by one command at a time."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.agent: Optional[NetAgent] = None
+        self.ticket = None
+        self.stack: Optional[ExitStack] = None
+        # Commands using or waiting for the session, and the timer closing it once idle
+        self.in_flight = 0
+        self.idle_timer: Optional[threading.Timer] = None
+
+    def close(self) -> None:
+        if self.stack is not None:
+            stack, self.stack, self.agent, self.ticket = self.stack, None, None, None
+            try:
+                stack.close()
+            except Exception as e:
+                logger.warning(f"Closing batch device session failed: {str(e)}")
+
+
+class DeviceSessions:
+    """Device sessions and show outputs shared by the queries of a batch.
+
+    A device gets one session, opened on first use and kept (holding one of its device limiter
+    slots) while commands use it; once no command has used it for `idle_timeout` seconds it
+    closes, so a batch does not keep device slots from interactive queries between its
+    commands. Show commands are run once per device: queries asking for the same output wait
+    for the first run and share it.
+
+    The queries of a batch run concurrently, so their order in the batch does not order their
+    commands. Once a query's set operation on a device has been applied, `invalidate` drops
+    the device's shared outputs: a show that starts afterwards runs again and sees the change,
+    while one already running alongside the set may not.
+    """
+
+    def __init__(self, idle_timeout: float,
+                 opener: Optional[Callable[[str, int, Dict[str, Any]], NetAgent]] = None):
+        """Initializes the sessions.
+
+        Args:
+            idle_timeout (float): Seconds a device session stays open without commands; 0 closes
+                it as soon as no command is in flight.
+            opener (Optional[Callable]): Opens a NetAgent for (host, port, params).
+        """
+        self.idle_timeout = idle_timeout
+        self.opener = opener or _open
+        self._connections: Dict[str, _DeviceConnection] = {}
+        self._outputs: Dict[Tuple[str, str], "Future[str]"] = {}
+        # device -> number of set operations applied to it during the batch
+        self._changes: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._closed = False
+        self._counts = {"connects": 0, "reused": 0, "cached": 0}
+
+    def _count(self, source: str) -> None:
+        QUERY_BATCH_SHOWS.labels(source=source).inc()
+        with self._lock:
+            self._counts[source] += 1
+
+    def show(self, host: str, port: int, params: Dict[str, Any], command: str) -> str:
+        """Returns the output of a show command, running it only if no query of the batch has."""
+        key = device_key(host, port)
+        cache_key = (key, normalize_command(command))
+        with self._lock:
+            future = self._outputs.get(cache_key)
+            owner = future is None
+            if owner:
+                future = self._outputs[cache_key] = Future()
+                changes = self._changes.get(key, 0)
+        if not owner:
+            self._count("cached")
+            return future.result()
+        try:
+            output = self._run(key, host, port, params, command)
+        except BaseException as e:
+            self._forget(cache_key, future)
+            future.set_exception(e)
+            raise
+        if output.startswith(SHOW_ERROR_PREFIX):
+            # Waiting queries get the error; later ones try again
+            self._forget(cache_key, future)
+        with self._lock:
+            changed = self._changes.get(key, 0) != changes
+        if changed:
+            # The device was changed while the command ran: the output may predate the change
+            self._forget(cache_key, future)
+        future.set_result(output)
+        return output
+
+    def _forget(self, cache_key: Tuple[str, str], future: "Future[str]") -> None:
+        with self._lock:
+            if self._outputs.get(cache_key) is future:
+                del self._outputs[cache_key]
+
+    def invalidate(self, host: str, port: int = 22) -> None:
+        """Drops the shared show outputs of a device after a set operation was applied to it."""
+        key = device_key(host, port)
+        with self._lock:
+            self._changes[key] = self._changes.get(key, 0) + 1
+            for cache_key in [cache_key for cache_key in self._outputs if cache_key[0] == key]:
+                del self._outputs[cache_key]
+
+    def _run(self, key: str, host: str, port: int, params: Dict[str, Any], command: str) -> str:
+        limiter = get_device_limiter()
+        with self._lock:
+            connection = self._connections.setdefault(key, _DeviceConnection())
+            connection.in_flight += 1
+            if connection.idle_timer is not None:
+                connection.idle_timer.cancel()
+                connection.idle_timer = None
+        try:
+            with connection.lock:
+                if connection.agent is None:
+                    stack = ExitStack()
+                    try:
+                        connection.ticket = stack.enter_context(limiter.session(key, params["device_type"]))
+                        connection.agent = self.opener(host, port, params)
+                        stack.callback(connection.agent.disconnect)
+                    except BaseException:
+                        connection.ticket = None
+                        stack.close()
+                        raise
+                    connection.stack = stack
+                    self._count("connects")
+                else:
+                    self._count("reused")
+                with limiter.command(connection.ticket):
+                    output = connection.agent.execute_show(command)
+                if output.startswith(SHOW_ERROR_PREFIX):
+                    # The session may be broken; the next command reconnects
+                    connection.close()
+                return output
+        finally:
+            self._idle(connection)
+
+    def _idle(self, connection: _DeviceConnection) -> None:
+        """Counts a command as done, closing the session after idle_timeout without commands."""
+        with self._lock:
+            connection.in_flight -= 1
+            if connection.in_flight or self._closed:
+                return
+            if self.idle_timeout > 0:
+                timer = connection.idle_timer = threading.Timer(
+                    self.idle_timeout, self._close_idle, args=(connection,))
+                timer.daemon = True
+                timer.start()
+                return
+        self._close_idle(connection)
+
+    def _close_idle(self, connection: _DeviceConnection) -> None:
+        with self._lock:
+            if connection.in_flight:
+                return
+            connection.idle_timer = None
+        with connection.lock:
+            # A command that arrived meanwhile reopens the session
+            connection.close()
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed = True
+            connections = list(self._connections.values())
+            self._connections.clear()
+            for connection in connections:
+                if connection.idle_timer is not None:
+                    connection.idle_timer.cancel()
+                    connection.idle_timer = None
+        for connection in connections:
+            with connection.lock:
+                connection.close()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counts)
+
+
+@dataclass(slots=True)
+class QueryOutcome:
+    """Result of one query of a batch."""
+    index: int
+    id: str
+    query: str
+    trace_id: str
+    ok: bool
+    answer: Optional[str]
+    error: Optional[str]
+    step: str
+    queued: float
+    duration: float
+
+    def as_event(self) -> Dict[str, Any]:
+        return {"event": "query", "index": self.index, "id": self.id, "query": self.query,
+                "trace_id": self.trace_id, "ok": self.ok, "answer": self.answer, "error": self.error,
+                "step": self.step, "queued": round(self.queued, 3), "duration": round(self.duration, 3)}
+
+
+class QueryBatch:
+    """Runs many queries as batch-priority scheduler jobs, reporting each as it completes.
+
+    The queries share device sessions and show outputs (`DeviceSessions`), their set operations
+    go through the change queue, and each scheduler worker reuses one pipeline system across the
+    batch's queries. Nobody watches a batch being typed
+    out, so the streaming delays are switched off.
+    """
+
+    def __init__(self, queries: List[Dict[str, str]], config: SystemConfig, parallelism: int,
+                 system_factory: Callable[[SystemConfig], Any],
+                 opener: Optional[Callable[[str, int, Dict[str, Any]], NetAgent]] = None):
+        """Initializes the batch.
+
+        Args:
+            queries (List[Dict[str, str]]): Queries as {"query": ..., "id": ...}.
+            config (SystemConfig): Configuration of the pipelines.
+            parallelism (int): Queries queued or running in the scheduler at once.
+            system_factory (Callable[[SystemConfig], Any]): Builds a pipeline system (CoopetitionSystem).
+            opener (Optional[Callable]): Opens device sessions; see DeviceSessions.
+
+        Raises:
+            ValueError: If there are no queries or parallelism is not positive.
+        """
+        if not queries:
+            raise ValueError("A batch needs at least one query")
+        if parallelism < 1:
+            raise ValueError(f"Batch parallelism must be positive, got {parallelism}")
+        self.queries = queries
+        self.config = replace(config, stream_char_delay=0.0, stream_output_char_delay=0.0)
+        self.parallelism = min(parallelism, len(queries))
+        self.system_factory = system_factory
+        self.sessions = DeviceSessions(config.query_batch_session_idle, opener)
+        self._systems = threading.local()
+
+    @classmethod
+    def from_request(cls, config: SystemConfig, queries: Any, system_factory: Callable[[SystemConfig], Any],
+                     parallelism: Optional[int] = None) -> "QueryBatch":
+        """Builds a batch from a request's query list.
+
+        Args:
+            config (SystemConfig): Supplies the default parallelism and the limits.
+            queries (Any): List of query strings or {"query": ..., "id": ...} objects.
+            system_factory (Callable[[SystemConfig], Any]): Builds a pipeline system.
+            parallelism (Optional[int]): Queries processed at once, at most `query_batch_max_parallelism`.
+
+        Raises:
+            ValueError: If the list is empty, too long or malformed, or parallelism is out of range.
+        """
+        if not isinstance(queries, list) or not queries:
+            raise ValueError("'queries' must be a non-empty list")
+        if len(queries) > config.query_batch_max_queries:
+            raise ValueError(f"A batch holds at most {config.query_batch_max_queries} queries, got {len(queries)}")
+        items = []
+        for index, entry in enumerate(queries):
+            if isinstance(entry, dict):
+                query, item_id = entry.get("query"), entry.get("id", index)
+            else:
+                query, item_id = entry, index
+            if not isinstance(query, str) or not query.strip():
+                raise ValueError(f"Query {index} has no 'query' text")
+            items.append({"query": query, "id": str(item_id)})
+        parallelism = config.query_batch_parallelism if parallelism is None else int(parallelism)
+        if not (1 <= parallelism <= config.query_batch_max_parallelism):
+            raise ValueError(f"'parallelism' must be between 1 and {config.query_batch_max_parallelism}")
+        return cls(items, config, parallelism, system_factory)
+
+    def _system(self) -> Any:
+        system = getattr(self._systems, "system", None)
+        if system is None:
+            system = self._systems.system = self.system_factory(self.config)
+        return system
+
+    def _process(self, index: int, submitted: float) -> QueryOutcome:
+        item = self.queries[index]
+        started = time.perf_counter()
+        trace_id = uuid.uuid4().hex
+        try:
+            system = self._system()
+            with using_device_sessions(self.sessions), batched_changes():
+                for _ in system.process_query_stream(item["query"], trace_id=trace_id):
+                    pass
+            state = system.state
+            error = state.get("error")
+            answer, step = state.get("best_analysis"), state.current_step.name.lower()
+        except Exception as e:
+            error, answer, step = str(e), None, "init"
+        ok = error is None and answer is not None
+        QUERY_BATCH_QUERIES.labels(outcome="ok" if ok else "error").inc()
+        return QueryOutcome(index, item["id"], item["query"], trace_id, ok, answer,
+                            error or (None if ok else "Нет ответа"), step,
+                            started - submitted, time.perf_counter() - started)
+
+    def run(self, scheduler: JobScheduler) -> Generator[Dict[str, Any], None, None]:
+        """Runs the batch, yielding an event per query in completion order and a final summary.
+
+        Each query is a batch-priority scheduler job, so interactive queries are served first and
+        the batch never runs more pipelines than the scheduler has workers. At most `parallelism`
+        queries, and no more than the scheduler's workers, are queued or running at once.
+
+        Events are dicts with an "event" key: "start", "query" and "done". Closing the generator
+        (the client went away) drops the queries not yet started.
+
+        Args:
+            scheduler (JobScheduler): Scheduler running the queries; this generator must not be
+                consumed on one of its workers.
+
+        Raises:
+            QueueFullError: On the first `next()`, if the scheduler queue has no room for the batch.
+        """
+        started = time.perf_counter()
+        done = failed = 0
+        group = JobGroup(scheduler, min(self.parallelism, scheduler.workers), Priority.BATCH)
+        try:
+            with tracing.start_trace("query_batch", queries=len(self.queries), parallelism=self.parallelism):
+                submitted = time.perf_counter()
+                # Each query records its own trace; the context carries the batch's for anything else
+                for index in range(len(self.queries)):
+                    group.submit(functools.partial(self._process, index, submitted))
+                group.start()
+                yield {"event": "start", "queries": len(self.queries), "parallelism": group.limit}
+                for outcome in group.results():
+                    done += 1
+                    failed += not outcome.ok
+                    yield outcome.as_event()
+        finally:
+            group.cancel()
+            for _ in group.results():
+                pass  # Running queries still use the device sessions
+            self.sessions.close()
+        summary = {"queries": len(self.queries), "ok": done - failed, "failed": failed,
+                   "duration": round(time.perf_counter() - started, 3), **self.sessions.stats()}
+        logger.info(f"Query batch done: {summary}")
+        yield {"event": "done", **summary}
@@ -0,0 +1,263 @@
+import json
+import logging
+import mmap
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, Generator, List, Optional
+
+from config import SystemConfig
+from metrics import RESULT_STORE_BYTES
+
+logger = logging.getLogger(__name__)
+
+HANDLE_PREFIX = "res_"
+
+
+@dataclass(slots=True)
+class StoredResult:
+    """A tool output kept out of band.
+
+    Attributes:
+        handle (str): Reference handed to the LLM instead of the output.
+        kind (str): Producing tool kind, e.g. "show" or "set".
+        size (int): Size of the output in bytes (UTF-8).
+        lines (int): Number of lines.
+        created_at (float): Creation time (time.time()).
+        meta (Dict[str, Any]): Tool arguments worth showing, e.g. host and command.
+        data (Optional[bytes]): The output while held in memory.
+        path (Optional[Path]): Spill file once the output lives on disk.
+    """
+    handle: str
+    kind: str
+    size: int
+    lines: int
+    created_at: float
+    meta: Dict[str, Any] = field(default_factory=dict)
+    data: Optional[bytes] = None
+    path: Optional[Path] = None
+
+    def describe(self, preview: str) -> str:
+        """JSON envelope returned to the LLM in place of the output."""
+        return json.dumps({"handle": self.handle, "kind": self.kind, "bytes": self.size, "lines": self.lines,
+                           **self.meta, "preview": preview}, ensure_ascii=False)
+
+
+class ResultStore:
+    """Tool outputs referenced by handle instead of being passed through chat messages.
+
+    Outputs are held in memory up to `memory_limit` bytes in total; outputs larger than
+    `spill_threshold`, and the oldest in-memory outputs once the limit is reached, are written
+    to `spill_dir` and read back through mmap. Results expire after `ttl` seconds.
+    """
+
+    def __init__(self, memory_limit: int, spill_threshold: int, spill_dir: Optional[str] = None,
+                 ttl: float = 600.0, preview_chars: int = 300):
+        """Initializes the store.
+
+        Args:
+            memory_limit (int): Bytes of outputs held in memory.
+            spill_threshold (int): Outputs of at least this many bytes go straight to disk.
+            spill_dir (Optional[str]): Directory of spill files; None uses a temporary directory.
+            ttl (float): Seconds after which a result is dropped.
+            preview_chars (int): Characters of the output included in the envelope.
+
+        Raises:
+            ValueError: If a limit is not positive.
+        """
+        if memory_limit < 1 or spill_threshold < 1 or ttl <= 0:
+            raise ValueError("Result store limits must be positive")
+        self.memory_limit = memory_limit
+        self.spill_threshold = spill_threshold
+        self.spill_dir = Path(spill_dir or os.path.join(tempfile.gettempdir(), f"netagents-results-{os.getpid()}"))
+        self.ttl = ttl
+        self.preview_chars = preview_chars
+        self._results: "OrderedDict[str, StoredResult]" = OrderedDict()
+        self._memory_bytes = 0
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        self._collectors = threading.local()
+
+    @classmethod
+    def from_config(cls, config: SystemConfig) -> "ResultStore":
+        return cls(config.result_store_memory_limit, config.result_store_spill_threshold,
+                   config.result_store_spill_dir, config.result_store_ttl, config.result_store_preview_chars)
+
+    def _spill(self, result: StoredResult) -> None:
+        self.spill_dir.mkdir(parents=True, exist_ok=True)
+        path = self.spill_dir / result.handle
+        path.write_bytes(result.data)
+        result.path = path
+        result.data = None
+        self._memory_bytes -= result.size
+        self._disk_bytes += result.size
+
+    def _remove(self, handle: str) -> None:
+        result = self._results.pop(handle)
+        if result.path is not None:
+            self._disk_bytes -= result.size
+            try:
+                result.path.unlink()
+            except OSError:
+                pass
+        else:
+            self._memory_bytes -= result.size
+
+    def _expire(self, now: float) -> None:
+        while self._results:
+            handle, result = next(iter(self._results.items()))
+            if now - result.created_at <= self.ttl:
+                break
+            self._remove(handle)
+
+    def put(self, output: str, kind: str, **meta: Any) -> StoredResult:
+        """Stores a tool output.
+
+        Args:
+            output (str): The output.
+            kind (str): Producing tool kind.
+            **meta: Tool arguments shown in the envelope.
+
+        Returns:
+            StoredResult: The stored result; `describe` builds the envelope for the LLM.
+        """
+        data = output.encode("utf-8")
+        result = StoredResult(f"{HANDLE_PREFIX}{uuid.uuid4().hex[:16]}", kind, len(data), output.count("\n") + 1,
+                              time.time(), meta, data)
+        with self._lock:
+            self._expire(result.created_at)
+            self._results[result.handle] = result
+            self._memory_bytes += result.size
+            if result.size >= self.spill_threshold:
+                self._spill(result)
+            # Oldest in-memory results go to disk first
+            for other in list(self._results.values()):
+                if self._memory_bytes <= self.memory_limit:
+                    break
+                if other.data:
+                    self._spill(other)
+        RESULT_STORE_BYTES.labels(location="disk" if result.path else "memory").observe(result.size)
+        collected = getattr(self._collectors, "handles", None)
+        if collected is not None:
+            collected.append(result.handle)
+        return result
+
+    def envelope(self, result: StoredResult, output: str) -> str:
+        """Returns the envelope of a result, previewing the start of its output."""
+        preview = output[:self.preview_chars]
+        if len(output) > self.preview_chars:
+            preview += f"… [{result.size} bytes, read by handle]"
+        return result.describe(preview)
+
+    def info(self, handle: str) -> Optional[StoredResult]:
+        with self._lock:
+            return self._results.get(handle)
+
+    def read(self, handle: str, start: int = 0, length: Optional[int] = None) -> str:
+        """Returns the output of a result, or a byte range of it.
+
+        Args:
+            handle (str): Result handle.
+            start (int): First byte.
+            length (Optional[int]): Number of bytes; None reads to the end.
+
+        Raises:
+            KeyError: If the handle is unknown or expired.
+        """
+        with self._lock:
+            self._expire(time.time())
+            result = self._results.get(handle)
+            if result is None:
+                raise KeyError(f"Unknown or expired result handle: {handle}")
+            data, path = result.data, result.path
+        end = None if length is None else start + length
+        if data is not None:
+            return data[start:end].decode("utf-8", errors="replace")
+        try:
+            with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                return mapped[start:end].decode("utf-8", errors="replace")
+        except FileNotFoundError:
+            raise KeyError(f"Unknown or expired result handle: {handle}")
+
+    def iter_bytes(self, handle: str, chunk_bytes: int = 1024 * 1024) -> Generator[bytes, None, None]:
+        """Yields the output of a result in chunks, without materializing it as one string.
+
+        Raises:
+            KeyError: If the handle is unknown or expired.
+        """
+        with self._lock:
+            self._expire(time.time())
+            result = self._results.get(handle)
+            if result is None:
+                raise KeyError(f"Unknown or expired result handle: {handle}")
+            data, path = result.data, result.path
+        if data is not None:
+            for start in range(0, len(data), chunk_bytes):
+                yield data[start:start + chunk_bytes]
+            return
+        try:
+            f = open(path, "rb")
+        except FileNotFoundError:
+            raise KeyError(f"Unknown or expired result handle: {handle}")
+        with f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            for start in range(0, len(mapped), chunk_bytes):
+                yield mapped[start:start + chunk_bytes]
+
+    def delete(self, handle: str) -> None:
+        with self._lock:
+            if handle in self._results:
+                self._remove(handle)
+
+    @contextmanager
+    def collect(self) -> Generator[List[str], None, None]:
+        """Collects the handles of results stored by the current thread within the block.
+
+        Tools run on the thread of the chat that called them, so the orchestrator learns the
+        handles its chat produced without parsing messages.
+        """
+        previous = getattr(self._collectors, "handles", None)
+        handles: List[str] = []
+        self._collectors.handles = handles
+        try:
+            yield handles
+        finally:
+            self._collectors.handles = previous
+            if previous is not None:
+                previous.extend(handles)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._expire(time.time())
+            return {
+                "results": len(self._results),
+                "memory_bytes": self._memory_bytes,
+                "disk_bytes": self._disk_bytes,
+                "memory_limit": self.memory_limit,
+                "spill_dir": str(self.spill_dir),
+            }
+
+
+_store: Optional[ResultStore] = None
+_store_lock = threading.Lock()
+
+
+def configure_result_store(store: ResultStore) -> None:
+    """Replaces the process-wide result store."""
+    global _store
+    with _store_lock:
+        _store = store
+
+
+def get_result_store() -> ResultStore:
+    """Returns the process-wide result store, creating it from SystemConfig defaults if needed."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ResultStore.from_config(SystemConfig())
+        return _store
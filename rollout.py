@@ -0,0 +1,253 @@
+import contextvars
+import logging
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Generator, List, Optional
+
+from config import SystemConfig
+from DoNetAgent import ERROR_MARKERS, NetAgent
+from device_limits import get_device_limiter
+from inventory import Device, Inventory, get_inventory
+from metrics import ROLLOUT_DEVICES
+from poller import get_snapshot_store
+import tracing
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+# Rollouts running in the process, against Rollout.max_concurrent
+_running = 0
+_running_lock = threading.Lock()
+
+
+class RolloutBusyError(Exception):
+    """Raised when a rollout is started while the maximum number of rollouts is running."""
+
+
+def _apply(device: Device, params: Dict[str, Any], commands: List[str]) -> str:
+    """Applies a change set to one device with NetAgent.execute_set."""
+    limiter = get_device_limiter()
+    with limiter.session(device.key, params["device_type"]) as ticket:
+        agent = NetAgent(host=device.host, username=params["username"], password=params["password"],
+                         device_type=params["device_type"], port=device.port)
+        try:
+            with limiter.command(ticket):
+                return agent.execute_set(commands)
+        finally:
+            agent.disconnect()
+
+
+@dataclass(slots=True)
+class DeviceOutcome:
+    """Result of a change set on one device."""
+    device: str
+    wave: int
+    ok: bool
+    output: str
+    duration: float
+
+    def as_event(self) -> Dict[str, Any]:
+        return {"event": "device", "device": self.device, "wave": self.wave, "ok": self.ok,
+                "duration": round(self.duration, 3), "output": self.output}
+
+
+class Rollout:
+    """Applies one change set to many devices in waves.
+
+    The first `canary` devices form wave 0 and must all succeed; the remaining devices follow
+    in waves of `wave_size`, each run with `parallelism` concurrent sessions. The rollout halts,
+    leaving later devices untouched, as soon as the error rate over the devices done so far
+    exceeds `max_error_rate`. Since parallelism is fixed, the total time is about the canary's
+    duration times the number of parallel rounds; the estimate is reported after the canary.
+
+    A rollout runs on the thread consuming `run`, not on a scheduler worker, so it never holds
+    workers from interactive queries; at most `max_concurrent` rollouts run at once, which caps
+    the device sessions they open in total.
+    """
+
+    def __init__(
+        self,
+        devices: List[Device],
+        commands: List[str],
+        inventory: Inventory,
+        canary: int,
+        parallelism: int,
+        wave_size: int,
+        max_error_rate: float,
+        applier: Optional[Callable[[Device, Dict[str, Any], List[str]], str]] = None,
+        max_concurrent: Optional[int] = None,
+    ):
+        """Initializes the rollout.
+
+        Args:
+            devices (List[Device]): Target devices, in rollout order.
+            commands (List[str]): Configuration commands.
+            inventory (Inventory): Resolves the connection parameters of each device.
+            canary (int): Devices changed first, one at a time.
+            parallelism (int): Concurrent device sessions within a wave.
+            wave_size (int): Devices per wave after the canary.
+            max_error_rate (float): Failed fraction of the devices done so far that halts the rollout.
+            applier (Optional[Callable]): Applies (device, params, commands) and returns the output.
+            max_concurrent (Optional[int]): Rollouts allowed to run at once, this one included;
+                None does not limit them.
+
+        Raises:
+            ValueError: If there are no devices or commands, or a limit is out of range.
+        """
+        if not devices or not commands:
+            raise ValueError("A rollout needs at least one device and one command")
+        if canary < 0 or parallelism < 1 or wave_size < 1 or not (0.0 <= max_error_rate < 1.0):
+            raise ValueError("Invalid rollout limits")
+        self.devices = devices
+        self.commands = commands
+        self.inventory = inventory
+        self.canary = min(canary, len(devices))
+        self.parallelism = parallelism
+        self.wave_size = wave_size
+        self.max_error_rate = max_error_rate
+        self.applier = applier or _apply
+        self.max_concurrent = max_concurrent
+
+    @classmethod
+    def from_request(cls, config: SystemConfig, commands: List[str], hosts: Optional[List[str]] = None,
+                     group: Optional[str] = None, **overrides: Any) -> "Rollout":
+        """Builds a rollout for a host list or an inventory group.
+
+        Args:
+            config (SystemConfig): Supplies the default canary, parallelism, wave size and error rate.
+            commands (List[str]): Configuration commands.
+            hosts (Optional[List[str]]): Hosts as `host` or `host:port`.
+            group (Optional[str]): Inventory group, used when no hosts are given.
+            **overrides: canary, parallelism, wave_size or max_error_rate.
+
+        Raises:
+            ValueError: If neither hosts nor a known group is given, or parallelism exceeds
+                `rollout_max_parallelism`.
+        """
+        inventory = get_inventory()
+        if hosts:
+            devices = []
+            for entry in hosts:
+                host, _, port = str(entry).partition(":")
+                port = int(port) if port else 22
+                devices.append(inventory.lookup(host, port) or Device(host, port))
+        elif group:
+            devices = inventory.devices_in(group)
+            if not devices:
+                raise ValueError(f"Inventory group '{group}' has no devices")
+        else:
+            raise ValueError("A rollout needs 'hosts' or 'group'")
+        settings = {
+            "canary": config.rollout_canary,
+            "parallelism": config.rollout_parallelism,
+            "wave_size": config.rollout_wave_size,
+            "max_error_rate": config.rollout_max_error_rate,
+        }
+        settings.update({key: value for key, value in overrides.items() if value is not None})
+        if not (1 <= int(settings["parallelism"]) <= config.rollout_max_parallelism):
+            raise ValueError(f"'parallelism' must be between 1 and {config.rollout_max_parallelism}")
+        return cls(devices, list(commands), inventory, **settings, max_concurrent=config.rollout_max_concurrent)
+
+    def waves(self) -> List[List[Device]]:
+        """Splits the devices into the canary wave and the following waves."""
+        waves = [[device] for device in self.devices[:self.canary]]
+        rest = self.devices[self.canary:]
+        waves += [rest[i:i + self.wave_size] for i in range(0, len(rest), self.wave_size)]
+        return waves
+
+    def _change(self, device: Device, wave: int) -> DeviceOutcome:
+        started = time.perf_counter()
+        try:
+            with span("rollout.device", host=device.key, wave=wave):
+                params = self.inventory.resolve(device.host, device.port)
+                output = self.applier(device, params, self.commands)
+        except Exception as e:
+            output = f"Error executing set commands: {str(e)}"
+        get_snapshot_store().invalidate(device.key)
+        ok = not any(marker in output for marker in ERROR_MARKERS)
+        ROLLOUT_DEVICES.labels(outcome="ok" if ok else "error").inc()
+        return DeviceOutcome(device.key, wave, ok, output, time.perf_counter() - started)
+
+    def _over_threshold(self, done: int, failed: int) -> bool:
+        """Tells whether the failures so far exceed the error budget.
+
+        The rate is judged once enough devices are done for it to be meaningful
+        (1 / max_error_rate of them); before that, only when the failures already exceed the
+        budget of the whole rollout.
+        """
+        if failed > self.max_error_rate * len(self.devices):
+            return True
+        min_sample = math.ceil(1 / self.max_error_rate) if self.max_error_rate else 1
+        return done >= min_sample and failed / done > self.max_error_rate
+
+    def run(self) -> Generator[Dict[str, Any], None, None]:
+        """Runs the rollout, yielding an event per device, per wave and at the end.
+
+        Events are dicts with an "event" key: "start", "device", "wave", "halted" and "done".
+
+        Raises:
+            RolloutBusyError: On the first `next()`, if `max_concurrent` rollouts are running.
+        """
+        global _running
+        with _running_lock:
+            if self.max_concurrent is not None and _running >= self.max_concurrent:
+                raise RolloutBusyError(f"{_running} rollout(s) already running, at most {self.max_concurrent}")
+            _running += 1
+        try:
+            yield from self._run()
+        finally:
+            with _running_lock:
+                _running -= 1
+
+    def _run(self) -> Generator[Dict[str, Any], None, None]:
+        waves = self.waves()
+        done = failed = 0
+        started = time.perf_counter()
+        yield {"event": "start", "devices": len(self.devices), "waves": len(waves), "canary": self.canary,
+               "parallelism": self.parallelism, "max_error_rate": self.max_error_rate}
+        halted = None
+        with tracing.start_trace("rollout", devices=len(self.devices), waves=len(waves)), \
+                ThreadPoolExecutor(max_workers=self.parallelism, thread_name_prefix="rollout") as pool:
+            for index, wave in enumerate(waves):
+                is_canary = index < self.canary
+                wave_started = time.perf_counter()
+                # Device spans join the rollout's trace
+                futures = [pool.submit(contextvars.copy_context().run, self._change, device, index) for device in wave]
+                for future in as_completed(futures):
+                    if future.cancelled():
+                        continue
+                    outcome = future.result()
+                    done += 1
+                    failed += not outcome.ok
+                    yield outcome.as_event()
+                    if halted is None and not outcome.ok and (is_canary or self._over_threshold(done, failed)):
+                        halted = (f"canary {outcome.device} failed" if is_canary
+                                  else f"error rate {failed}/{done} exceeds {self.max_error_rate:.0%}")
+                        # Devices not yet started are left untouched; running sessions finish
+                        for pending in futures:
+                            pending.cancel()
+                done_in_wave = sum(1 for future in futures if future.done() and not future.cancelled())
+                wave_event = {"event": "wave", "wave": index, "canary": is_canary, "devices": done_in_wave,
+                              "duration": round(time.perf_counter() - wave_started, 3)}
+                if is_canary and index == self.canary - 1 and len(waves) > self.canary:
+                    # Remaining devices run `parallelism` at a time at about the canary's pace
+                    remaining = len(self.devices) - done
+                    per_device = (time.perf_counter() - started) / done
+                    wave_event["eta"] = round(per_device * math.ceil(remaining / self.parallelism), 1)
+                yield wave_event
+                if halted:
+                    break
+        skipped = len(self.devices) - done
+        if skipped:
+            ROLLOUT_DEVICES.labels(outcome="skipped").inc(skipped)
+        summary = {"devices": len(self.devices), "ok": done - failed, "failed": failed, "skipped": skipped,
+                   "duration": round(time.perf_counter() - started, 3)}
+        if halted:
+            logger.warning(f"Rollout halted: {halted}")
+            yield {"event": "halted", "reason": halted, **summary}
+        else:
+            logger.info(f"Rollout done: {summary}")
+            yield {"event": "done", **summary}
@@ -0,0 +1,339 @@
+import contextvars
+import functools
+import itertools
+import logging
+import math
+import queue
+import threading
+import time
+import uuid
+from collections import deque
+from dataclasses import dataclass, field
+from enum import IntEnum
+from typing import Any, Callable, Deque, Dict, Generator, Iterable, List, Optional, Tuple
+from metrics import JOB_WAIT_DURATION, JOB_REJECTED
+
+logger = logging.getLogger(__name__)
+
+# Sentinel pushed into a job's output queue when the pipeline has finished
+_END_OF_JOB = object()
+
+
+class Priority(IntEnum):
+    """Priority classes for scheduled jobs; lower values are served first."""
+    INTERACTIVE = 0
+    BATCH = 1
+
+
+class QueueFullError(Exception):
+    """Raised when the scheduler refuses a job because its queue is full."""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Job queue is full, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+@dataclass(order=True)
+class _QueueEntry:
+    """Priority queue entry; ordering is by priority, then by submission order."""
+    priority: int
+    seq: int
+    job: "Job" = field(compare=False)
+
+
+class Job:
+    """A single pipeline run submitted to the JobScheduler.
+
+    The worker pushes every chunk produced by the pipeline into an internal queue,
+    the HTTP handler consumes them through stream().
+    """
+
+    def __init__(self, func: Callable[[], Iterable[str]], priority: Priority):
+        self.id = uuid.uuid4().hex
+        self.func = func
+        self.priority = priority
+        self.submitted_at = time.monotonic()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.cancelled = threading.Event()
+        self._chunks: "queue.Queue" = queue.Queue()
+
+    @property
+    def wait_time(self) -> Optional[float]:
+        """Seconds the job spent in the queue before a worker picked it up."""
+        if self.started_at is None:
+            return None
+        return self.started_at - self.submitted_at
+
+    def cancel(self) -> None:
+        """Marks the job as cancelled (e.g. the client disconnected)."""
+        self.cancelled.set()
+
+    def stream(self) -> Generator[str, None, None]:
+        """Yields the pipeline chunks as the worker produces them.
+
+        Closing the generator early cancels the job.
+        """
+        try:
+            while True:
+                chunk = self._chunks.get()
+                if chunk is _END_OF_JOB:
+                    return
+                yield chunk
+        finally:
+            self.cancel()
+
+
+class JobScheduler:
+    """Runs pipelines on a fixed pool of workers behind a bounded priority queue.
+
+    Interactive jobs are always dequeued before batch jobs; jobs of the same
+    priority are served in submission order.
+    """
+
+    def __init__(self, workers: int, max_queue: int, retry_after: int):
+        """Starts the worker threads.
+
+        Args:
+            workers (int): Number of pipelines allowed to run concurrently.
+            max_queue (int): Maximum number of jobs waiting for a worker.
+            retry_after (int): Fallback Retry-After value in seconds.
+
+        Raises:
+            ValueError: If workers or max_queue are not positive.
+        """
+        if workers < 1:
+            raise ValueError(f"workers must be positive, got {workers}")
+        if max_queue < 1:
+            raise ValueError(f"max_queue must be positive, got {max_queue}")
+        self.workers = workers
+        self.max_queue = max_queue
+        self.default_retry_after = retry_after
+        self._queue: "queue.PriorityQueue[_QueueEntry]" = queue.PriorityQueue(maxsize=max_queue)
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._active = 0
+        self._completed = 0
+        self._rejected = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+        self._total_run = 0.0
+        self._stopped = threading.Event()
+        self._threads = [
+            threading.Thread(target=self._worker, name=f"scheduler-worker-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+        logger.info(f"Job scheduler started: workers={workers}, max_queue={max_queue}")
+
+    def submit(self, func: Callable[[], Iterable[str]], priority: Priority = Priority.INTERACTIVE) -> Job:
+        """Queues a pipeline for execution.
+
+        Args:
+            func (Callable[[], Iterable[str]]): Callable returning the pipeline chunks.
+            priority (Priority): Priority class of the job.
+
+        Returns:
+            Job: The queued job.
+
+        Raises:
+            QueueFullError: If the queue is at capacity.
+        """
+        job = Job(func, priority)
+        try:
+            self._queue.put_nowait(_QueueEntry(int(priority), next(self._seq), job))
+        except queue.Full:
+            with self._lock:
+                self._rejected += 1
+            JOB_REJECTED.inc()
+            retry_after = self.retry_after()
+            logger.warning(f"Job rejected, queue full ({self.max_queue}); Retry-After {retry_after}s")
+            raise QueueFullError(retry_after)
+        logger.info(f"Job {job.id} queued with priority {priority.name}, depth {self._queue.qsize()}")
+        return job
+
+    def retry_after(self) -> int:
+        """Estimates in seconds when a rejected client should retry.
+
+        Returns:
+            int: Time to drain the current queue based on the average run time,
+                or the configured fallback before any job has completed.
+        """
+        with self._lock:
+            if not self._completed:
+                return self.default_retry_after
+            avg_run = self._total_run / self._completed
+        return max(1, math.ceil(avg_run * (self._queue.qsize() + 1) / self.workers))
+
+    def stats(self) -> Dict[str, float]:
+        """Returns queue depth and wait time statistics."""
+        with self._lock:
+            completed = self._completed
+            return {
+                "workers": self.workers,
+                "active": self._active,
+                "queue_depth": self._queue.qsize(),
+                "max_queue": self.max_queue,
+                "completed": completed,
+                "rejected": self._rejected,
+                "avg_wait_seconds": self._total_wait / completed if completed else 0.0,
+                "max_wait_seconds": self._max_wait,
+                "avg_run_seconds": self._total_run / completed if completed else 0.0,
+            }
+
+    def shutdown(self) -> None:
+        """Stops the workers once the jobs already running are finished."""
+        self._stopped.set()
+        for thread in self._threads:
+            thread.join()
+
+    def _worker(self) -> None:
+        while not self._stopped.is_set():
+            try:
+                entry = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            self._run(entry.job)
+
+    def _run(self, job: Job) -> None:
+        job.started_at = time.monotonic()
+        if job.cancelled.is_set():
+            logger.info(f"Job {job.id} cancelled while queued after {job.wait_time:.2f}s")
+            job._chunks.put(_END_OF_JOB)
+            return
+
+        with self._lock:
+            self._active += 1
+        logger.info(f"Job {job.id} started after waiting {job.wait_time:.2f}s")
+        JOB_WAIT_DURATION.labels(priority=job.priority.name.lower()).observe(job.wait_time)
+        chunks = None
+        try:
+            chunks = iter(job.func())
+            for chunk in chunks:
+                if job.cancelled.is_set():
+                    logger.info(f"Job {job.id} cancelled by client")
+                    break
+                job._chunks.put(chunk)
+        except Exception as e:
+            logger.error(f"Job {job.id} failed: {str(e)}")
+        finally:
+            if chunks is not None and hasattr(chunks, "close"):
+                chunks.close()
+            job.finished_at = time.monotonic()
+            job._chunks.put(_END_OF_JOB)
+            with self._lock:
+                self._active -= 1
+                self._completed += 1
+                self._total_wait += job.wait_time
+                self._max_wait = max(self._max_wait, job.wait_time)
+                self._total_run += job.finished_at - job.started_at
+
+
+class JobGroup:
+    """Runs calls as scheduler jobs of one priority, at most `limit` of them in the scheduler at once.
+
+    Fan-out work (e.g. the queries of a batch) goes through the scheduler this way instead of a
+    private thread pool, so it is admitted against the same workers as interactive pipelines,
+    which are always dequeued first. Calls run in the context they were submitted from. The
+    consumer of `results` must not run on a scheduler worker itself.
+    """
+
+    def __init__(self, scheduler: JobScheduler, limit: int, priority: Priority = Priority.BATCH):
+        """Initializes an empty group.
+
+        Args:
+            scheduler (JobScheduler): Scheduler running the calls.
+            limit (int): Calls queued or running in the scheduler at once.
+            priority (Priority): Priority class of the jobs.
+
+        Raises:
+            ValueError: If limit is not positive.
+        """
+        if limit < 1:
+            raise ValueError(f"Job group limit must be positive, got {limit}")
+        self.scheduler = scheduler
+        self.limit = limit
+        self.priority = priority
+        self._pending: Deque[Tuple[contextvars.Context, Callable[[], Any]]] = deque()
+        self._jobs: List[Job] = []
+        self._results: "queue.Queue[Tuple[Any, Optional[Exception]]]" = queue.Queue()
+        # Calls handed to the scheduler whose result has not been received yet
+        self._outstanding = 0
+        self._started = 0
+        self._received = 0
+        self._cancelled = False
+        self._lock = threading.Lock()
+
+    def submit(self, call: Callable[[], Any]) -> None:
+        """Adds a call; it goes to the scheduler once fewer than `limit` calls of the group are there."""
+        self._pending.append((contextvars.copy_context(), call))
+
+    def start(self) -> None:
+        """Hands the first calls to the scheduler.
+
+        Raises:
+            QueueFullError: If the scheduler queue has no room for any of them.
+        """
+        full = self._fill()
+        if full is not None and not self._outstanding:
+            raise full
+
+    def _fill(self) -> Optional[QueueFullError]:
+        while self._pending and self._outstanding < self.limit:
+            context, call = self._pending[0]
+            try:
+                job = self.scheduler.submit(functools.partial(self._run, context, call), self.priority)
+            except QueueFullError as e:
+                return e
+            self._pending.popleft()
+            self._jobs.append(job)
+            self._outstanding += 1
+        return None
+
+    def _run(self, context: contextvars.Context, call: Callable[[], Any]) -> Iterable[str]:
+        with self._lock:
+            if self._cancelled:
+                return ()
+            self._started += 1
+        try:
+            self._results.put((context.run(call), None))
+        except Exception as e:
+            self._results.put((None, e))
+        return ()
+
+    def results(self) -> Generator[Any, None, None]:
+        """Yields the results of the calls in completion order until all of them have reported.
+
+        Calls the scheduler has no room for are retried as earlier ones finish. After `cancel`,
+        only the calls already running are waited for.
+
+        Raises:
+            Exception: The exception raised by a call.
+        """
+        while True:
+            with self._lock:
+                if self._cancelled and self._received >= self._started:
+                    return
+            if not self._cancelled:
+                if not self._pending and not self._outstanding:
+                    return
+                full = self._fill()
+                if full is not None and not self._outstanding:
+                    # Nothing of the group in the scheduler to wait for: retry once there is room
+                    time.sleep(min(full.retry_after, 1.0))
+                    continue
+            value, error = self._results.get()
+            self._received += 1
+            self._outstanding -= 1
+            if error is not None:
+                raise error
+            yield value
+
+    def cancel(self) -> None:
+        """Drops the calls that have not started; the running ones finish."""
+        with self._lock:
+            self._cancelled = True
+        self._pending.clear()
+        for job in self._jobs:
+            job.cancel()
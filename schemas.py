@@ -0,0 +1,92 @@
+import json
+import re
+from typing import List, Literal, Type, TypeVar, Union
+
+from pydantic import BaseModel, Field, ValidationError
+
+M = TypeVar("M", bound=BaseModel)
+
+_THINK_BLOCK = re.compile(r"<think>.*?</think>", re.DOTALL)
+_JSON_BLOCK = re.compile(r"\{.*\}", re.DOTALL)
+
+
+class CommandDecision(BaseModel):
+    """Command chosen by the DominantAgent in the determine_command step."""
+
+    command: Union[str, List[str]] = Field(description="show command, or list of configuration lines for set")
+    command_type: Literal["show", "set"]
+
+
+class AnalysisResult(BaseModel):
+    """Analysis of a command output produced by an Analyzer agent."""
+
+    status: Literal["ok", "warning", "critical"]
+    summary: str
+    issues: List[str] = Field(description="Problems found in the output, empty if none")
+    recommendations: List[str] = Field(description="Suggested actions, empty if none")
+
+
+STATUS_SEVERITY = ("ok", "warning", "critical")
+
+
+def merge_analyses(parts: List[AnalysisResult], note: str = "") -> AnalysisResult:
+    """Combines the analyses of the parts of an output into one.
+
+    The status is the most severe one; summaries are joined in order and issues and
+    recommendations are concatenated without duplicates.
+
+    Args:
+        parts (List[AnalysisResult]): Analyses of consecutive parts, at least one.
+        note (str): Appended to the summary, e.g. which parts were not analyzed.
+
+    Returns:
+        AnalysisResult: The combined analysis.
+    """
+    if len(parts) == 1 and not note:
+        return parts[0]
+    summary = " ".join(f"[{index}/{len(parts)}] {part.summary}" for index, part in enumerate(parts, 1))
+    return AnalysisResult(
+        status=max((part.status for part in parts), key=STATUS_SEVERITY.index),
+        summary=f"{summary} {note}".strip(),
+        issues=list(dict.fromkeys(issue for part in parts for issue in part.issues)),
+        recommendations=list(dict.fromkeys(item for part in parts for item in part.recommendations)),
+    )
+
+
+def _describe(error: Exception) -> str:
+    if isinstance(error, ValidationError):
+        return "; ".join(f"{'.'.join(map(str, item['loc'])) or 'reply'}: {item['msg']}" for item in error.errors())
+    return str(error)
+
+
+def parse_model(model: Type[M], content: str, termination_msg: str = "TERMINATE") -> M:
+    """Validates an LLM reply against a schema.
+
+    Accepts schema-constrained replies as well as free text containing a JSON object,
+    ignoring reasoning blocks and the termination word.
+
+    Args:
+        model (Type[M]): Pydantic model the reply must match.
+        content (str): Reply content.
+        termination_msg (str): Termination word stripped from the reply.
+
+    Returns:
+        M: The validated model.
+
+    Raises:
+        ValueError: If the reply contains no JSON object matching the schema.
+    """
+    text = _THINK_BLOCK.sub("", content or "").split(termination_msg)[0].strip()
+    if not text:
+        raise ValueError("Empty content in response")
+    try:
+        return model.model_validate_json(text)
+    except ValidationError as e:
+        error = e
+    match = _JSON_BLOCK.search(text)
+    if match and match.group(0) != text:
+        try:
+            return model.model_validate(json.loads(match.group(0)))
+        except (json.JSONDecodeError, ValidationError) as e:
+            error = e
+    raise ValueError(f"Reply does not match {model.__name__}: {_describe(error)}")
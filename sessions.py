@@ -0,0 +1,187 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Union
+
+from config import SystemConfig
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(slots=True)
+class SessionRecord:
+    """Results kept between the queries of one client session.
+
+    Attributes:
+        session_id (str): Client session id.
+        created_at (float): Creation time (time.time()).
+        last_access (float): Time of the last query in the session.
+        ip (Optional[str]): Device queried last.
+        command (Optional[Union[str, List[str]]]): Command run last.
+        command_type (Optional[str]): "show" or "set".
+        execute_result (Optional[str]): Output of the last command.
+        result_at (float): Time the output was collected.
+        reachable_at (float): Time the device last answered a ping.
+        analyses (List[str]): Recent analyses as JSON, oldest first.
+        queries (List[str]): Recent queries, oldest first.
+        size (int): Approximate memory held by the record in bytes.
+    """
+    session_id: str
+    created_at: float
+    last_access: float
+    ip: Optional[str] = None
+    command: Optional[Union[str, List[str]]] = None
+    command_type: Optional[str] = None
+    execute_result: Optional[str] = None
+    result_at: float = 0.0
+    reachable_at: float = 0.0
+    analyses: List[str] = field(default_factory=list)
+    queries: List[str] = field(default_factory=list)
+    size: int = 0
+
+    def measure(self) -> int:
+        """Recomputes `size` from the stored strings."""
+        strings = [self.execute_result or ""] + self.analyses + self.queries
+        self.size = sum(len(text.encode("utf-8")) for text in strings)
+        return self.size
+
+    def result_for(self, ip: str, command: Union[str, List[str]], max_age: float) -> Optional[str]:
+        """Returns the stored output if it was collected for the same show command on the same device recently."""
+        if self.command_type != "show" or self.ip != ip or self.command != command or not self.execute_result:
+            return None
+        if time.time() - self.result_at > max_age:
+            return None
+        return self.execute_result
+
+    def host_checked(self, ip: str, max_age: float) -> bool:
+        """Tells whether the device answered a ping within the session recently."""
+        return self.ip == ip and time.time() - self.reachable_at <= max_age
+
+
+class SessionStore:
+    """In-memory session records with a TTL and caps on their number and total size.
+
+    Least recently used sessions are evicted first when a cap is exceeded.
+    """
+
+    def __init__(self, ttl: float, max_sessions: int, max_bytes: int, max_history: int = 5):
+        """Initializes the store.
+
+        Args:
+            ttl (float): Seconds of inactivity after which a session expires.
+            max_sessions (int): Maximum number of sessions kept.
+            max_bytes (int): Maximum total size of the stored outputs and analyses.
+            max_history (int): Queries and analyses kept per session.
+
+        Raises:
+            ValueError: If a limit is not positive.
+        """
+        if ttl <= 0 or max_sessions < 1 or max_bytes < 1 or max_history < 1:
+            raise ValueError("Session store limits must be positive")
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.max_history = max_history
+        self._records: "OrderedDict[str, SessionRecord]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config: SystemConfig) -> "SessionStore":
+        return cls(config.session_ttl, config.session_max_sessions, config.session_max_bytes,
+                   config.session_max_history)
+
+    def _expire(self, now: float) -> None:
+        while self._records:
+            session_id, record = next(iter(self._records.items()))
+            if now - record.last_access <= self.ttl:
+                break
+            self._drop(session_id)
+
+    def _drop(self, session_id: str) -> None:
+        record = self._records.pop(session_id)
+        self._bytes -= record.size
+
+    def get(self, session_id: str) -> SessionRecord:
+        """Returns the session's record, creating an empty one for new or expired sessions."""
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            record = self._records.get(session_id)
+            if record is None:
+                record = self._records[session_id] = SessionRecord(session_id, now, now)
+                self._evict(keep=session_id)
+            else:
+                record.last_access = now
+                self._records.move_to_end(session_id)
+            return record
+
+    def save(self, session_id: str, changes: Dict[str, Any], analysis: str, query: str) -> None:
+        """Records a completed query in its session, trimming the history and enforcing the caps.
+
+        The record is updated under the store's lock, so concurrent queries of one session and
+        the size accounting of other sessions see it either before or after the update.
+
+        Args:
+            session_id (str): Client session id.
+            changes (Dict[str, Any]): SessionRecord fields to set, e.g. {"ip": ..., "command": ...}.
+            analysis (str): Analysis produced for the query, as JSON.
+            query (str): The query.
+        """
+        now = time.time()
+        with self._lock:
+            record = self._records.get(session_id)
+            if record is None:
+                # Expired or evicted while the query ran
+                record = self._records[session_id] = SessionRecord(session_id, now, now)
+            self._bytes -= record.size
+            for name, value in changes.items():
+                setattr(record, name, value)
+            record.analyses.append(analysis)
+            record.queries.append(query)
+            del record.analyses[:-self.max_history]
+            del record.queries[:-self.max_history]
+            record.measure()
+            if record.size > self.max_bytes:
+                logger.warning(f"Session {session_id} holds {record.size} bytes; dropping its command output")
+                record.execute_result = None
+                record.measure()
+            record.last_access = now
+            self._records.move_to_end(session_id)
+            self._bytes += record.size
+            self._evict(keep=session_id)
+
+    def _evict(self, keep: str) -> None:
+        while len(self._records) > 1 and (len(self._records) > self.max_sessions or self._bytes > self.max_bytes):
+            oldest = next(iter(self._records))
+            if oldest == keep:
+                break
+            self._drop(oldest)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._expire(time.time())
+            return {"sessions": len(self._records), "bytes": self._bytes,
+                    "max_sessions": self.max_sessions, "max_bytes": self.max_bytes}
+
+
+_store: Optional[SessionStore] = None
+_store_lock = threading.Lock()
+
+
+def configure_session_store(store: SessionStore) -> None:
+    """Replaces the process-wide session store."""
+    global _store
+    with _store_lock:
+        _store = store
+
+
+def get_session_store() -> SessionStore:
+    """Returns the process-wide session store, creating it from SystemConfig defaults if needed."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = SessionStore.from_config(SystemConfig())
+        return _store
@@ -0,0 +1,196 @@
+import contextvars
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from config import SystemConfig
+from DoNetAgent import NetAgent
+from device_limits import get_device_limiter
+from inventory import device_key
+from metrics import SPECULATION_SAVED, SPECULATIONS
+from poller import SHOW_ERROR_PREFIX, normalize_command
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+# Only commands with these prefixes are ever run speculatively
+READ_ONLY_PREFIXES = ("show ",)
+# Queries asking for a change are never speculated on, whatever command the rules suggest
+CHANGE_KEYWORDS = ("настро", "измени", "установи", "удали", "добавь", "включи", "выключи", "отключи",
+                   "configure", "shutdown", "set ", "no ")
+
+
+def is_read_only(command: str) -> bool:
+    return normalize_command(command).startswith(READ_ONLY_PREFIXES)
+
+
+def _run_show(host: str, port: int, params: Dict[str, Any], command: str) -> str:
+    """Runs a show command through the device limiter, like the netmiko_show tool."""
+    limiter = get_device_limiter()
+    with limiter.session(device_key(host, port), params["device_type"]) as ticket:
+        agent = NetAgent(host=host, username=params["username"], password=params["password"],
+                         device_type=params["device_type"], port=port)
+        try:
+            with limiter.command(ticket):
+                return agent.execute_show(command)
+        finally:
+            agent.disconnect()
+
+
+class Speculation:
+    """A show command started before the LLM has chosen the query's command."""
+
+    def __init__(self, command: str, future: "Future[Tuple[str, float]]", speculator: "Speculator"):
+        self.command = command
+        self.future = future
+        self.started = time.monotonic()
+        self.started_at = time.time()
+        self._speculator = speculator
+        self._resolved = False
+
+    def resolve(self, command: Optional[str]) -> Optional[str]:
+        """Hands over the output if the chosen command is the speculated one.
+
+        Args:
+            command (Optional[str]): The command chosen by the LLM; None for set commands.
+
+        Returns:
+            Optional[str]: The output, waiting for it if still running; None on a mismatch or
+                a failed command, in which case the pipeline runs the command itself.
+        """
+        if self._resolved:
+            return None
+        self._resolved = True
+        if command is None or normalize_command(command) != normalize_command(self.command):
+            self._speculator._record("miss")
+            logger.info(f"Speculative '{self.command}' discarded, LLM chose {command!r}")
+            return None
+        confirmed = time.monotonic()
+        try:
+            output, duration = self.future.result()
+        except Exception as e:
+            self._speculator._record("error")
+            logger.warning(f"Speculative '{self.command}' failed: {str(e)}")
+            return None
+        if output.startswith(SHOW_ERROR_PREFIX):
+            self._speculator._record("error")
+            return None
+        # Without speculation the command would have started at confirmation
+        saved = min(duration, confirmed - self.started)
+        self._speculator._record("hit", saved)
+        logger.info(f"Speculative '{self.command}' confirmed, {saved:.2f}s saved")
+        return output
+
+    def abandon(self) -> None:
+        """Drops a speculation the pipeline never got to resolve; the output is discarded."""
+        if not self._resolved:
+            self._resolved = True
+            self._speculator._record("abandoned")
+
+
+class Speculator:
+    """Runs the likely show command of a query while the LLM is still determining it.
+
+    The command is predicted with keyword rules mirroring the DominantAgent prompt. Only
+    read-only show commands are run, never for queries that ask for a change, and the output
+    is used only if the LLM picks the same command.
+    """
+
+    def __init__(self, workers: int, rules: List[Dict[str, Any]],
+                 runner: Optional[Callable[[str, int, Dict[str, Any], str], str]] = None):
+        """Initializes the speculator.
+
+        Args:
+            workers (int): Speculative commands running at once.
+            rules (List[Dict[str, Any]]): Rules {"keywords": [...], "command": "show ..."}; the
+                first rule with a keyword found in the query wins.
+            runner (Optional[Callable]): Runs (host, port, params, command) and returns the output.
+
+        Raises:
+            ValueError: If workers is not positive or a rule's command is not a show command.
+        """
+        if workers < 1:
+            raise ValueError(f"Speculation workers must be positive, got {workers}")
+        for rule in rules:
+            if not is_read_only(rule["command"]):
+                raise ValueError(f"Speculation rule command must be a show command, got {rule['command']}")
+        self.rules = [([keyword.lower() for keyword in rule["keywords"]], rule["command"]) for rule in rules]
+        self.runner = runner or _run_show
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="speculate")
+        self._lock = threading.Lock()
+        self._counts = {"started": 0, "hit": 0, "miss": 0, "error": 0, "abandoned": 0}
+        self._saved = 0.0
+
+    @classmethod
+    def from_config(cls, config: SystemConfig) -> "Speculator":
+        return cls(config.speculation_workers, config.speculation_rules)
+
+    def predict(self, query: str) -> Optional[str]:
+        """Returns the likely show command of a query, or None."""
+        lowered = query.lower()
+        if any(keyword in lowered for keyword in CHANGE_KEYWORDS):
+            return None
+        for keywords, command in self.rules:
+            if any(keyword in lowered for keyword in keywords):
+                return command
+        return None
+
+    def start(self, host: str, port: int, params: Dict[str, Any], command: str) -> Speculation:
+        """Starts a show command in the background.
+
+        Raises:
+            ValueError: If the command is not read-only.
+        """
+        if not is_read_only(command):
+            raise ValueError(f"Refusing to speculate on non-show command: {command}")
+
+        def run() -> Tuple[str, float]:
+            started = time.monotonic()
+            with span("speculation.show", host=device_key(host, port), command=command):
+                output = self.runner(host, port, params, command)
+            return output, time.monotonic() - started
+
+        with self._lock:
+            self._counts["started"] += 1
+        logger.info(f"Speculatively running '{command}' on {device_key(host, port)}")
+        # The command's spans join the trace of the pipeline that started it
+        return Speculation(command, self._executor.submit(contextvars.copy_context().run, run), self)
+
+    def _record(self, outcome: str, saved: float = 0.0) -> None:
+        SPECULATIONS.labels(outcome=outcome).inc()
+        if outcome == "hit":
+            SPECULATION_SAVED.observe(saved)
+        with self._lock:
+            self._counts[outcome] += 1
+            self._saved += saved
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            decided = self._counts["hit"] + self._counts["miss"]
+            return {
+                **self._counts,
+                "hit_rate": round(self._counts["hit"] / decided, 3) if decided else None,
+                "saved_seconds": round(self._saved, 3),
+            }
+
+
+_speculator: Optional[Speculator] = None
+_speculator_lock = threading.Lock()
+
+
+def configure_speculator(speculator: Speculator) -> None:
+    """Replaces the process-wide speculator."""
+    global _speculator
+    with _speculator_lock:
+        _speculator = speculator
+
+
+def get_speculator() -> Speculator:
+    """Returns the process-wide speculator, creating it from SystemConfig defaults if needed."""
+    global _speculator
+    with _speculator_lock:
+        if _speculator is None:
+            _speculator = Speculator.from_config(SystemConfig())
+        return _speculator
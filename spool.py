@@ -0,0 +1,179 @@
+import codecs
+import logging
+import mmap
+import os
+import resource
+import tempfile
+from typing import Generator, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_READ_CHUNK_BYTES = 64 * 1024
+
+
+def current_rss() -> int:
+    """Returns the resident set size of the process in bytes.
+
+    Reads /proc/self/statm where available; elsewhere falls back to the peak RSS reported by
+    getrusage, which never decreases.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class RssWatch:
+    """Tracks the peak growth of the process RSS while a request runs.
+
+    RSS is process-wide, so concurrent requests see each other's allocations; the growth is an
+    upper bound of what the request itself holds.
+    """
+
+    def __init__(self, limit: Optional[int] = None):
+        self.limit = limit
+        self.started = current_rss()
+        self.peak = self.started
+
+    @property
+    def growth(self) -> int:
+        return self.peak - self.started
+
+    def check(self) -> bool:
+        """Samples the RSS; returns False once the growth exceeds the limit."""
+        self.peak = max(self.peak, current_rss())
+        return self.limit is None or self.growth <= self.limit
+
+
+class SpooledOutput:
+    """A command output held in memory while small and in a temporary file once large.
+
+    Writes accumulate in memory until `threshold` bytes, then move to an anonymous temporary
+    file that readers map with mmap, so large outputs are read chunk by chunk from the page
+    cache instead of living on the heap. The file is removed on `close` (or when the process
+    exits).
+    """
+
+    def __init__(self, threshold: int, spool_dir: Optional[str] = None):
+        """Initializes an empty output.
+
+        Args:
+            threshold (int): Bytes kept in memory before the output moves to a file.
+            spool_dir (Optional[str]): Directory of the temporary file; None uses the system temp dir.
+
+        Raises:
+            ValueError: If threshold is not positive.
+        """
+        if threshold < 1:
+            raise ValueError(f"Spool threshold must be positive, got {threshold}")
+        self.threshold = threshold
+        self.spool_dir = spool_dir
+        self.size = 0
+        self.lines = 1
+        self._buffer: Optional[bytearray] = bytearray()
+        self._file = None
+        self._mapped: Optional[mmap.mmap] = None
+
+    @classmethod
+    def from_text(cls, text: str, threshold: int, spool_dir: Optional[str] = None) -> "SpooledOutput":
+        output = cls(threshold, spool_dir)
+        output.write(text)
+        return output
+
+    @property
+    def spooled(self) -> bool:
+        """True once the output lives in a file."""
+        return self._file is not None
+
+    def write(self, text: str) -> None:
+        self.write_bytes(text.encode("utf-8"))
+
+    def write_bytes(self, data: bytes) -> None:
+        """Appends UTF-8 encoded output, moving it to a file when the threshold is crossed."""
+        if not data:
+            return
+        self.size += len(data)
+        self.lines += data.count(b"\n")
+        if self._file is None and self.size < self.threshold:
+            self._buffer += data
+            return
+        if self._file is None:
+            if self.spool_dir:
+                os.makedirs(self.spool_dir, exist_ok=True)
+            self._file = tempfile.TemporaryFile(dir=self.spool_dir, prefix="netagents-output-")
+            self._file.write(self._buffer)
+            self._buffer = None
+            logger.debug(f"Output exceeded {self.threshold} bytes, spooled to a temporary file")
+        if self._mapped is not None:
+            self._mapped.close()
+            self._mapped = None
+        self._file.write(data)
+
+    def _view(self):
+        if self._file is None:
+            return self._buffer
+        if self._mapped is None:
+            self._file.flush()
+            self._mapped = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._mapped
+
+    def read(self, start: int = 0, length: Optional[int] = None) -> str:
+        """Returns a byte range of the output as text; a split character at the edges is replaced."""
+        if self.size == 0:
+            return ""
+        end = self.size if length is None else min(start + length, self.size)
+        return bytes(self._view()[start:end]).decode("utf-8", errors="replace")
+
+    def text(self) -> str:
+        """Returns the whole output as a string; callers check `size` first."""
+        return self.read()
+
+    def head(self, limit: int) -> str:
+        """Returns at most `limit` bytes from the start, cut at a line end where there is one."""
+        if self.size <= limit:
+            return self.text()
+        data = bytes(self._view()[:limit])
+        cut = data.rfind(b"\n")
+        return data[:cut + 1 if cut > 0 else limit].decode("utf-8", errors="ignore")
+
+    def iter_text(self, chunk_bytes: int = DEFAULT_READ_CHUNK_BYTES) -> Generator[str, None, None]:
+        """Yields the output as text chunks of at most about `chunk_bytes` bytes.
+
+        Chunks end at a line end where the chunk contains one, and never split a character.
+        """
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        start = 0
+        while start < self.size:
+            end = min(start + chunk_bytes, self.size)
+            data = bytes(self._view()[start:end])
+            if end < self.size:
+                cut = data.rfind(b"\n")
+                if cut >= 0:
+                    data = data[:cut + 1]
+            start += len(data)
+            text = decoder.decode(data, final=start >= self.size)
+            if text:
+                yield text
+
+    def iter_lines(self, chunk_bytes: int = DEFAULT_READ_CHUNK_BYTES) -> Generator[str, None, None]:
+        """Yields the output line by line, keeping line ends; overlong lines come in pieces."""
+        for chunk in self.iter_text(chunk_bytes):
+            yield from chunk.splitlines(keepends=True)
+
+    def close(self) -> None:
+        if self._mapped is not None:
+            self._mapped.close()
+            self._mapped = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._buffer = bytearray()
+        self.size = 0
+        self.lines = 1
+
+    def __enter__(self) -> "SpooledOutput":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
@@ -0,0 +1,166 @@
+import logging
+import socket
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from config import DEFAULT_SSH_PROBE_SOCKET_TTL, DEFAULT_SSH_PROBE_TIMEOUT
+from inventory import device_key
+from metrics import SSH_PROBES, SSH_WARM_SOCKETS
+
+logger = logging.getLogger(__name__)
+
+# Bytes peeked from the server's identification line
+BANNER_PEEK_BYTES = 255
+
+
+@dataclass(slots=True)
+class ProbeResult:
+    """Outcome of an SSH port probe.
+
+    Attributes:
+        host (str): Device probed.
+        port (int): SSH port.
+        reachable (bool): Whether the TCP connect succeeded.
+        connect_time (float): Seconds the connect took.
+        banner (Optional[str]): Server identification line, e.g. "SSH-2.0-Cisco-1.25".
+        error (Optional[str]): Reason the device is unreachable.
+    """
+    host: str
+    port: int
+    reachable: bool
+    connect_time: float
+    banner: Optional[str] = None
+    error: Optional[str] = None
+
+    def describe(self) -> str:
+        if not self.reachable:
+            return f"Host {self.host} is unreachable on SSH port {self.port}: {self.error}"
+        banner = f", {self.banner}" if self.banner else ""
+        return f"Host {self.host} is reachable on SSH port {self.port} ({self.connect_time * 1000:.0f} ms{banner})."
+
+
+class WarmSockets:
+    """Connected SSH sockets left by probes, taken over by the next login to the device.
+
+    A socket is used at most once and closed if nobody takes it within `ttl` seconds,
+    well before devices drop unauthenticated connections. A reaper thread, running only while
+    sockets are parked, closes them on time even if no later probe or login comes along.
+    """
+
+    def __init__(self, ttl: float = DEFAULT_SSH_PROBE_SOCKET_TTL):
+        self.ttl = ttl
+        self._sockets: Dict[str, Tuple[socket.socket, float]] = {}
+        self._lock = threading.Lock()
+        self._reaper: Optional[threading.Thread] = None
+
+    def park(self, key: str, sock: socket.socket) -> None:
+        with self._lock:
+            previous = self._sockets.pop(key, None)
+            self._sockets[key] = (sock, time.monotonic())
+            expired = self._expire()
+            if self._reaper is None:
+                self._reaper = threading.Thread(target=self._reap, name="warm-socket-reaper", daemon=True)
+                self._reaper.start()
+        if previous:
+            expired.append(previous[0])
+        for stale in expired:
+            stale.close()
+
+    def discard(self, key: str) -> None:
+        """Closes the device's parked socket, e.g. when the pipeline will not log in after all."""
+        with self._lock:
+            entry = self._sockets.pop(key, None)
+        if entry is not None:
+            entry[0].close()
+            SSH_WARM_SOCKETS.labels(outcome="discarded").inc()
+
+    def take(self, key: str) -> Optional[socket.socket]:
+        """Returns the device's parked socket, if any is still fresh."""
+        with self._lock:
+            entry = self._sockets.pop(key, None)
+            expired = self._expire()
+        for stale in expired:
+            stale.close()
+        if entry is None:
+            return None
+        sock, parked_at = entry
+        if time.monotonic() - parked_at > self.ttl:
+            sock.close()
+            SSH_WARM_SOCKETS.labels(outcome="expired").inc()
+            return None
+        SSH_WARM_SOCKETS.labels(outcome="taken").inc()
+        return sock
+
+    def _reap(self) -> None:
+        while True:
+            with self._lock:
+                expired = self._expire()
+                if not self._sockets:
+                    self._reaper = None
+                else:
+                    wake = min(parked_at for _, parked_at in self._sockets.values()) + self.ttl
+            for stale in expired:
+                stale.close()
+            if self._reaper is not threading.current_thread():
+                return
+            time.sleep(max(wake - time.monotonic(), 0.01))
+
+    def _expire(self) -> List[socket.socket]:
+        now = time.monotonic()
+        expired = [key for key, (_, parked_at) in self._sockets.items() if now - parked_at > self.ttl]
+        SSH_WARM_SOCKETS.labels(outcome="expired").inc(len(expired))
+        return [self._sockets.pop(key)[0] for key in expired]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._sockets)
+
+
+_warm_sockets = WarmSockets()
+
+
+def get_warm_sockets() -> WarmSockets:
+    """Returns the process-wide pool of probe sockets."""
+    return _warm_sockets
+
+
+def probe_ssh_port(host: str, port: int = 22, timeout: float = DEFAULT_SSH_PROBE_TIMEOUT,
+                   keep: bool = True) -> ProbeResult:
+    """Checks reachability with a TCP connect to the SSH port.
+
+    Unlike ICMP this is not filtered on management networks, and the connected socket is kept
+    for the following login, so the probe is the first half of the SSH handshake rather than
+    an extra round-trip.
+
+    Args:
+        host (str): The IP address or hostname.
+        port (int): SSH port.
+        timeout (float): Connect timeout in seconds, also the time allowed for the server banner.
+        keep (bool): Park the connected socket for NetAgent instead of closing it.
+
+    Returns:
+        ProbeResult: The outcome.
+    """
+    started = time.perf_counter()
+    try:
+        sock = socket.create_connection((host, port), timeout=timeout)
+    except OSError as e:
+        SSH_PROBES.labels(outcome="unreachable").inc()
+        return ProbeResult(host, port, False, time.perf_counter() - started, error=str(e) or type(e).__name__)
+    connect_time = time.perf_counter() - started
+    banner = None
+    try:
+        # Peek so the banner stays in the buffer for paramiko's handshake
+        data = sock.recv(BANNER_PEEK_BYTES, socket.MSG_PEEK)
+        banner = data.split(b"\r\n")[0].split(b"\n")[0].decode("ascii", errors="replace") or None
+    except OSError:
+        pass
+    SSH_PROBES.labels(outcome="reachable").inc()
+    if keep:
+        sock.settimeout(None)
+        get_warm_sockets().park(device_key(host, port), sock)
+    else:
+        sock.close()
+    return ProbeResult(host, port, True, connect_time, banner)
@@ -1,6 +1,12 @@
-from typing import Dict, Any, Optional
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Dict, Any, List, Optional, Tuple
 from enum import Enum, auto
 
+from config import DEFAULT_STATE_EVENT_BUFFER, DEFAULT_STATE_LOG_VALUE_CHARS, redact
+
 class StateStep(Enum):
     """Enum for valid system state steps."""
     INIT = auto()
@@ -12,39 +18,157 @@ class StateStep(Enum):
     SELECT = auto()
     DONE = auto()
 
+def _truncate(value: Any, limit: int) -> Any:
+    """Shortens strings and containers to at most `limit` characters for logging."""
+    if isinstance(value, str):
+        return value if len(value) <= limit else f"{value[:limit]}… [{len(value)} chars]"
+    if isinstance(value, (list, dict)):
+        text = repr(value)
+        return value if len(text) <= limit else f"{text[:limit]}… [{len(text)} chars]"
+    return value
+
+@dataclass(frozen=True, slots=True)
+class StateSnapshot:
+    """Immutable view of the state at one version.
+
+    String values are shared with the state rather than copied; rendering via `str()`
+    truncates them, so snapshots are cheap to take and safe to log. Passwords and secrets in
+    dict values (credentials) are masked when the snapshot is taken.
+    """
+    version: int
+    step: StateStep
+    values: Tuple[Tuple[str, Any], ...]
+    value_chars: int = DEFAULT_STATE_LOG_VALUE_CHARS
+
+    def as_dict(self) -> Dict[str, Any]:
+        return dict(self.values)
+
+    def __str__(self) -> str:
+        shown = {key: _truncate(value, self.value_chars) for key, value in self.values if value is not None}
+        return f"v{self.version} {self.step.name.lower()} {shown}"
+
+@dataclass(frozen=True, slots=True)
+class StepEvent:
+    """A step transition recorded in the ring buffers."""
+    timestamp: float
+    run_id: str
+    step: str
+    snapshot: StateSnapshot
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {"timestamp": self.timestamp, "run_id": self.run_id, "step": self.step, "state": str(self.snapshot)}
+
+# Recent step events of all runs, for debugging (see `recent_events`)
+_recent_events: deque = deque(maxlen=DEFAULT_STATE_EVENT_BUFFER * 4)
+_recent_events_lock = threading.Lock()
+
+def recent_events(limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Returns the most recent step events of all runs, oldest first."""
+    with _recent_events_lock:
+        events = list(_recent_events)
+    return [event.as_dict() for event in events[-limit if limit else 0:]]
+
 class SystemState:
-    """Manages shared state for data exchange between agents."""
-    
+    """Manages shared state for data exchange between agents.
+
+    Fields are slots with fixed types; every update bumps `version`. Step transitions are
+    kept in a bounded ring buffer together with a snapshot of the state at that point.
+    """
+
+    # Field types; None is always accepted
+    FIELD_TYPES: Dict[str, Any] = {
+        "query": str,
+        "ip": str,
+        "ping_result": str,
+        "credentials": dict,
+        "credential_status": str,
+        "command": (str, list),
+        "command_type": str,
+        "execute_result": str,
+        "result_handle": str,
+        "analyses": list,
+        "best_analysis": str,
+        "error": str,
+    }
     # Valid state keys
-    VALID_KEYS = {"query", "ip", "ping_result", "credentials", "credential_status", "command", "command_type", "execute_result", "analyses", "best_analysis"}
-
-    def __init__(self):
-        """Initializes the system state with default values and initial step."""
-        self.data: Dict[str, Any] = {
-            "query": None,
-            "ip": None,
-            "ping_result": None,
-            "scan_result": None,
-            "analyses": [],  # List of analyses from analyzer agents
-            "best_analysis": None
-        }
+    VALID_KEYS = frozenset(FIELD_TYPES)
+
+    __slots__ = tuple(FIELD_TYPES) + ("current_step", "version", "run_id", "value_chars", "_events")
+
+    def __init__(self, event_buffer: int = DEFAULT_STATE_EVENT_BUFFER, value_chars: int = DEFAULT_STATE_LOG_VALUE_CHARS,
+                 run_id: str = ""):
+        """Initializes the system state with default values and initial step.
+
+        Args:
+            event_buffer (int): Number of step events kept for this run.
+            value_chars (int): Characters per value shown when the state is logged.
+            run_id (str): Id of the run (e.g. the trace id) attached to step events.
+        """
+        for key in self.FIELD_TYPES:
+            setattr(self, key, None)
+        self.analyses = []  # List of analyses from analyzer agents
         self.current_step: StateStep = StateStep.INIT
+        self.version = 0
+        self.run_id = run_id
+        self.value_chars = value_chars
+        self._events: deque = deque(maxlen=event_buffer)
 
     def update(self, key: str, value: Any) -> None:
+        """Sets a field and bumps the state version.
 
+        Raises:
+            ValueError: If the key is unknown or the value has the wrong type.
+        """
         if key not in self.VALID_KEYS:
-            raise ValueError(f"Invalid state key: {key}. Must be one of {self.VALID_KEYS}")
-        self.data[key] = value
+            raise ValueError(f"Invalid state key: {key}. Must be one of {sorted(self.VALID_KEYS)}")
+        if value is not None and not isinstance(value, self.FIELD_TYPES[key]):
+            raise ValueError(f"Invalid type for state key {key}: {type(value).__name__}")
+        setattr(self, key, value)
+        self.version += 1
 
     def get(self, key: str) -> Optional[Any]:
 
         if key not in self.VALID_KEYS:
-            raise ValueError(f"Invalid state key: {key}. Must be one of {self.VALID_KEYS}")
-        return self.data.get(key)
+            raise ValueError(f"Invalid state key: {key}. Must be one of {sorted(self.VALID_KEYS)}")
+        return getattr(self, key)
+
+    @property
+    def data(self) -> Dict[str, Any]:
+        """All fields as a dict (built on access; prefer `get` or `snapshot`)."""
+        return {key: getattr(self, key) for key in self.FIELD_TYPES}
+
+    def snapshot(self, compact: bool = False) -> StateSnapshot:
+        """Returns an immutable view of the current version.
+
+        Args:
+            compact (bool): Keep only the first `value_chars` characters of long strings, so
+                the snapshot does not pin multi-megabyte command outputs in memory.
+        """
+        values = tuple(
+            (key, _truncate(value, self.value_chars) if compact and isinstance(value, str) else redact(value))
+            for key, value in ((key, getattr(self, key)) for key in self.FIELD_TYPES)
+        )
+        return StateSnapshot(self.version, self.current_step, values, self.value_chars)
 
     def advance_step(self, next_step: str) -> None:
+        """Moves to the next step and records the transition.
 
+        Raises:
+            ValueError: If the step is unknown.
+        """
         try:
             self.current_step = StateStep[next_step.upper()]
         except KeyError:
-            raise ValueError(f"Invalid step: {next_step}. Must be one of {[s.name.lower() for s in StateStep]}")
\ No newline at end of file
+            raise ValueError(f"Invalid step: {next_step}. Must be one of {[s.name.lower() for s in StateStep]}")
+        event = StepEvent(time.time(), self.run_id, next_step, self.snapshot(compact=True))
+        self._events.append(event)
+        with _recent_events_lock:
+            _recent_events.append(event)
+
+    def events(self) -> List[StepEvent]:
+        """Returns this run's recorded step events, oldest first."""
+        return list(self._events)
+
+    def __str__(self) -> str:
+        """Renders the state with long values truncated; only evaluated when actually logged."""
+        return str(self.snapshot())
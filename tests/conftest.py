@@ -0,0 +1,8 @@
+import os
+import sys
+
+# The modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Manual scripts that talk to a live llama.cpp server at import time
+collect_ignore = ["test_llm.py", "test_tools_llm.py", "test_tools_planer.py"]
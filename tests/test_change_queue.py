@@ -0,0 +1,75 @@
+import threading
+from typing import Any, Dict, List
+
+from change_queue import ChangeQueue
+
+PARAMS = {"username": "user", "password": "secret", "device_type": "cisco_ios"}
+
+
+class RecordingApplier:
+    """Stands in for the device: records the change sets of every batch."""
+
+    def __init__(self):
+        self.batches: List[List[List[str]]] = []
+        self.lock = threading.Lock()
+
+    def __call__(self, host: str, port: int, params: Dict[str, Any], changes: List[List[str]]) -> List[str]:
+        with self.lock:
+            self.batches.append(changes)
+        return [f"applied {' '.join(commands)}" for commands in changes]
+
+
+def test_changes_within_the_window_share_a_batch_in_submission_order():
+    applier = RecordingApplier()
+    queue = ChangeQueue(window=0.2, max_batch=10, applier=applier)
+    futures = [queue.submit("10.0.0.1", [f"line {index}"], PARAMS) for index in range(3)]
+    assert [future.result(5) for future in futures] == ["applied line 0", "applied line 1", "applied line 2"]
+    assert applier.batches == [[["line 0"], ["line 1"], ["line 2"]]]
+
+
+def test_batches_are_capped_and_keep_the_order():
+    applier = RecordingApplier()
+    queue = ChangeQueue(window=0.2, max_batch=2, applier=applier)
+    futures = [queue.submit("10.0.0.1", [f"line {index}"], PARAMS) for index in range(3)]
+    for future in futures:
+        future.result(5)
+    assert applier.batches == [[["line 0"], ["line 1"]], [["line 2"]]]
+
+
+def test_changes_with_other_credentials_are_not_merged_across():
+    applier = RecordingApplier()
+    queue = ChangeQueue(window=0.2, max_batch=10, applier=applier)
+    other = {**PARAMS, "username": "admin"}
+    futures = [queue.submit("10.0.0.1", ["a"], PARAMS), queue.submit("10.0.0.1", ["b"], other),
+               queue.submit("10.0.0.1", ["c"], PARAMS)]
+    for future in futures:
+        future.result(5)
+    assert applier.batches == [[["a"]], [["b"]], [["c"]]]
+
+
+def test_urgent_change_flushes_the_window():
+    applier = RecordingApplier()
+    queue = ChangeQueue(window=30.0, max_batch=10, applier=applier)
+    first = queue.submit("10.0.0.1", ["a"], PARAMS)
+    urgent = queue.submit("10.0.0.1", ["b"], PARAMS, urgent=True)
+    assert urgent.result(5) == "applied b"
+    assert first.result(5) == "applied a"
+    assert applier.batches == [[["a"], ["b"]]]
+
+
+def test_flush_applies_pending_changes_at_once():
+    applier = RecordingApplier()
+    queue = ChangeQueue(window=30.0, max_batch=10, applier=applier)
+    future = queue.submit("10.0.0.1", ["a"], PARAMS)
+    queue.flush("10.0.0.1")
+    assert future.result(5) == "applied a"
+    assert queue.stats()["10.0.0.1"] == {"pending": 0, "batches": 1, "changes": 1}
+
+
+def test_failed_batch_reports_the_error_to_every_change():
+    def applier(host, port, params, changes):
+        raise OSError("connection refused")
+
+    queue = ChangeQueue(window=0.05, max_batch=10, applier=applier)
+    futures = [queue.submit("10.0.0.1", [line], PARAMS) for line in ("a", "b")]
+    assert all(future.result(5) == "Error executing set commands: connection refused" for future in futures)
@@ -0,0 +1,104 @@
+import threading
+import time
+
+import pytest
+
+from llm_client import CONCURRENCY_BACKOFF, LATENCY_BASELINE_WINDOW, AdaptiveConcurrencyLimiter, LLMOverloadedError
+
+
+def _request(limiter: AdaptiveConcurrencyLimiter, latency: float, pipeline: str = "p"):
+    """Acquires a ticket that looks as if it had been running for `latency` seconds."""
+    ticket = limiter.acquire(pipeline)
+    ticket.started_at -= latency
+    return ticket
+
+
+def _round(limiter: AdaptiveConcurrencyLimiter, latency: float) -> None:
+    """Runs the limit's worth of concurrent requests, all succeeding with the same latency."""
+    tickets = [_request(limiter, latency) for _ in range(int(limiter.limit))]
+    for ticket in tickets:
+        limiter.release(ticket, congested=False)
+
+
+def test_limit_grows_while_saturated_and_fast():
+    limiter = AdaptiveConcurrencyLimiter(initial=2, min_limit=1, max_limit=8)
+    for _ in range(20):
+        _round(limiter, 0.01)
+    assert limiter.limit > 4
+    assert limiter.increases >= 3
+    assert limiter.decreases == 0
+
+
+def test_limit_stays_when_not_saturated():
+    limiter = AdaptiveConcurrencyLimiter(initial=4, min_limit=1, max_limit=8)
+    for _ in range(50):
+        limiter.release(_request(limiter, 0.01), congested=False)
+    assert limiter.limit == 4
+
+
+def test_limit_backs_off_on_slow_saturated_requests():
+    limiter = AdaptiveConcurrencyLimiter(initial=4, min_limit=1, max_limit=8, tolerance=2.0)
+    _round(limiter, 0.01)
+    before = limiter.limit
+    tickets = [_request(limiter, 0.1) for _ in range(int(limiter.limit))]
+    for ticket in tickets:
+        limiter.release(ticket, congested=False)
+    # Requests started before the cut say nothing about the new limit: one cut per round-trip
+    assert limiter.decreases == 1
+    assert limiter.limit == pytest.approx(before * CONCURRENCY_BACKOFF)
+
+
+def test_limit_backs_off_on_errors_down_to_min():
+    limiter = AdaptiveConcurrencyLimiter(initial=4, min_limit=2, max_limit=8)
+    for _ in range(30):
+        limiter.release(limiter.acquire(), congested=True)
+    assert limiter.limit == 2
+
+
+def test_baseline_does_not_drift_away_from_measurements():
+    limiter = AdaptiveConcurrencyLimiter(initial=2, min_limit=1, max_limit=2, tolerance=2.0)
+    # Latency creeping up as load builds must not drag the baseline along
+    for step in range(60):
+        _round(limiter, 0.01 * 1.02 ** step)
+    assert limiter.baseline == pytest.approx(0.01, abs=0.002)
+    assert limiter.decreases >= 1
+
+
+def test_baseline_follows_a_slower_backend():
+    limiter = AdaptiveConcurrencyLimiter(initial=1, min_limit=1, max_limit=1)
+    limiter.release(_request(limiter, 0.001), congested=False)
+    for _ in range(LATENCY_BASELINE_WINDOW):
+        limiter.release(_request(limiter, 0.05), congested=False)
+    assert limiter.baseline == pytest.approx(0.05, abs=0.01)
+
+
+def test_waiting_requests_are_admitted_round_robin_across_pipelines():
+    limiter = AdaptiveConcurrencyLimiter(initial=1, min_limit=1, max_limit=1)
+    holder = limiter.acquire("holder")
+    admitted = []
+
+    def wait(pipeline: str) -> None:
+        ticket = limiter.acquire(pipeline)
+        admitted.append(pipeline)
+        limiter.release(ticket)
+
+    threads = []
+    for waiting, pipeline in enumerate(["a", "a", "a", "b", "b"], start=1):
+        thread = threading.Thread(target=wait, args=(pipeline,))
+        thread.start()
+        threads.append(thread)
+        while limiter.stats()["waiting"] < waiting:
+            time.sleep(0.001)
+    limiter.release(holder)
+    for thread in threads:
+        thread.join(5)
+    assert admitted == ["a", "b", "a", "b", "a"]
+
+
+def test_full_queue_rejects():
+    limiter = AdaptiveConcurrencyLimiter(initial=1, min_limit=1, max_limit=1, queue_timeout=0.05, max_queue=1)
+    holder = limiter.acquire()
+    with pytest.raises(LLMOverloadedError):
+        limiter.acquire()
+    assert limiter.stats()["rejected"] == 1
+    limiter.release(holder)
@@ -0,0 +1,23 @@
+import logging
+
+from config import REDACTED, SystemConfig, redact
+
+
+def test_redact_masks_sensitive_keys_at_any_depth():
+    value = {"default_device_credentials": {"username": "wbos", "password": "welcome"},
+             "llm_backends": [{"base_url": "http://llm:8080/v1", "api_key": "sk-1"}], "secret": "s"}
+    assert redact(value) == {"default_device_credentials": {"username": "wbos", "password": REDACTED},
+                             "llm_backends": [{"base_url": "http://llm:8080/v1", "api_key": REDACTED}],
+                             "secret": REDACTED}
+
+
+def test_values_without_secrets_are_not_copied():
+    value = {"hosts": ["10.0.0.1"], "limits": {"max_sessions": 2}}
+    assert redact(value) is value
+
+
+def test_config_log_does_not_show_credentials(caplog):
+    with caplog.at_level(logging.INFO, logger="config"):
+        config = SystemConfig(llm_api_key="sk-secret-key")
+    assert config.default_device_credentials["password"] not in caplog.text
+    assert "sk-secret-key" not in caplog.text
@@ -0,0 +1,74 @@
+import threading
+import time
+
+import pytest
+
+import inventory
+from config import SystemConfig
+from device_limits import DeviceBusyError, DeviceLimit, DeviceLimiter
+from inventory import Credentials, Device, FingerprintCache, Inventory
+
+
+@pytest.fixture
+def core_inventory():
+    previous = inventory._inventory
+    inventory.configure_inventory(Inventory(
+        [Device("10.0.0.1", group="core"), Device("10.0.0.2", port=2222, group="core")],
+        {"default": Credentials("user", "secret")},
+        FingerprintCache(None),
+    ))
+    yield
+    inventory.configure_inventory(previous)
+
+
+def test_policy_prefers_group_then_device_type_then_default():
+    core, juniper = DeviceLimit(max_sessions=1), DeviceLimit(max_sessions=3)
+    limiter = DeviceLimiter({"core": core, "juniper_junos": juniper},
+                            group_resolver={"10.0.0.1": "core"}.get)
+    assert limiter.policy_for("10.0.0.1", "juniper_junos") is core
+    assert limiter.policy_for("10.0.0.9", "juniper_junos") is juniper
+    assert limiter.policy_for("10.0.0.9", "cisco_ios") is limiter.default
+
+
+def test_from_config_resolves_inventory_groups(core_inventory):
+    config = SystemConfig(device_limits={"core": {"max_sessions": 1, "rate": 5.0, "burst": 1}})
+    limiter = DeviceLimiter.from_config(config)
+    assert limiter.policy_for("10.0.0.1").max_sessions == 1
+    assert limiter.policy_for("10.0.0.2:2222").max_sessions == 1
+    assert limiter.policy_for("10.0.0.3").max_sessions == limiter.default.max_sessions
+
+
+def test_group_limit_caps_sessions(core_inventory):
+    config = SystemConfig(device_limits={"core": {"max_sessions": 1, "rate": 5.0, "burst": 1}},
+                          device_session_wait_timeout=0.05)
+    limiter = DeviceLimiter.from_config(config)
+    with limiter.session("10.0.0.1"):
+        with pytest.raises(DeviceBusyError):
+            with limiter.session("10.0.0.1"):
+                pass
+        # Other devices are not affected
+        with limiter.session("10.0.0.3"):
+            pass
+
+
+def test_sessions_are_granted_in_arrival_order():
+    limiter = DeviceLimiter(default=DeviceLimit(max_sessions=1, rate=100.0, burst=10))
+    order = []
+    holder = limiter.session("10.0.0.1")
+    holder.__enter__()
+
+    def run(index: int) -> None:
+        with limiter.session("10.0.0.1"):
+            order.append(index)
+
+    threads = []
+    for index in range(4):
+        thread = threading.Thread(target=run, args=(index,))
+        thread.start()
+        threads.append(thread)
+        while limiter.stats()["10.0.0.1"]["waiting"] < index + 1:
+            time.sleep(0.001)
+    holder.__exit__(None, None, None)
+    for thread in threads:
+        thread.join(5)
+    assert order == [0, 1, 2, 3]
@@ -0,0 +1,58 @@
+from history import OutputHistory
+
+OUTPUT = "Interface  Status\nge-0/0/0   up\nge-0/0/1   up\n"
+
+
+def test_repeated_output_is_stored_once():
+    history = OutputHistory(max_entries=4, max_keys=8, max_bytes=1 << 20)
+    entry, delta = history.record("10.0.0.1", "show interfaces", OUTPUT, collected_at=100.0)
+    assert delta is None
+    again, delta = history.record("10.0.0.1", "show interfaces", OUTPUT, collected_at=200.0)
+    assert again is entry
+    assert (entry.first_seen, entry.last_seen) == (100.0, 200.0)
+    assert not delta.changed
+    stats = history.stats()
+    assert (stats["entries"], stats["blobs"]) == (1, 1)
+
+
+def test_identical_outputs_share_a_blob_across_devices():
+    history = OutputHistory(max_entries=4, max_keys=8, max_bytes=1 << 20)
+    history.record("10.0.0.1", "show interfaces", OUTPUT)
+    history.record("10.0.0.2", "show interfaces", OUTPUT)
+    stats = history.stats()
+    assert (stats["keys"], stats["entries"], stats["blobs"]) == (2, 2, 1)
+
+
+def test_changed_output_is_diffed_against_the_previous_one():
+    history = OutputHistory(max_entries=4, max_keys=8, max_bytes=1 << 20)
+    history.record("10.0.0.1", "show interfaces", OUTPUT)
+    _, delta = history.record("10.0.0.1", "show interfaces", OUTPUT.replace("ge-0/0/1   up", "ge-0/0/1   down"))
+    assert (delta.added, delta.removed, delta.unchanged) == (1, 1, 2)
+    assert "+ge-0/0/1   down" in delta.diff
+
+
+def test_oldest_entries_of_a_command_are_released():
+    history = OutputHistory(max_entries=2, max_keys=8, max_bytes=1 << 20)
+    for index in range(3):
+        history.record("10.0.0.1", "show clock", f"{index}:00\n")
+    stats = history.stats()
+    assert (stats["entries"], stats["blobs"]) == (2, 2)
+
+
+def test_least_recently_recorded_keys_are_evicted():
+    history = OutputHistory(max_entries=2, max_keys=2, max_bytes=1 << 20)
+    history.record("10.0.0.1", "show clock", "1\n")
+    history.record("10.0.0.2", "show clock", "2\n")
+    history.record("10.0.0.1", "show clock", "1\n")
+    history.record("10.0.0.3", "show clock", "3\n")
+    assert history.latest("10.0.0.2", "show clock") is None
+    assert history.latest("10.0.0.1", "show clock") is not None
+    assert history.stats()["keys"] == 2
+
+
+def test_byte_limit_evicts_keys_but_keeps_the_latest():
+    history = OutputHistory(max_entries=2, max_keys=8, max_bytes=64)
+    history.record("10.0.0.1", "show running-config", "a" * 10_000 + "\n" + "".join(map(str, range(100))))
+    history.record("10.0.0.2", "show running-config", "b" * 10_000 + "\n" + "".join(map(str, range(200))))
+    assert history.latest("10.0.0.1", "show running-config") is None
+    assert history.latest("10.0.0.2", "show running-config") is not None
@@ -0,0 +1,20 @@
+from agents import get_llm_config
+from config import SystemConfig
+from schemas import AnalysisResult
+
+
+def _thinking(llm_config) -> bool:
+    return llm_config["config_list"][0]["extra_body"]["chat_template_kwargs"]["enable_thinking"]
+
+
+def test_schema_constrained_profiles_do_not_think():
+    llm_config = get_llm_config(SystemConfig(structured_output=True), "analyze")
+    assert llm_config["response_format"] is AnalysisResult
+    assert not _thinking(llm_config)
+
+
+def test_free_form_profiles_keep_their_thinking_setting():
+    llm_config = get_llm_config(SystemConfig(structured_output=False), "analyze")
+    assert "response_format" not in llm_config
+    assert _thinking(llm_config)
+    assert not _thinking(get_llm_config(SystemConfig(), "summary"))
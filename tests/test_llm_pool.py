@@ -0,0 +1,59 @@
+import pytest
+
+import llm_client
+from config import SystemConfig
+from llm_client import NoBackendAvailableError, get_llm_pool
+from metrics import LLM_CONCURRENCY_LIMIT
+
+
+@pytest.fixture
+def pools():
+    created = []
+    yield created
+    with llm_client._pools_lock:
+        for key, pool in list(llm_client._pools.items()):
+            if pool in created:
+                del llm_client._pools[key]
+    for pool in created:
+        pool.close()
+
+
+def test_configs_differing_in_pool_settings_get_their_own_pool(pools):
+    base = SystemConfig(llm_base_url="http://127.0.0.1:9/v1", llm_health_check_interval=3600.0)
+    variants = [
+        SystemConfig(llm_base_url=base.llm_base_url, llm_health_check_interval=3600.0, **change)
+        for change in ({"llm_request_timeout": 5.0}, {"llm_failure_threshold": 9},
+                       {"llm_adaptive_concurrency": not base.llm_adaptive_concurrency},
+                       {"llm_slot_affinity": not base.llm_slot_affinity},
+                       {"llm_backend_wait_timeout": 1.0})
+    ]
+    pools.append(get_llm_pool(base))
+    for config in variants:
+        pool = get_llm_pool(config)
+        pools.append(pool)
+        assert pool is not pools[0]
+    assert get_llm_pool(SystemConfig(llm_base_url=base.llm_base_url, llm_health_check_interval=3600.0)) is pools[0]
+    assert pools[1].backends[0].http.timeout.read == 5.0
+    assert (pools[3].limiter is None) != (pools[0].limiter is None)
+
+
+def test_slots_dispatch_gives_up_after_the_backend_wait_timeout(pools):
+    config = SystemConfig(llm_backends=[{"base_url": "http://127.0.0.1:9/v1", "slots": 1}], llm_dispatch="slots",
+                          llm_backend_wait_timeout=0.05, llm_health_check_interval=3600.0)
+    pool = get_llm_pool(config)
+    pools.append(pool)
+    backend, _ = pool.acquire()
+    with pytest.raises(NoBackendAvailableError):
+        pool.acquire()
+    pool.release(backend, 0.01)
+    assert pool.acquire()[0] is backend
+
+
+def test_concurrency_limit_gauge_sums_the_registered_pools(pools):
+    before = LLM_CONCURRENCY_LIMIT.value
+    for slots in (3, 5):
+        config = SystemConfig(llm_backends=[{"base_url": f"http://127.0.0.{slots}:9/v1", "slots": slots}],
+                              llm_health_check_interval=3600.0)
+        pools.append(get_llm_pool(config))
+    assert [int(pool.limiter.limit) for pool in pools] == [3, 5]
+    assert LLM_CONCURRENCY_LIMIT.value == before + 8
@@ -0,0 +1,129 @@
+import time
+
+import pytest
+
+import poller
+import tools
+from change_queue import ChangeQueue
+from fake_device import FakeDeviceBackend, FakeDeviceSettings
+from inventory import Credentials, Device, FingerprintCache, Inventory
+from metrics import PREFETCH_LOOKUPS
+from poller import PrefetchPoller, Snapshot, SnapshotStore
+from rollout import Rollout
+
+DEVICE = Device("10.0.0.1", group="core", platform="cisco_ios")
+
+
+def _inventory() -> Inventory:
+    return Inventory([DEVICE], {"default": Credentials("user", "secret")}, FingerprintCache(None))
+
+
+def _poller(store: SnapshotStore, collector, interval: float = 60.0) -> PrefetchPoller:
+    schedule = {"core": {"commands": ["show version", "show clock"]}}
+    return PrefetchPoller(_inventory(), store, schedule, interval, concurrency=2, jitter=0.0, collector=collector)
+
+
+@pytest.fixture
+def store(monkeypatch):
+    """The process-wide snapshot store, empty for the test."""
+    store = SnapshotStore()
+    monkeypatch.setattr(poller, "_store", store)
+    return store
+
+
+def test_poll_stores_a_snapshot_per_command():
+    store = SnapshotStore()
+    prefetch = _poller(store, lambda device, params, commands: {command: f"{command} output" for command in commands})
+    assert prefetch.poll(DEVICE, ["show version", "show clock"]) == 2
+    snapshot = store.get("10.0.0.1", "SHOW  version")
+    assert snapshot.output == "show version output"
+    assert prefetch.stats()["polls"] == 1 and prefetch.stats()["errors"] == 0
+
+
+def test_failed_commands_and_polls_count_as_errors():
+    store = SnapshotStore()
+    prefetch = _poller(store, lambda device, params, commands: {"show version": "ok"})
+    assert prefetch.poll(DEVICE, ["show version", "show clock"]) == 1
+
+    def unreachable(device, params, commands):
+        raise OSError("connection refused")
+
+    prefetch.collector = unreachable
+    assert prefetch.poll(DEVICE, ["show version"]) == 0
+    assert prefetch.stats()["errors"] == 2
+
+
+def test_lookup_counts_hits_stale_snapshots_and_misses():
+    store = SnapshotStore()
+    store.put(Snapshot("10.0.0.1", "show version", "fresh", time.time(), 0.1))
+    store.put(Snapshot("10.0.0.1", "show clock", "old", time.time() - 120, 0.1))
+    before = {result: PREFETCH_LOOKUPS.labels(result=result).value for result in ("hit", "stale", "miss")}
+    assert store.lookup("10.0.0.1", "show version", max_age=60).output == "fresh"
+    assert store.lookup("10.0.0.1", "show clock", max_age=60) is None
+    assert store.lookup("10.0.0.2", "show version", max_age=60) is None
+    after = {result: PREFETCH_LOOKUPS.labels(result=result).value for result in ("hit", "stale", "miss")}
+    assert {result: after[result] - before[result] for result in after} == {"hit": 1, "stale": 1, "miss": 1}
+
+
+def test_running_poller_collects_scheduled_devices():
+    store = SnapshotStore()
+    prefetch = _poller(store, lambda device, params, commands: {command: "output" for command in commands},
+                       interval=0.2)
+    prefetch.start()
+    try:
+        deadline = time.monotonic() + 5
+        while store.get("10.0.0.1", "show clock") is None and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        prefetch.stop()
+    assert store.stats()["snapshots"] == 2
+    assert not prefetch.stats()["running"]
+
+
+def test_invalidate_drops_snapshots_and_polls_running_across_the_change():
+    store = SnapshotStore()
+    store.put(Snapshot("10.0.0.1", "show vlan", "vlan 1", time.time(), 0.1))
+    store.put(Snapshot("10.0.0.2", "show vlan", "vlan 1", time.time(), 0.1))
+
+    def changed_while_polling(device, params, commands):
+        store.invalidate(device.key)
+        return {command: "pre-change output" for command in commands}
+
+    assert store.invalidate("10.0.0.1") == 1
+    assert store.get("10.0.0.1", "show vlan") is None
+    assert store.get("10.0.0.2", "show vlan") is not None
+    _poller(store, changed_while_polling).poll(DEVICE, ["show vlan"])
+    assert store.get("10.0.0.1", "show vlan") is None
+    # Polls started after the change are kept
+    _poller(store, lambda device, params, commands: {"show vlan": "vlan 1, 10"}).poll(DEVICE, ["show vlan"])
+    assert store.get("10.0.0.1", "show vlan").output == "vlan 1, 10"
+
+
+def test_direct_set_invalidates_the_device(store):
+    store.put(Snapshot("10.0.0.1", "show vlan", "vlan 1", time.time(), 0.1))
+    backend = FakeDeviceBackend(FakeDeviceSettings()).install()
+    try:
+        tools.netmiko_set("10.0.0.1", ["vlan 10"], "user", "secret")
+    finally:
+        backend.uninstall()
+    assert backend.counters["saves"] == 1
+    assert store.get("10.0.0.1", "show vlan") is None
+
+
+def test_change_queue_invalidates_the_device(store):
+    store.put(Snapshot("10.0.0.1", "show vlan", "vlan 1", time.time(), 0.1))
+    queue = ChangeQueue(window=0.0, max_batch=4, applier=lambda host, port, params, changes: ["ok"] * len(changes))
+    params = {"username": "user", "password": "secret", "device_type": "cisco_ios"}
+    assert queue.submit("10.0.0.1", ["vlan 10"], params).result(5) == "ok"
+    assert store.get("10.0.0.1", "show vlan") is None
+
+
+def test_rollout_invalidates_every_changed_device(store):
+    devices = [Device(f"10.0.0.{index}", platform="cisco_ios") for index in (1, 2)]
+    for device in devices:
+        store.put(Snapshot(device.key, "show vlan", "vlan 1", time.time(), 0.1))
+    inventory = Inventory(devices, {"default": Credentials("user", "secret")}, FingerprintCache(None))
+    rollout = Rollout(devices, ["vlan 10"], inventory, canary=0, parallelism=1, wave_size=2, max_error_rate=0.5,
+                      applier=lambda device, params, commands: "ok")
+    list(rollout.run())
+    assert store.stats()["snapshots"] == 0
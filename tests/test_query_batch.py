@@ -0,0 +1,103 @@
+import threading
+import time
+
+import change_queue
+import tools
+from change_queue import ChangeQueue, batched_changes
+from device_limits import get_device_limiter
+from device_sessions import using_device_sessions
+from query_batch import DeviceSessions
+
+PARAMS = {"username": "user", "password": "secret", "device_type": "cisco_ios"}
+
+
+class _Agent:
+    def __init__(self, calls):
+        self.calls = calls
+        self.closed = False
+
+    def execute_show(self, command: str) -> str:
+        self.calls.append(command)
+        time.sleep(0.05)
+        return f"output of {command}"
+
+    def disconnect(self) -> None:
+        self.closed = True
+
+
+def _sessions(idle_timeout: float):
+    calls, agents = [], []
+
+    def opener(host, port, params):
+        agents.append(_Agent(calls))
+        return agents[-1]
+
+    return DeviceSessions(idle_timeout, opener), calls, agents
+
+
+def test_concurrent_queries_share_one_show_run():
+    sessions, calls, agents = _sessions(0.0)
+    outputs = []
+    threads = [threading.Thread(target=lambda: outputs.append(
+        sessions.show("10.9.0.1", 22, PARAMS, "show  version"))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    sessions.close()
+    assert outputs == ["output of show  version"] * 4
+    assert calls == ["show  version"]
+    assert sessions.stats() == {"connects": 1, "reused": 0, "cached": 3}
+
+
+def test_idle_session_releases_its_device_slot():
+    sessions, calls, agents = _sessions(0.1)
+    sessions.show("10.9.0.2", 22, PARAMS, "show version")
+    sessions.show("10.9.0.2", 22, PARAMS, "show clock")
+    assert len(agents) == 1 and not agents[0].closed
+    assert get_device_limiter().stats()["10.9.0.2"]["active_sessions"] == 1
+    time.sleep(0.3)
+    assert agents[0].closed
+    assert get_device_limiter().stats()["10.9.0.2"]["active_sessions"] == 0
+    # The next command opens a new session
+    sessions.show("10.9.0.2", 22, PARAMS, "show users")
+    sessions.close()
+    assert len(agents) == 2 and agents[1].closed
+    assert sessions.stats()["connects"] == 2
+
+
+def test_zero_idle_timeout_closes_when_nothing_is_in_flight():
+    sessions, calls, agents = _sessions(0.0)
+    sessions.show("10.9.0.3", 22, PARAMS, "show version")
+    assert agents[0].closed
+    assert get_device_limiter().stats()["10.9.0.3"]["active_sessions"] == 0
+
+
+def test_set_in_the_batch_drops_the_device_outputs():
+    sessions, calls, _ = _sessions(0.0)
+    sessions.show("10.9.0.1", 22, PARAMS, "show vlan")
+    sessions.show("10.9.0.2", 22, PARAMS, "show vlan")
+    previous = change_queue._queue
+    change_queue.configure_change_queue(
+        ChangeQueue(0.0, 4, applier=lambda host, port, params, changes: ["ok"] * len(changes)))
+    try:
+        with using_device_sessions(sessions), batched_changes():
+            tools.netmiko_set("10.9.0.1", ["vlan 10"], "user", "secret")
+    finally:
+        change_queue._queue = previous
+    sessions.show("10.9.0.1", 22, PARAMS, "show vlan")
+    sessions.show("10.9.0.2", 22, PARAMS, "show vlan")
+    assert calls == ["show vlan", "show vlan", "show vlan"]
+    assert sessions.stats()["cached"] == 1
+
+
+def test_output_of_a_show_running_across_a_change_is_not_shared():
+    sessions, calls, _ = _sessions(0.0)
+    thread = threading.Thread(target=sessions.show, args=("10.9.0.1", 22, PARAMS, "show vlan"))
+    thread.start()
+    while not calls:
+        time.sleep(0.001)
+    sessions.invalidate("10.9.0.1")
+    thread.join(5)
+    sessions.show("10.9.0.1", 22, PARAMS, "show vlan")
+    assert calls == ["show vlan", "show vlan"]
@@ -0,0 +1,51 @@
+import time
+
+import pytest
+
+from result_store import HANDLE_PREFIX, ResultStore
+
+
+def test_small_results_stay_in_memory(tmp_path):
+    store = ResultStore(memory_limit=1000, spill_threshold=500, spill_dir=str(tmp_path))
+    result = store.put("line 1\nline 2", "show", host="10.0.0.1")
+    assert result.handle.startswith(HANDLE_PREFIX)
+    assert (result.path, result.lines) == (None, 2)
+    assert store.read(result.handle) == "line 1\nline 2"
+    assert store.read(result.handle, 5, 3) == "1\nl"
+
+
+def test_large_results_spill_to_disk(tmp_path):
+    store = ResultStore(memory_limit=1000, spill_threshold=100, spill_dir=str(tmp_path))
+    output = "интерфейс up\n" * 20
+    result = store.put(output, "show")
+    assert result.data is None and result.path.exists()
+    assert store.read(result.handle) == output
+    assert b"".join(store.iter_bytes(result.handle, chunk_bytes=7)).decode("utf-8") == output
+    assert store.stats()["disk_bytes"] == len(output.encode("utf-8"))
+
+
+def test_oldest_results_spill_once_memory_is_full(tmp_path):
+    store = ResultStore(memory_limit=100, spill_threshold=1000, spill_dir=str(tmp_path))
+    first = store.put("a" * 60, "show")
+    second = store.put("b" * 60, "show")
+    assert first.path is not None and second.path is None
+    assert store.stats()["memory_bytes"] == 60
+    assert store.read(first.handle) == "a" * 60
+
+
+def test_expired_results_are_dropped_with_their_files(tmp_path):
+    store = ResultStore(memory_limit=1000, spill_threshold=10, spill_dir=str(tmp_path), ttl=0.05)
+    result = store.put("x" * 100, "show")
+    time.sleep(0.1)
+    with pytest.raises(KeyError):
+        store.read(result.handle)
+    assert not result.path.exists()
+    assert store.stats()["disk_bytes"] == 0
+
+
+def test_delete_removes_the_spill_file(tmp_path):
+    store = ResultStore(memory_limit=1000, spill_threshold=10, spill_dir=str(tmp_path))
+    result = store.put("x" * 100, "show")
+    store.delete(result.handle)
+    assert store.info(result.handle) is None
+    assert not result.path.exists()
@@ -0,0 +1,84 @@
+import threading
+from typing import Any, Dict, List
+
+import pytest
+
+import inventory
+from config import SystemConfig
+from inventory import Credentials, Device, FingerprintCache, Inventory
+from rollout import Rollout, RolloutBusyError
+
+
+def _devices(count: int) -> List[Device]:
+    return [Device(f"10.0.0.{index}", platform="cisco_ios") for index in range(1, count + 1)]
+
+
+def _rollout(devices: List[Device], failing: set, **limits: Any):
+    applied = []
+    lock = threading.Lock()
+
+    def applier(device: Device, params: Dict[str, Any], commands: List[str]) -> str:
+        with lock:
+            applied.append(device.host)
+        return "% Invalid input detected" if device.host in failing else "ok"
+
+    inventory = Inventory(devices, {"default": Credentials("user", "secret")}, FingerprintCache(None))
+    settings = {"canary": 0, "parallelism": 1, "wave_size": 2, "max_error_rate": 0.25, **limits}
+    return Rollout(devices, ["ntp server 10.0.0.100"], inventory, applier=applier, **settings), applied
+
+
+def test_waves_start_with_single_device_canaries():
+    rollout, _ = _rollout(_devices(7), set(), canary=2, wave_size=3)
+    assert [len(wave) for wave in rollout.waves()] == [1, 1, 3, 2]
+
+
+def test_failed_canary_halts_the_rollout():
+    rollout, applied = _rollout(_devices(5), {"10.0.0.1"}, canary=1)
+    events = list(rollout.run())
+    assert applied == ["10.0.0.1"]
+    assert events[-1]["event"] == "halted"
+    assert events[-1]["reason"] == "canary 10.0.0.1 failed"
+    assert (events[-1]["failed"], events[-1]["skipped"]) == (1, 4)
+
+
+def test_error_rate_over_budget_halts_the_rollout():
+    rollout, applied = _rollout(_devices(8), {"10.0.0.1", "10.0.0.3", "10.0.0.4"})
+    events = list(rollout.run())
+    assert applied == ["10.0.0.1", "10.0.0.2", "10.0.0.3", "10.0.0.4"]
+    assert events[-1]["event"] == "halted"
+    assert events[-1]["reason"].startswith("error rate 3/4")
+    assert (events[-1]["ok"], events[-1]["failed"], events[-1]["skipped"]) == (1, 3, 4)
+
+
+def test_failures_within_budget_do_not_halt():
+    rollout, applied = _rollout(_devices(8), {"10.0.0.5"})
+    events = list(rollout.run())
+    assert len(applied) == 8
+    assert events[-1]["event"] == "done"
+    assert (events[-1]["ok"], events[-1]["failed"], events[-1]["skipped"]) == (7, 1, 0)
+
+
+def test_rollouts_over_max_concurrent_are_refused_until_one_ends():
+    first, _ = _rollout(_devices(2), set(), max_concurrent=1)
+    second, applied = _rollout(_devices(2), set(), max_concurrent=1)
+    running = first.run()
+    assert next(running)["event"] == "start"
+    with pytest.raises(RolloutBusyError):
+        next(second.run())
+    running.close()
+    assert list(second.run())[-1]["event"] == "done"
+    assert len(applied) == 2
+
+
+def test_from_request_rejects_parallelism_over_the_max():
+    previous = inventory._inventory
+    inventory.configure_inventory(Inventory(_devices(2), {"default": Credentials("user", "secret")},
+                                            FingerprintCache(None)))
+    try:
+        config = SystemConfig(rollout_parallelism=2, rollout_max_parallelism=4, rollout_max_concurrent=2)
+        rollout = Rollout.from_request(config, ["ntp server 10.0.0.100"], ["10.0.0.1", "10.0.0.2"], parallelism=4)
+        assert (rollout.parallelism, rollout.max_concurrent) == (4, 2)
+        with pytest.raises(ValueError):
+            Rollout.from_request(config, ["ntp server 10.0.0.100"], ["10.0.0.1"], parallelism=5)
+    finally:
+        inventory.configure_inventory(previous)
@@ -0,0 +1,96 @@
+import threading
+import time
+
+import pytest
+
+from scheduler import JobGroup, JobScheduler, Priority, QueueFullError
+
+
+@pytest.fixture
+def scheduler():
+    scheduler = JobScheduler(workers=2, max_queue=8, retry_after=1)
+    yield scheduler
+    scheduler.shutdown()
+
+
+def test_group_runs_every_call_within_its_limit(scheduler):
+    group = JobGroup(scheduler, limit=2)
+    running, peak, lock = [0], [0], threading.Lock()
+
+    def call(index: int) -> int:
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.02)
+        with lock:
+            running[0] -= 1
+        return index
+
+    for index in range(6):
+        group.submit(lambda index=index: call(index))
+    group.start()
+    assert sorted(group.results()) == list(range(6))
+    assert peak[0] == 2
+
+
+def test_interactive_jobs_overtake_queued_group_calls(scheduler):
+    order = []
+    release = threading.Event()
+    blockers = [scheduler.submit(lambda: release.wait(5) and ()) for _ in range(2)]
+    group = JobGroup(scheduler, limit=2)
+    for index in range(2):
+        group.submit(lambda index=index: order.append(f"batch {index}"))
+    group.start()
+    interactive = scheduler.submit(lambda: order.append("interactive") or (), Priority.INTERACTIVE)
+    release.set()
+    list(interactive.stream())
+    list(group.results())
+    for job in blockers:
+        list(job.stream())
+    assert order[0] == "interactive"
+
+
+def test_cancel_drops_calls_that_have_not_started(scheduler):
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def slow():
+        started.set()
+        release.wait(5)
+        return "slow"
+
+    group = JobGroup(scheduler, limit=1)
+    group.submit(slow)
+    group.submit(lambda: calls.append("dropped"))
+    group.start()
+    started.wait(5)
+    group.cancel()
+    release.set()
+    assert list(group.results()) == ["slow"]
+    assert calls == []
+
+
+def test_start_raises_when_the_scheduler_has_no_room():
+    scheduler = JobScheduler(workers=1, max_queue=1, retry_after=1)
+    release = threading.Event()
+    try:
+        scheduler.submit(lambda: release.wait(5) and ())
+        while scheduler.stats()["active"] < 1:
+            time.sleep(0.001)
+        scheduler.submit(lambda: ())
+        group = JobGroup(scheduler, limit=1)
+        group.submit(lambda: None)
+        with pytest.raises(QueueFullError):
+            group.start()
+    finally:
+        release.set()
+        scheduler.shutdown()
+
+
+def test_call_errors_reach_the_consumer(scheduler):
+    group = JobGroup(scheduler, limit=1)
+    group.submit(lambda: 1 / 0)
+    group.start()
+    with pytest.raises(ZeroDivisionError):
+        list(group.results())
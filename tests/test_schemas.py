@@ -0,0 +1,35 @@
+import pytest
+
+from schemas import AnalysisResult, CommandDecision, parse_model
+
+DECISION = '{"command": "show version", "command_type": "show"}'
+
+
+def test_schema_constrained_reply():
+    assert parse_model(CommandDecision, DECISION) == CommandDecision(command="show version", command_type="show")
+
+
+def test_reasoning_and_termination_word_are_ignored():
+    reply = f"<think>the user wants the version</think>\n{DECISION}\nTERMINATE"
+    assert parse_model(CommandDecision, reply).command == "show version"
+
+
+def test_json_object_is_found_in_free_text():
+    reply = f"Выполню команду:\n```json\n{DECISION}\n```\nГотово."
+    assert parse_model(CommandDecision, reply).command_type == "show"
+
+
+def test_list_of_configuration_lines():
+    reply = '{"command": ["interface ge-0/0/1", "shutdown"], "command_type": "set"}'
+    assert parse_model(CommandDecision, reply).command == ["interface ge-0/0/1", "shutdown"]
+
+
+def test_mismatching_reply_names_the_field():
+    with pytest.raises(ValueError, match="status"):
+        parse_model(AnalysisResult, 'Итог: {"status": "fine", "summary": "ok", "issues": [], "recommendations": []}')
+
+
+@pytest.mark.parametrize("reply", ["", "<think>...</think>", "TERMINATE", "no json here"])
+def test_replies_without_an_object_are_rejected(reply):
+    with pytest.raises(ValueError):
+        parse_model(CommandDecision, reply)
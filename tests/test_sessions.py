@@ -0,0 +1,48 @@
+import threading
+import time
+
+from sessions import SessionStore
+
+
+def _save(store: SessionStore, session_id: str, output: str = "output", query: str = "q") -> None:
+    store.save(session_id, {"ip": "10.0.0.1", "command": "show version", "command_type": "show",
+                            "execute_result": output, "result_at": time.time()}, "{}", query)
+
+
+def test_save_updates_the_record_and_trims_history():
+    store = SessionStore(ttl=60, max_sessions=4, max_bytes=10_000, max_history=2)
+    store.get("s1")
+    for index in range(3):
+        _save(store, "s1", query=f"q{index}")
+    record = store.get("s1")
+    assert record.queries == ["q1", "q2"]
+    assert record.result_for("10.0.0.1", "show version", max_age=60) == "output"
+    assert store.stats()["bytes"] == record.size
+
+
+def test_least_recently_used_session_is_evicted():
+    store = SessionStore(ttl=60, max_sessions=2, max_bytes=10_000)
+    _save(store, "s1")
+    _save(store, "s2")
+    store.get("s1")
+    _save(store, "s3")
+    assert store.stats()["sessions"] == 2
+    assert store.get("s1").ip == "10.0.0.1"
+    assert store.get("s2").ip is None
+
+
+def test_concurrent_saves_keep_the_byte_count_consistent():
+    store = SessionStore(ttl=60, max_sessions=4, max_bytes=1_000_000, max_history=3)
+
+    def run(index: int) -> None:
+        for step in range(200):
+            _save(store, f"s{index % 2}", output="x" * (step % 50), query=str(step))
+
+    threads = [threading.Thread(target=run, args=(index,)) for index in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    records = [store.get("s0"), store.get("s1")]
+    assert all(len(record.queries) == 3 for record in records)
+    assert store.stats()["bytes"] == sum(record.size for record in records)
@@ -0,0 +1,83 @@
+from typing import Any, List
+
+import pytest
+
+import DoNetAgent
+from DoNetAgent import NetAgent
+
+SUB_MODES = ("interface", "router", "vlan")
+
+
+class ModalConnection:
+    """Connection that tracks the configuration mode like an IOS CLI."""
+
+    def __init__(self, **device: Any):
+        self.mode = "exec"
+        self.applied: List[tuple] = []
+        self.events: List[str] = []
+
+    def enable(self) -> str:
+        return ""
+
+    def config_mode(self) -> str:
+        self.mode = "config"
+        return ""
+
+    def exit_config_mode(self) -> str:
+        self.mode = "exec"
+        return ""
+
+    def send_config_set(self, commands: List[str], exit_config_mode: bool = True) -> str:
+        assert self.mode != "exec", "configuration commands sent outside config mode"
+        output = []
+        for command in commands:
+            self.applied.append((self.mode, command))
+            if command.startswith("bad"):
+                output.append("% Invalid input detected at '^' marker.")
+            elif command.split()[0] in SUB_MODES:
+                self.mode = f"config-{command.split()[0]}"
+            else:
+                output.append(f"({self.mode})# {command}")
+        return "\n".join(output)
+
+    def commit(self) -> str:
+        raise AttributeError("no commit on cisco_ios")
+
+    def save_config(self) -> str:
+        self.events.append("save")
+        return ""
+
+    def disconnect(self) -> None:
+        pass
+
+
+@pytest.fixture
+def connection():
+    connections = []
+
+    def factory(**device: Any) -> ModalConnection:
+        connections.append(ModalConnection(**device))
+        return connections[-1]
+
+    DoNetAgent.configure_connection_factory(factory)
+    yield lambda: connections[-1]
+    DoNetAgent.configure_connection_factory(None)
+
+
+def test_each_set_starts_from_global_config(connection):
+    agent = NetAgent(host="10.0.0.1", username="user", password="secret")
+    outputs = agent.execute_set_batch([["interface Gi0/1", "description uplink"], ["hostname core-1"]])
+    assert connection().applied == [("config", "interface Gi0/1"), ("config-interface", "description uplink"),
+                                    ("config", "hostname core-1")]
+    assert outputs[1] == "(config)# hostname core-1"
+    assert connection().events == ["save"]
+
+
+def test_failed_set_stops_the_batch_before_save(connection):
+    agent = NetAgent(host="10.0.0.1", username="user", password="secret")
+    outputs = agent.execute_set_batch([["hostname core-1"], ["bad command"], ["ntp server 10.0.0.100"]])
+    assert [command for _, command in connection().applied] == ["hostname core-1", "bad command"]
+    assert connection().events == []
+    assert outputs[0].startswith("Error executing set commands: not persisted, change set 2")
+    assert "% Invalid input" in outputs[1]
+    assert outputs[2].endswith("this set was not sent")
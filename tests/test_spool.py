@@ -0,0 +1,41 @@
+import pytest
+
+from spool import SpooledOutput
+
+# Two-byte characters and no line ends: every odd chunk size cuts a character
+CYRILLIC = "интерфейс" * 50
+
+
+@pytest.mark.parametrize("threshold", [1 << 20, 16])
+def test_chunks_never_split_a_character(threshold):
+    with SpooledOutput.from_text(CYRILLIC, threshold) as output:
+        assert output.spooled == (threshold == 16)
+        chunks = list(output.iter_text(chunk_bytes=7))
+        assert "".join(chunks) == CYRILLIC
+        assert all("�" not in chunk for chunk in chunks)
+
+
+def test_chunks_end_at_line_ends():
+    text = "".join(f"ge-0/0/{index} интерфейс up\n" for index in range(40))
+    with SpooledOutput.from_text(text, threshold=64) as output:
+        chunks = list(output.iter_text(chunk_bytes=100))
+        assert "".join(chunks) == text
+        assert all(chunk.endswith("\n") for chunk in chunks)
+        assert all(len(chunk.encode("utf-8")) <= 100 for chunk in chunks)
+
+
+def test_head_cuts_at_a_line_end():
+    with SpooledOutput.from_text("первая строка\nвторая строка\n", threshold=8) as output:
+        assert output.head(30) == "первая строка\n"
+        assert output.lines == 3
+
+
+def test_output_moves_to_a_file_past_the_threshold(tmp_path):
+    output = SpooledOutput(threshold=10, spool_dir=str(tmp_path))
+    output.write("12345")
+    assert not output.spooled
+    output.write("67890abc")
+    assert output.spooled
+    assert output.text() == "1234567890abc"
+    output.close()
+    assert output.size == 0
@@ -1,7 +1,15 @@
 import logging
 import subprocess
-from typing import List, Optional
+from typing import Callable, List, Optional
 from DoNetAgent import NetAgent  # Import NetAgent class
+from device_limits import get_device_limiter
+from inventory import device_key
+from result_store import get_result_store
+from change_queue import changes_batched, get_change_queue
+from poller import get_snapshot_store
+from ssh_probe import probe_ssh_port
+from device_sessions import current_device_sessions
+from tracing import traced
 
 logger = logging.getLogger(__name__)
 
@@ -34,6 +42,19 @@ def _run_subprocess(command: List[str], host: str) -> subprocess.CompletedProces
         logger.error(f"Subprocess error for command {command} on host {host}: {str(e)}")
         raise
 
+# Runner used by ping_host; stand-ins (e.g. fake_device) replace it in benchmarks
+_ping_runner: Callable[[List[str], str], subprocess.CompletedProcess] = _run_subprocess
+
+def configure_ping_runner(runner: Optional[Callable[[List[str], str], subprocess.CompletedProcess]]) -> None:
+    """Replaces the runner executing the ping command.
+
+    Args:
+        runner (Optional[Callable]): Callable with the signature of _run_subprocess; None restores it.
+    """
+    global _ping_runner
+    _ping_runner = runner or _run_subprocess
+
+@traced("tool.ping_host")
 def ping_host(host: str) -> str:
     """Checks the availability of a host using the ping command.
 
@@ -44,7 +65,7 @@ def ping_host(host: str) -> str:
         str: A message indicating whether the host is reachable or not, or an error message.
     """
     try:
-        result = _run_subprocess(PING_COMMAND, host)
+        result = _ping_runner(PING_COMMAND, host)
         if result.returncode == 0:
             logger.info(f"Host {host} is reachable.")
             return f"Host {host} is reachable."
@@ -54,6 +75,28 @@ def ping_host(host: str) -> str:
         logger.error(f"Ping error for host {host}: {str(e)}")
         return f"Ping error: {str(e)}"
 
+@traced("tool.ssh_probe")
+def ssh_probe(host: str, port: int = 22) -> str:
+    """Checks the availability of a host by connecting to its SSH port.
+
+    Works where ICMP is filtered; the connection is reused by the next netmiko_show or
+    netmiko_set on the host.
+
+    Args:
+        host (str): The IP address or hostname to check.
+        port (int): SSH port (default 22).
+
+    Returns:
+        str: A message indicating whether the SSH port is reachable or not.
+    """
+    result = probe_ssh_port(host, port)
+    if result.reachable:
+        logger.info(f"Host {host} is reachable on SSH port {port}.")
+    else:
+        logger.warning(f"Host {host} is unreachable on SSH port {port}: {result.error}")
+    return result.describe()
+
+@traced("tool.port_scan")
 def port_scan(host: str) -> str:
     """Scans ports on a host using nmap.
 
@@ -88,7 +131,18 @@ def simulate_port_scan(host: str) -> str:
     logger.info(f"Simulating port scan for {host}")
     return f'{{"host": "{host}", "open_ports": [22, 80, 443], "scan_time": "2025-09-11T12:00:00Z"}}'
 
-def netmiko_show(host: str, command: str, username: str, password: str, device_type: str = 'cisco_ios') -> str:
+def _store_output(output: str, kind: str, **meta) -> str:
+    """Keeps a device output in the result store and returns its envelope for the LLM.
+
+    Error messages are returned as they are, so the agent can report them.
+    """
+    if output.startswith("Error executing"):
+        return output
+    store = get_result_store()
+    return store.envelope(store.put(output, kind, **meta), output)
+
+@traced("tool.netmiko_show")
+def netmiko_show(host: str, command: str, username: str, password: str, device_type: str = 'cisco_ios', port: int = 22) -> str:
     """Execute a show command on the network device using Netmiko.
 
     Args:
@@ -97,37 +151,69 @@ def netmiko_show(host: str, command: str, username: str, password: str, device_t
         username (str): Username for authentication.
         password (str): Password for authentication.
         device_type (str): Device type (default 'cisco_ios').
+        port (int): SSH port (default 22).
 
     Returns:
-        str: The output from the command or error message.
+        str: JSON with the handle of the stored output and its first lines, or an error message.
     """
     try:
-        agent = NetAgent(host=host, username=username, password=password, device_type=device_type)
-        result = agent.execute_show(command)
-        agent.disconnect()
-        return result
+        sessions = current_device_sessions()
+        if sessions is not None:
+            # Part of a query batch: the device session and the output are shared with its other queries
+            params = {"username": username, "password": password, "device_type": device_type}
+            result = sessions.show(host, port, params, command)
+        else:
+            limiter = get_device_limiter()
+            with limiter.session(device_key(host, port), device_type) as ticket:
+                agent = NetAgent(host=host, username=username, password=password, device_type=device_type, port=port)
+                try:
+                    with limiter.command(ticket):
+                        result = agent.execute_show(command)
+                finally:
+                    agent.disconnect()
+        return _store_output(result, "show", host=device_key(host, port), command=command)
     except Exception as e:
         logger.error(f"Netmiko show error for {host}: {str(e)}")
         return f"Error executing show command: {str(e)}"
 
-def netmiko_set(host: str, commands: List[str], username: str, password: str, device_type: str = 'cisco_ios') -> str:
+@traced("tool.netmiko_set")
+def netmiko_set(host: str, commands: List[str], username: str, password: str, device_type: str = 'cisco_ios', port: int = 22) -> str:
     """Execute set commands on the network device using Netmiko.
 
+    Changes are applied at once. Inside `batched_changes` (query batches), changes to the same
+    device arriving within a short window are applied together, with a single commit and save;
+    the result covers only these commands.
+
     Args:
         host (str): The IP address or hostname.
         commands (List[str]): List of configuration commands.
         username (str): Username for authentication.
         password (str): Password for authentication.
         device_type (str): Device type (default 'cisco_ios').
+        port (int): SSH port (default 22).
 
     Returns:
-        str: The output from the commands or error message.
+        str: JSON with the handle of the stored output and its first lines, or an error message.
     """
     try:
-        agent = NetAgent(host=host, username=username, password=password, device_type=device_type)
-        result = agent.execute_set(commands)
-        agent.disconnect()
-        return result
+        if changes_batched():
+            params = {"username": username, "password": password, "device_type": device_type}
+            result = get_change_queue().submit(host, commands, params, port=port).result()
+            sessions = current_device_sessions()
+            if sessions is not None:
+                # Later shows of the batch must not get the pre-change output
+                sessions.invalidate(host, port)
+        else:
+            limiter = get_device_limiter()
+            with limiter.session(device_key(host, port), device_type) as ticket:
+                agent = NetAgent(host=host, username=username, password=password, device_type=device_type, port=port)
+                try:
+                    with limiter.command(ticket):
+                        result = agent.execute_set(commands)
+                finally:
+                    agent.disconnect()
+                    get_snapshot_store().invalidate(device_key(host, port))
+        return _store_output(result, "set", host=device_key(host, port), commands=len(commands))
     except Exception as e:
         logger.error(f"Netmiko set error for {host}: {str(e)}")
-        return f"Error executing set commands: {str(e)}"
\ No newline at end of file
+        return f"Error executing set commands: {str(e)}"
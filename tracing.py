@@ -0,0 +1,291 @@
+import contextvars
+import functools
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Generator, List, Optional
+
+import requests
+
+from config import SystemConfig
+
+logger = logging.getLogger(__name__)
+
+SERVICE_NAME = "netagents"
+OTLP_TIMEOUT_SECONDS = 5
+
+_current_span: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    """A timed operation within a trace."""
+
+    def __init__(self, trace: "Trace", name: str, parent: Optional["Span"], attributes: Dict[str, Any]):
+        self.trace = trace
+        self.name = name
+        self.span_id = os.urandom(8).hex()
+        self.parent = parent
+        self.attributes = dict(attributes)
+        self.thread_id = threading.get_ident()
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.error: Optional[str] = None
+
+    @property
+    def duration(self) -> float:
+        """Span duration in seconds (up to now if the span is still open)."""
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e9
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def finish(self, error: Optional[str] = None) -> None:
+        """Ends the span and makes its parent the current span again; repeated calls are ignored."""
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.time_ns()
+        if error:
+            self.error = error
+        if _current_span.get() is self:
+            _current_span.set(self.parent)
+
+
+class Trace:
+    """All spans recorded for a single pipeline run."""
+
+    def __init__(self, trace_id: Optional[str] = None):
+        self.trace_id = trace_id or uuid.uuid4().hex
+        self.spans: List[Span] = []
+        self._lock = threading.Lock()
+
+    def add(self, span: Span) -> None:
+        with self._lock:
+            self.spans.append(span)
+
+
+def begin_span(name: str, **attributes: Any) -> Optional[Span]:
+    """Starts a span as a child of the current span and makes it current.
+
+    Returns:
+        Optional[Span]: The new span, or None if no trace is active.
+    """
+    parent = _current_span.get()
+    if parent is None:
+        return None
+    span = Span(parent.trace, name, parent, attributes)
+    parent.trace.add(span)
+    _current_span.set(span)
+    return span
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Generator[Optional[Span], None, None]:
+    """Records the block as a span of the active trace; a no-op outside of a trace."""
+    current = begin_span(name, **attributes)
+    if current is None:
+        yield None
+        return
+    try:
+        yield current
+    except Exception as e:
+        current.finish(error=str(e))
+        raise
+    finally:
+        current.finish()
+
+
+def traced(name: Optional[str] = None) -> Callable:
+    """Decorator recording every call of the function as a span."""
+
+    def decorator(func: Callable) -> Callable:
+        span_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def current_trace_id() -> Optional[str]:
+    """Returns the id of the active trace, if any."""
+    current = _current_span.get()
+    return current.trace.trace_id if current else None
+
+
+@contextmanager
+def start_trace(name: str, trace_id: Optional[str] = None, **attributes: Any) -> Generator[Trace, None, None]:
+    """Starts a new trace with a root span and exports it when the block exits.
+
+    Args:
+        name (str): Name of the root span.
+        trace_id (Optional[str]): 32-character hex trace id; generated when omitted.
+        **attributes: Attributes of the root span.
+
+    Yields:
+        Trace: The trace being recorded.
+    """
+    trace = Trace(trace_id)
+    root = Span(trace, name, None, attributes)
+    trace.add(root)
+    previous = _current_span.get()
+    _current_span.set(root)
+    try:
+        yield trace
+    except Exception as e:
+        root.finish(error=str(e))
+        raise
+    finally:
+        for open_span in trace.spans:
+            open_span.finish()
+        _current_span.set(previous)
+        try:
+            get_exporter().export(trace)
+        except Exception as e:
+            logger.error(f"Failed to export trace {trace.trace_id}: {str(e)}")
+
+
+class TraceExporter:
+    """Base class for trace exporters; the default implementation discards traces."""
+
+    def export(self, trace: Trace) -> None:
+        pass
+
+
+class ChromeTraceExporter(TraceExporter):
+    """Writes each trace to `<directory>/trace_<id>.json` in the Chrome trace event format.
+
+    The files open in chrome://tracing or https://ui.perfetto.dev as per-request waterfalls.
+    """
+
+    def __init__(self, directory: str, max_files: int = 200):
+        self.directory = Path(directory)
+        self.max_files = max_files
+
+    def export(self, trace: Trace) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        events = []
+        for item in trace.spans:
+            args = dict(item.attributes)
+            if item.error:
+                args["error"] = item.error
+            events.append({
+                "name": item.name,
+                "cat": item.name.split(".")[0],
+                "ph": "X",
+                "ts": item.start_ns / 1000,
+                "dur": (item.end_ns - item.start_ns) / 1000,
+                "pid": os.getpid(),
+                "tid": item.thread_id,
+                "args": {key: value if isinstance(value, (int, float, bool)) else str(value) for key, value in args.items()},
+            })
+        path = self.directory / f"trace_{trace.trace_id}.json"
+        path.write_text(json.dumps({"traceEvents": events, "displayTimeUnit": "ms"}, ensure_ascii=False))
+        logger.info(f"Trace {trace.trace_id} written to {path}")
+        self._rotate()
+
+    def _rotate(self) -> None:
+        files = sorted(self.directory.glob("trace_*.json"), key=lambda p: p.stat().st_mtime)
+        for old in files[:-self.max_files]:
+            old.unlink(missing_ok=True)
+
+
+class OTLPJsonExporter(TraceExporter):
+    """Posts traces to an OTLP/HTTP collector (e.g. `http://localhost:4318/v1/traces`) as OTLP JSON.
+
+    Export runs on a background thread so a slow collector never delays the pipeline.
+    """
+
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+
+    @staticmethod
+    def _attributes(values: Dict[str, Any]) -> List[Dict[str, Any]]:
+        attributes = []
+        for key, value in values.items():
+            if isinstance(value, bool):
+                attributes.append({"key": key, "value": {"boolValue": value}})
+            elif isinstance(value, int):
+                attributes.append({"key": key, "value": {"intValue": str(value)}})
+            elif isinstance(value, float):
+                attributes.append({"key": key, "value": {"doubleValue": value}})
+            else:
+                attributes.append({"key": key, "value": {"stringValue": str(value)}})
+        return attributes
+
+    def payload(self, trace: Trace) -> Dict[str, Any]:
+        """Builds the OTLP JSON `ExportTraceServiceRequest` body for a trace."""
+        spans = []
+        for item in trace.spans:
+            otlp_span = {
+                "traceId": trace.trace_id,
+                "spanId": item.span_id,
+                "name": item.name,
+                "kind": 1,
+                "startTimeUnixNano": str(item.start_ns),
+                "endTimeUnixNano": str(item.end_ns),
+                "attributes": self._attributes(item.attributes),
+                "status": {"code": 2, "message": item.error} if item.error else {"code": 1},
+            }
+            if item.parent is not None:
+                otlp_span["parentSpanId"] = item.parent.span_id
+            spans.append(otlp_span)
+        return {
+            "resourceSpans": [{
+                "resource": {"attributes": self._attributes({"service.name": SERVICE_NAME})},
+                "scopeSpans": [{"scope": {"name": SERVICE_NAME}, "spans": spans}],
+            }]
+        }
+
+    def export(self, trace: Trace) -> None:
+        threading.Thread(target=self._post, args=(self.payload(trace), trace.trace_id), daemon=True).start()
+
+    def _post(self, payload: Dict[str, Any], trace_id: str) -> None:
+        try:
+            response = requests.post(self.endpoint, json=payload, timeout=OTLP_TIMEOUT_SECONDS)
+            response.raise_for_status()
+        except requests.RequestException as e:
+            logger.warning(f"OTLP export of trace {trace_id} to {self.endpoint} failed: {str(e)}")
+
+
+_exporter: Optional[TraceExporter] = None
+_exporter_lock = threading.Lock()
+
+
+def exporter_from_config(config: SystemConfig) -> TraceExporter:
+    """Builds the trace exporter selected by `config.trace_exporter`.
+
+    Raises:
+        ValueError: If the exporter name is unknown.
+    """
+    if config.trace_exporter == "chrome":
+        return ChromeTraceExporter(config.trace_dir, config.trace_max_files)
+    if config.trace_exporter == "otlp":
+        return OTLPJsonExporter(config.trace_otlp_endpoint)
+    if config.trace_exporter == "none":
+        return TraceExporter()
+    raise ValueError(f"Unknown trace exporter: {config.trace_exporter}")
+
+
+def configure_tracing(exporter: TraceExporter) -> None:
+    """Replaces the process-wide trace exporter."""
+    global _exporter
+    with _exporter_lock:
+        _exporter = exporter
+
+
+def get_exporter() -> TraceExporter:
+    """Returns the process-wide trace exporter, creating it from SystemConfig defaults if needed."""
+    global _exporter
+    with _exporter_lock:
+        if _exporter is None:
+            _exporter = exporter_from_config(SystemConfig())
+        return _exporter